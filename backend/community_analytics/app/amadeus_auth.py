@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+AMADEUS_TOKEN_URL = "https://test.api.amadeus.com/v1/security/oauth2/token"
+
+
+def _request_token() -> Tuple[str, float]:
+    """POST client_credentials to Amadeus; returns (access_token, expires_in seconds)."""
+    import requests  # local import
+
+    r = requests.post(
+        AMADEUS_TOKEN_URL,
+        data={
+            "grant_type": "client_credentials",
+            "client_id": os.getenv("AMADEUS_CLIENT_ID"),
+            "client_secret": os.getenv("AMADEUS_CLIENT_SECRET"),
+        },
+        timeout=15,
+    )
+    r.raise_for_status()
+    j = r.json() or {}
+    token = j.get("access_token")
+    if not token:
+        raise RuntimeError("amadeus token response without access_token")
+    return token, float(j.get("expires_in") or 1799)
+
+
+class AmadeusTokenManager:
+    """
+    Process-wide cache for the Amadeus OAuth token.
+
+    - Tokens are reused until `margin` seconds before expires_in.
+    - Inside the last `proactive` seconds of validity a hit also kicks off a background refresh;
+      the hit claims the single-flight slot before starting the thread, so at most one runs, and
+      after a failed one the next waits `retry_s`.
+    - Concurrent refreshes collapse into one request (single-flight); other callers wait for it.
+    - invalidate(token) drops a token the API rejected with 401.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Tuple[str, float]] = _request_token,
+        margin: float = 60.0,
+        proactive: float = 300.0,
+        wait_timeout: float = 20.0,
+        retry_s: float = 30.0,
+    ) -> None:
+        self._fetch = fetch
+        self.margin = margin
+        self.proactive = proactive
+        self.wait_timeout = wait_timeout
+        self.retry_s = retry_s
+        self._retry_at = 0.0  # no background refresh before this after a failure
+        self._lock = threading.Lock()
+        self._inflight: Optional[threading.Event] = None
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._owner: Optional[str] = None
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "backgroundRefreshes": 0, "invalidations": 0, "errors": 0}
+
+    def _valid(self, now: float) -> bool:
+        return bool(self._token) and now < self._expires_at - self.margin and self._owner == os.getenv("AMADEUS_CLIENT_ID")
+
+    def _cached(self) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            if not self._valid(now):
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            token = self._token
+            ev: Optional[threading.Event] = None
+            if now >= self._expires_at - self.proactive and self._inflight is None and now >= self._retry_at:
+                # Claimed here, under the lock: concurrent hits see the flight and start nothing
+                ev = self._inflight = threading.Event()
+                self._stats["backgroundRefreshes"] += 1
+        if ev is not None:
+            threading.Thread(target=self._lead, args=(ev,), daemon=True).start()
+        return token
+
+    def _refresh(self) -> Optional[str]:
+        with self._lock:
+            leader = self._inflight is None
+            if leader:
+                self._inflight = threading.Event()
+            ev = self._inflight
+        if not leader:
+            ev.wait(self.wait_timeout)
+            with self._lock:
+                return self._token if self._valid(time.monotonic()) else None
+        return self._lead(ev)
+
+    def _lead(self, ev: threading.Event) -> Optional[str]:
+        """Fetch a token as the holder of the single-flight slot `ev`, then release it."""
+        try:
+            owner = os.getenv("AMADEUS_CLIENT_ID")
+            token, expires_in = self._fetch()
+            with self._lock:
+                self._token = token
+                self._expires_at = time.monotonic() + expires_in
+                self._owner = owner
+                self._stats["refreshes"] += 1
+            return token
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+                self._retry_at = time.monotonic() + self.retry_s
+            return None
+        finally:
+            with self._lock:
+                self._inflight = None
+            ev.set()
+
+    def get_token(self) -> Optional[str]:
+        return self._cached() or self._refresh()
+
+    async def aget_token(self) -> Optional[str]:
+        token = self._cached()
+        if token:
+            return token
+        return await asyncio.to_thread(self._refresh)
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["cached"] = bool(self._token)
+            out["expiresInS"] = round(max(0.0, self._expires_at - time.monotonic()), 1) if self._token else 0.0
+        return out
+
+
+amadeus_tokens = AmadeusTokenManager()
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import datetime as dt
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .amadeus_auth import amadeus_tokens
+from .flight_providers import (
+    AMADEUS_SEARCH_URL,
+    TRAVELPAYOUTS_URL,
+    _amadeus_payload,
+    _iso_date,
+    _is_simulation,
+    _parse_amadeus,
+    _parse_travelpayouts,
+    _sorted_offers,
+    _stub_offers,
+    _travelpayouts_params,
+    offer_cache_key,
+)
+from .offer_cache import offer_cache, _is_enabled as _offer_cache_enabled
+from .provider_guard import ProviderUnavailable, check_budget_s, guards
+
+# asyncio-native counterpart of flight_providers.py. One pooled httpx.AsyncClient is shared by
+# every request in the process; each provider call runs under its own deadline and may be hedged
+# (a duplicate request is fired if the first one is slow) so the combined call costs roughly the
+# slowest provider that answers within budget instead of the sum of all timeouts.
+
+_client = None
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def provider_deadline(provider: str) -> float:
+    """Seconds a provider may take before its offers are dropped (env: <PROVIDER>_DEADLINE_S)."""
+    defaults = {"travelpayouts": 8.0, "amadeus": 10.0}
+    return _env_float(f"{provider.upper()}_DEADLINE_S", defaults.get(provider, 8.0))
+
+
+def hedge_after() -> float:
+    """Seconds to wait before firing a hedged duplicate request; 0 disables hedging."""
+    return _env_float("PROVIDER_HEDGE_AFTER_S", 2.5)
+
+
+def get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx  # local import, like requests in flight_providers
+
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(_env_float("PROVIDER_MAX_CONNECTIONS", 50)),
+                max_keepalive_connections=int(_env_float("PROVIDER_MAX_KEEPALIVE", 20)),
+            ),
+            timeout=httpx.Timeout(20.0, connect=5.0),
+        )
+    return _client
+
+
+async def aclose_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+async def _hedged(factory: Callable[[], Awaitable[Any]], deadline: float, hedge: float) -> Any:
+    """Run factory() under `deadline`; if it has not finished after `hedge` s, race a second copy."""
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    tasks = [asyncio.ensure_future(factory())]
+    last_exc: Optional[BaseException] = None
+    try:
+        if 0 < hedge < deadline:
+            done, _ = await asyncio.wait(tasks, timeout=hedge)
+            if not done:
+                tasks.append(asyncio.ensure_future(factory()))
+        while tasks:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for t in done:
+                tasks.remove(t)
+                if t.exception() is None:
+                    return t.result()
+                last_exc = t.exception()
+        if last_exc is not None and not tasks:
+            raise last_exc
+        raise asyncio.TimeoutError()
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def afetch_travelpayouts(origin: str, destination: str, date: Optional[str], currency: str = "USD", budget_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    token = os.getenv("TRAVELPAYOUTS_TOKEN")
+    marker = os.getenv("AFFILIATE_ID_TP", "MI_PARTNER_ID")
+    if _is_simulation() or not token:
+        return _stub_offers("travelpayouts", origin, destination, date, currency)
+
+    guard = guards["travelpayouts"]
+    loop = asyncio.get_running_loop()
+    end = loop.time() + min(provider_deadline("travelpayouts"), budget_s if budget_s is not None else float("inf"))
+    try:
+        await guard.abefore(budget_s)
+    except ProviderUnavailable:
+        return []
+    date_iso = _iso_date(date) or dt.date.today().isoformat()
+    params = _travelpayouts_params(origin, destination, date_iso, currency, token)
+
+    async def _call() -> Dict[str, Any]:
+        r = await get_client().get(TRAVELPAYOUTS_URL, params=params)
+        r.raise_for_status()
+        return r.json() or {}
+
+    t = loop.time()
+    try:
+        j = await _hedged(_call, max(0.0, end - loop.time()), hedge_after())
+    except Exception:
+        guard.record(False, loop.time() - t)
+        return []
+    guard.record(True, loop.time() - t)
+    return _parse_travelpayouts(j, origin, destination, date_iso, currency, marker)
+
+
+async def afetch_amadeus(origin: str, destination: str, date: Optional[str], currency: str = "USD", budget_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    client_id = os.getenv("AMADEUS_CLIENT_ID")
+    client_secret = os.getenv("AMADEUS_CLIENT_SECRET")
+    aff = os.getenv("AFFILIATE_ID_AMA", "")
+    if _is_simulation() or not (client_id and client_secret):
+        return _stub_offers("amadeus", origin, destination, date, currency)
+
+    guard = guards["amadeus"]
+    loop = asyncio.get_running_loop()
+    end = loop.time() + min(provider_deadline("amadeus"), budget_s if budget_s is not None else float("inf"))
+    try:
+        await guard.abefore(budget_s)
+    except ProviderUnavailable:
+        return []
+    date_iso = _iso_date(date) or dt.date.today().isoformat()
+    client = get_client()
+    payload = _amadeus_payload(origin, destination, date_iso, currency)
+
+    async def _call(access_token: str) -> Any:
+        headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+        r = await client.post(AMADEUS_SEARCH_URL, json=payload, headers=headers)
+        if r.status_code == 401:
+            return r
+        r.raise_for_status()
+        return r.json() or {}
+
+    t = loop.time()
+    try:
+        for attempt in range(2):
+            access_token = await asyncio.wait_for(amadeus_tokens.aget_token(), timeout=max(0.0, end - loop.time()))
+            if not access_token:
+                raise RuntimeError("no Amadeus access token")
+            j = await _hedged(lambda: _call(access_token), max(0.0, end - loop.time()), hedge_after())
+            if isinstance(j, dict):
+                break
+            # 401: token was revoked/expired upstream; drop it and retry once with a fresh one
+            amadeus_tokens.invalidate(access_token)
+            if attempt == 1:
+                j.raise_for_status()
+    except Exception:
+        guard.record(False, loop.time() - t)
+        return []
+    guard.record(True, loop.time() - t)
+    return _parse_amadeus(j, origin, destination, date_iso, currency, aff)
+
+
+async def _cached(provider: str, fn, origin: str, destination: str, date: Optional[str], currency: str, budget_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    if not _offer_cache_enabled():
+        return await fn(origin, destination, date, currency, budget_s=budget_s)
+    key = offer_cache_key(provider, origin, destination, date, currency)
+    return await offer_cache.aget_or_fetch(key, lambda: fn(origin, destination, date, currency, budget_s=budget_s))
+
+
+async def afetch_from_providers(origin: str, destination: str, date: Optional[str], currency: str = "USD", budget_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Query all providers concurrently (within CHECK_BUDGET_S) and return a normalized list sorted by price asc."""
+    budget = budget_s if budget_s is not None else check_budget_s()
+    outcomes = await asyncio.gather(
+        _cached("travelpayouts", afetch_travelpayouts, origin, destination, date, currency, budget),
+        _cached("amadeus", afetch_amadeus, origin, destination, date, currency, budget),
+        return_exceptions=True,
+    )
+    offers: List[Dict[str, Any]] = []
+    for out in outcomes:
+        if isinstance(out, list):
+            offers.extend(out)
+    return _sorted_offers(offers)
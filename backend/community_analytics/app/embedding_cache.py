@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Content-hash keyed store for sentence embeddings. Vectors live in a float32 np.memmap
+# (capacity x dim) and a small SQLite (WAL) index maps sha1(text) -> slot + last use, so every
+# uvicorn worker on the host sees the same cache and it survives restarts. When full, the
+# least recently used slot is reused. Each index row also keeps the crc32 of its vector: a
+# writer fills the slot before committing the row, and a reader drops any copy whose crc does
+# not match (the slot was being recycled for another text while it read).
+
+LAYOUT = "2"  # bump when the index schema changes; older files are rebuilt
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, directory: str, model_name: str, capacity: int = 50000) -> None:
+        self.directory = directory
+        self.model_name = model_name
+        self.capacity = int(capacity)
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.sqlite")
+        self._data_path = os.path.join(directory, "embeddings.f32")
+        self._local = threading.local()
+        self._mm: Optional[np.memmap] = None
+        self._dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "torn": 0}
+        c = self._conn()
+        c.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+        meta = dict(c.execute("SELECT k, v FROM meta").fetchall())
+        if meta and (
+            meta.get("model") != model_name or int(meta.get("capacity", 0)) != self.capacity or meta.get("layout") != LAYOUT
+        ):
+            # Different encoder or layout: vectors are not comparable, start over
+            c.execute("DROP TABLE IF EXISTS idx")
+            c.execute("DELETE FROM meta")
+            if os.path.exists(self._data_path):
+                os.remove(self._data_path)
+            meta = {}
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS idx (h TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, crc INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        c.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON idx (last_used)")
+        if meta.get("dim"):
+            self._open(int(meta["dim"]))
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self._index_path, timeout=10, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = c
+        return c
+
+    def _open(self, dim: int) -> None:
+        with self._lock:
+            if self._mm is not None:
+                return
+            mode = "r+" if os.path.exists(self._data_path) else "w+"
+            self._mm = np.memmap(self._data_path, dtype=np.float32, mode=mode, shape=(self.capacity, dim))
+            self._dim = dim
+
+    def _ensure(self, dim: int) -> None:
+        if self._mm is not None:
+            return
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            meta = dict(c.execute("SELECT k, v FROM meta").fetchall())
+            if not meta.get("dim"):
+                c.executemany(
+                    "INSERT OR REPLACE INTO meta (k, v) VALUES (?, ?)",
+                    [("model", self.model_name), ("capacity", str(self.capacity)), ("dim", str(dim)), ("layout", LAYOUT)],
+                )
+            else:
+                dim = int(meta["dim"])
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        self._open(dim)
+
+    @staticmethod
+    def _crc(vec: np.ndarray) -> int:
+        return zlib.crc32(np.ascontiguousarray(vec, dtype=np.float32).tobytes())
+
+    def _lookup(self, keys: List[str]) -> Dict[str, Tuple[int, int]]:
+        found: Dict[str, Tuple[int, int]] = {}
+        c = self._conn()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for h, slot, crc in c.execute(f"SELECT h, slot, crc FROM idx WHERE h IN ({marks})", chunk):
+                found[h] = (slot, crc)
+        return found
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        if self._mm is None or not texts:
+            return [None] * len(texts)
+        keys = [text_key(t) for t in texts]
+        rows = {k: (np.array(self._mm[slot]), crc) for k, (slot, crc) in self._lookup(keys).items()}
+        # Another worker may be recycling a slot for a different text while we copy it; the
+        # committed crc only matches the vector that belongs to this row
+        valid = {k: v for k, (v, crc) in rows.items() if self._crc(v) == crc}
+        if len(valid) < len(rows):
+            with self._lock:
+                self._stats["torn"] += len(rows) - len(valid)
+        if valid:
+            now = time.time()
+            self._conn().executemany("UPDATE idx SET last_used = ? WHERE h = ?", [(now, k) for k in valid])
+        return [valid.get(k) for k in keys]
+
+    def put_many(self, texts: List[str], vectors: np.ndarray) -> None:
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._ensure(vectors.shape[1])
+        if vectors.shape[1] != self._dim:
+            return
+        c = self._conn()
+        now = time.time()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            evicted = 0
+            # Slots are handed out densely (0..used-1) and only ever recycled, never freed
+            used = c.execute("SELECT COUNT(*) FROM idx").fetchone()[0]
+            for text, vec in zip(texts, vectors):
+                k = text_key(text)
+                row = c.execute("SELECT slot FROM idx WHERE h = ?", (k,)).fetchone()
+                if row:
+                    slot = row[0]
+                elif used < self.capacity:
+                    slot = used
+                    used += 1
+                else:
+                    # Rows touched by this batch carry last_used = now, so they are never the victim
+                    victim = c.execute("SELECT h, slot FROM idx WHERE last_used < ? ORDER BY last_used ASC LIMIT 1", (now,)).fetchone()
+                    if victim is None:
+                        break  # batch larger than the cache: the rest stays uncached
+                    c.execute("DELETE FROM idx WHERE h = ?", (victim[0],))
+                    slot = victim[1]
+                    evicted += 1
+                self._mm[slot] = vec
+                c.execute("INSERT OR REPLACE INTO idx (h, slot, crc, last_used) VALUES (?, ?, ?, ?)", (k, slot, self._crc(vec), now))
+            # Vectors reach the shared file before the index rows that point at them are committed
+            self._mm.flush()
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._stats["evictions"] += evicted
+
+    def encode(self, texts: List[str], encoder: Any) -> np.ndarray:
+        """Embeddings for `texts`, calling encoder.encode only for texts not cached yet."""
+        cached = self.get_many(texts)
+        missing = sorted({t for t, v in zip(texts, cached) if v is None})
+        with self._lock:
+            self._stats["hits"] += len(texts) - sum(1 for v in cached if v is None)
+            self._stats["misses"] += len(missing)
+        fresh: Dict[str, np.ndarray] = {}
+        if missing:
+            vecs = np.asarray(encoder.encode(missing), dtype=np.float32)
+            fresh = dict(zip(missing, vecs))
+            try:
+                self.put_many(missing, vecs)
+            except Exception:
+                pass
+        return np.stack([v if v is not None else fresh[t] for t, v in zip(texts, cached)]) if texts else np.zeros((0, self._dim or 0), dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            entries = self._conn().execute("SELECT COUNT(*) FROM idx").fetchone()[0]
+        except Exception:
+            entries = None
+        with self._lock:
+            return {**self._stats, "entries": entries, "capacity": self.capacity, "dim": self._dim, "path": self.directory}
+
+
+class CachedEncoder:
+    """Drop-in `.encode(texts)` for a SentenceTransformer backed by an EmbeddingCache."""
+
+    def __init__(self, encoder: Any, cache: EmbeddingCache) -> None:
+        self.encoder = encoder
+        self.cache = cache
+
+    def encode(self, texts: List[str], **kwargs: Any) -> np.ndarray:
+        return self.cache.encode(list(texts), self.encoder)
+
+
+def build_embedding_cache(model_name: str) -> Optional[EmbeddingCache]:
+    """EMBED_CACHE_DIR (default ./cache/embeddings, empty disables) and EMBED_CACHE_MAX entries."""
+    directory = os.getenv("EMBED_CACHE_DIR", os.path.join(os.getcwd(), "cache", "embeddings"))
+    if not directory:
+        return None
+    try:
+        return EmbeddingCache(directory, model_name, capacity=int(os.getenv("EMBED_CACHE_MAX", "50000")))
+    except Exception:
+        return None
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .async_providers import afetch_amadeus, get_client, hedge_after, provider_deadline, _hedged
+from .flight_providers import _is_simulation, _iso_date, _normalize_offer, _sorted_offers, fetch_amadeus, offer_cache_key
+from .offer_cache import OfferKey, offer_cache, _is_enabled as _offer_cache_enabled
+from .provider_guard import ProviderUnavailable, guards
+
+# Fare calendar: cheapest price per day across departureDate ± flexDays.
+# Travelpayouts answers a whole month per call (grouped_prices, group_by=departure_at), so it
+# fills the matrix cheaply; Amadeus has no range search and costs one call per date, so those
+# calls are deduped across alerts, run with bounded concurrency and capped per sweep by
+# FARE_CALENDAR_MAX_CALLS (fresh cache entries are free and never count against it).
+
+TRAVELPAYOUTS_GROUPED_URL = "https://api.travelpayouts.com/aviasales/v3/grouped_prices"
+
+# (origin, destination, departureDate, flexDays)
+CalendarRequest = Tuple[str, str, str, int]
+Matrix = Dict[Tuple[str, str], Dict[str, Dict[str, Any]]]
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def window_dates(center: str, flex_days: int, today: Optional[dt.date] = None) -> List[str]:
+    """ISO dates center-flex .. center+flex, dropping days already in the past."""
+    c = dt.date.fromisoformat(_iso_date(center) or dt.date.today().isoformat())
+    today = today or dt.date.today()
+    days = (c + dt.timedelta(days=i) for i in range(-abs(flex_days), abs(flex_days) + 1))
+    return [d.isoformat() for d in days if d >= today]
+
+
+def _month_key(origin: str, destination: str, month: str, currency: str) -> OfferKey:
+    return ("travelpayouts_calendar", origin.upper(), destination.upper(), month, currency.upper())
+
+
+# --- Travelpayouts month calls --------------------------------------------------------------
+
+
+def _tp_month_params(origin: str, destination: str, month: str, currency: str, token: str) -> Dict[str, Any]:
+    return {
+        "origin": origin,
+        "destination": destination,
+        "departure_at": month,
+        "group_by": "departure_at",
+        "currency": currency.lower(),
+        "token": token,
+    }
+
+
+def _parse_tp_month(j: Dict[str, Any], origin: str, destination: str, currency: str, marker: str) -> List[Dict[str, Any]]:
+    data = (j or {}).get("data") or {}
+    items = data.values() if isinstance(data, dict) else data
+    offers: List[Dict[str, Any]] = []
+    for it in items:
+        price = it.get("price") or it.get("value")
+        day = str(it.get("departure_at") or "")[:10]
+        if price and day:
+            link = f"https://search.travelpayouts.com/flights?origin={origin}&destination={destination}&depart_date={day}&marker={marker}"
+            offers.append(_normalize_offer("travelpayouts", origin, destination, day, float(price), currency.upper(), link))
+    return offers
+
+
+def _stub_month(origin: str, destination: str, month: str, currency: str) -> List[Dict[str, Any]]:
+    """Deterministic per-day prices for simulation (varies by day so a best date exists)."""
+    marker = os.getenv("AFFILIATE_ID_TP", "MI_PARTNER_ID")
+    first = dt.date.fromisoformat(month + "-01")
+    offers = []
+    d = first
+    while d.month == first.month:
+        price = 330.0 + float((d.day * 37 + len(origin + destination) * 11) % 70)
+        link = f"https://search.travelpayouts.com/flights?origin={origin}&destination={destination}&depart_date={d.isoformat()}&marker={marker}"
+        offers.append(_normalize_offer("travelpayouts", origin, destination, d.isoformat(), price, currency.upper(), link, source="stub"))
+        d += dt.timedelta(days=1)
+    return offers
+
+
+def fetch_tp_month(origin: str, destination: str, month: str, currency: str = "USD") -> List[Dict[str, Any]]:
+    token = os.getenv("TRAVELPAYOUTS_TOKEN")
+    if _is_simulation() or not token:
+        return _stub_month(origin, destination, month, currency)
+
+    import requests  # local import
+
+    guard = guards["travelpayouts"]
+    try:
+        guard.before()
+    except ProviderUnavailable:
+        return []
+    t = time.perf_counter()
+    try:
+        r = requests.get(TRAVELPAYOUTS_GROUPED_URL, params=_tp_month_params(origin, destination, month, currency, token), timeout=20)
+        r.raise_for_status()
+        j = r.json() or {}
+    except Exception:
+        guard.record(False, time.perf_counter() - t)
+        return []
+    guard.record(True, time.perf_counter() - t)
+    return _parse_tp_month(j, origin, destination, currency, os.getenv("AFFILIATE_ID_TP", "MI_PARTNER_ID"))
+
+
+async def afetch_tp_month(origin: str, destination: str, month: str, currency: str = "USD") -> List[Dict[str, Any]]:
+    token = os.getenv("TRAVELPAYOUTS_TOKEN")
+    if _is_simulation() or not token:
+        return _stub_month(origin, destination, month, currency)
+    params = _tp_month_params(origin, destination, month, currency, token)
+    guard = guards["travelpayouts"]
+    try:
+        await guard.abefore()
+    except ProviderUnavailable:
+        return []
+
+    async def _call() -> Dict[str, Any]:
+        r = await get_client().get(TRAVELPAYOUTS_GROUPED_URL, params=params)
+        r.raise_for_status()
+        return r.json() or {}
+
+    t = time.perf_counter()
+    try:
+        j = await _hedged(_call, provider_deadline("travelpayouts"), hedge_after())
+    except Exception:
+        guard.record(False, time.perf_counter() - t)
+        return []
+    guard.record(True, time.perf_counter() - t)
+    return _parse_tp_month(j, origin, destination, currency, os.getenv("AFFILIATE_ID_TP", "MI_PARTNER_ID"))
+
+
+# --- planning --------------------------------------------------------------------------------
+
+
+class CalendarPlan:
+    """Deduped upstream calls for a set of calendar requests, trimmed to the call budget."""
+
+    def __init__(self, currency: str, max_calls: int) -> None:
+        self.currency = currency
+        self.max_calls = max_calls
+        self.months: List[Tuple[str, str, str]] = []  # (origin, destination, YYYY-MM)
+        self.dates: List[Tuple[str, str, str]] = []  # Amadeus (origin, destination, date)
+        self.skipped = 0
+        self.cost = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "monthCalls": len(self.months),
+            "amadeusDates": len(self.dates),
+            "amadeusSkipped": self.skipped,
+            "plannedUpstreamCalls": self.cost,
+            "maxCalls": self.max_calls,
+        }
+
+
+def calendar_max_calls() -> int:
+    """Upstream call cap for one calendar plan (env FARE_CALENDAR_MAX_CALLS)."""
+    return _env_int("FARE_CALENDAR_MAX_CALLS", 60)
+
+
+def _cost(key: OfferKey) -> int:
+    return 0 if _offer_cache_enabled() and offer_cache.state(key) == "fresh" else 1
+
+
+def plan_calendar(requests: List[CalendarRequest], currency: str = "USD", max_calls: Optional[int] = None) -> CalendarPlan:
+    plan = CalendarPlan(currency, max_calls if max_calls is not None else calendar_max_calls())
+    demand: Dict[Tuple[str, str, str], List[int]] = {}  # date -> [alerts wanting it, min distance to a center]
+    months: Set[Tuple[str, str, str]] = set()
+    for origin, destination, center, flex in requests:
+        c = dt.date.fromisoformat(_iso_date(center) or dt.date.today().isoformat())
+        for day in window_dates(center, flex):
+            k = (origin, destination, day)
+            dist = abs((dt.date.fromisoformat(day) - c).days)
+            cur = demand.setdefault(k, [0, dist])
+            cur[0] += 1
+            cur[1] = min(cur[1], dist)
+            months.add((origin, destination, day[:7]))
+
+    # Month calls fill many days each, so they are planned first
+    for origin, destination, month in sorted(months):
+        cost = _cost(_month_key(origin, destination, month, currency))
+        if plan.cost + cost > plan.max_calls:
+            continue
+        plan.months.append((origin, destination, month))
+        plan.cost += cost
+    # Then per-date Amadeus calls: most shared dates first, then closest to the requested date
+    for k, (n, dist) in sorted(demand.items(), key=lambda kv: (-kv[1][0], kv[1][1], kv[0])):
+        cost = _cost(offer_cache_key("amadeus", k[0], k[1], k[2], currency))
+        if plan.cost + cost > plan.max_calls:
+            plan.skipped += 1
+            continue
+        plan.dates.append(k)
+        plan.cost += cost
+    return plan
+
+
+# --- execution -------------------------------------------------------------------------------
+
+
+def _assemble(plan: CalendarPlan, month_offers: List[Any], date_offers: List[Any]) -> Matrix:
+    matrix: Matrix = {}
+    for (origin, destination, _), offers in list(zip(plan.months, month_offers)) + list(zip(plan.dates, date_offers)):
+        if not isinstance(offers, list):
+            continue
+        days = matrix.setdefault((origin, destination), {})
+        for o in _sorted_offers(offers):
+            day = o.get("date")
+            if day and (day not in days or o["price"] < days[day]["price"]):
+                days[day] = {"price": o["price"], "provider": o.get("provider"), "affiliate_link": o.get("affiliate_link"), "source": o.get("source", "live")}
+    return matrix
+
+
+def _month_job(plan: CalendarPlan, origin: str, destination: str, month: str) -> List[Dict[str, Any]]:
+    fetch = lambda: fetch_tp_month(origin, destination, month, plan.currency)
+    if not _offer_cache_enabled():
+        return fetch()
+    return offer_cache.get_or_fetch(_month_key(origin, destination, month, plan.currency), fetch)
+
+
+def _date_job(plan: CalendarPlan, origin: str, destination: str, day: str) -> List[Dict[str, Any]]:
+    fetch = lambda: fetch_amadeus(origin, destination, day, plan.currency)
+    if not _offer_cache_enabled():
+        return fetch()
+    return offer_cache.get_or_fetch(offer_cache_key("amadeus", origin, destination, day, plan.currency), fetch)
+
+
+def fetch_calendar(plan: CalendarPlan) -> Matrix:
+    """Runs the plan on a bounded thread pool (FARE_CALENDAR_CONCURRENCY, default 4)."""
+    with ThreadPoolExecutor(max_workers=max(1, _env_int("FARE_CALENDAR_CONCURRENCY", 4))) as pool:
+        months = [pool.submit(_month_job, plan, *m) for m in plan.months]
+        dates = [pool.submit(_date_job, plan, *d) for d in plan.dates]
+        month_offers = [f.exception() or f.result() for f in months]
+        date_offers = [f.exception() or f.result() for f in dates]
+    return _assemble(plan, month_offers, date_offers)
+
+
+async def afetch_calendar(plan: CalendarPlan) -> Matrix:
+    """asyncio flavour of fetch_calendar; concurrency bounded by a semaphore."""
+    sem = asyncio.Semaphore(max(1, _env_int("FARE_CALENDAR_CONCURRENCY", 4)))
+
+    async def _month(origin: str, destination: str, month: str) -> List[Dict[str, Any]]:
+        async with sem:
+            fetch = lambda: afetch_tp_month(origin, destination, month, plan.currency)
+            if not _offer_cache_enabled():
+                return await fetch()
+            return await offer_cache.aget_or_fetch(_month_key(origin, destination, month, plan.currency), fetch)
+
+    async def _date(origin: str, destination: str, day: str) -> List[Dict[str, Any]]:
+        async with sem:
+            fetch = lambda: afetch_amadeus(origin, destination, day, plan.currency)
+            if not _offer_cache_enabled():
+                return await fetch()
+            return await offer_cache.aget_or_fetch(offer_cache_key("amadeus", origin, destination, day, plan.currency), fetch)
+
+    month_offers = await asyncio.gather(*(_month(*m) for m in plan.months), return_exceptions=True)
+    date_offers = await asyncio.gather(*(_date(*d) for d in plan.dates), return_exceptions=True)
+    return _assemble(plan, list(month_offers), list(date_offers))
+
+
+def calendar_for(matrix: Matrix, origin: str, destination: str, center: str, flex_days: int) -> Dict[str, Any]:
+    """Per-day prices for one request's window (price None when unknown) plus the best date."""
+    known = matrix.get((origin, destination), {})
+    empty = {"price": None, "provider": None, "affiliate_link": None, "source": None}
+    days = [{"date": d, **known.get(d, empty)} for d in window_dates(center, flex_days)]
+    priced = [d for d in days if d["price"] is not None]
+    best = min(priced, key=lambda d: (d["price"], d["date"])) if priced else None
+    return {
+        "days": days,
+        "bestDate": best["date"] if best else None,
+        "bestPrice": best["price"] if best else None,
+        "bestLink": best["affiliate_link"] if best else None,
+        "bestSource": best["source"] if best else None,
+        "coverage": round(len(priced) / len(days), 3) if days else 0.0,
+    }
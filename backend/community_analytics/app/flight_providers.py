@@ -1,14 +1,20 @@
 from __future__ import annotations
 
 import os
+import time
 import datetime as dt
 from typing import List, Dict, Any, Optional
 
+from .amadeus_auth import amadeus_tokens
+from .offer_cache import OfferKey, offer_cache, _is_enabled as _offer_cache_enabled
+from .provider_guard import ProviderUnavailable, check_budget_s, guards
+
 # Network calls are executed by the service runtime, not during codegen.
 # We keep 'requests' import local inside functions to avoid import failures if missing.
 
 
-def _normalize_offer(provider: str, origin: str, destination: str, date: Optional[str], price: float, currency: str, deep_link: str) -> Dict[str, Any]:
+def _normalize_offer(provider: str, origin: str, destination: str, date: Optional[str], price: float, currency: str, deep_link: str, source: str = "live") -> Dict[str, Any]:
+    # source: "live" for real provider prices, "stub" for simulated ones (never treat those as deals)
     return {
         "provider": provider,
         "origin": origin,
@@ -17,6 +23,7 @@ def _normalize_offer(provider: str, origin: str, destination: str, date: Optiona
         "price": float(price),
         "currency": currency,
         "affiliate_link": deep_link,
+        "source": source,
     }
 
 
@@ -35,6 +42,8 @@ def _iso_date(d: Optional[str]) -> Optional[str]:
 
 def _stub_offers(provider: str, origin: str, destination: str, date: Optional[str], currency: str = "USD") -> List[Dict[str, Any]]:
     """Return deterministic stub offers for simulation when API keys are missing."""
+    if provider in guards:
+        guards[provider].stub_served()
     date_iso = _iso_date(date) or dt.date.today().isoformat()
     if provider == "travelpayouts":
         aff = os.getenv("AFFILIATE_ID_TP", "MI_PARTNER_ID")
@@ -59,8 +68,8 @@ def _stub_offers(provider: str, origin: str, destination: str, date: Optional[st
             f"https://example.com/book?o={origin}&d={destination}&dt={date_iso}&aff={aff}&opt=1",
         ]
     return [
-        _normalize_offer(provider, origin, destination, date_iso, base, currency, links[0]),
-        _normalize_offer(provider, origin, destination, date_iso, base + 12.0, currency, links[1]),
+        _normalize_offer(provider, origin, destination, date_iso, base, currency, links[0], source="stub"),
+        _normalize_offer(provider, origin, destination, date_iso, base + 12.0, currency, links[1], source="stub"),
     ]
 
 
@@ -69,25 +78,13 @@ def _is_simulation() -> bool:
     return val in ("1", "true", "yes", "y", "on")
 
 
-def fetch_travelpayouts(origin: str, destination: str, date: Optional[str], currency: str = "USD") -> List[Dict[str, Any]]:
-    """
-    Travelpayouts API basic integration. Returns normalized offers with affiliate links.
+TRAVELPAYOUTS_URL = "https://api.travelpayouts.com/aviasales/v3/prices_for_dates"
+AMADEUS_SEARCH_URL = "https://test.api.amadeus.com/v2/shopping/flight-offers"
 
-    Env vars:
-      - TRAVELPAYOUTS_TOKEN
-      - AFFILIATE_ID_TP (used to build deeplink)
-    """
-    token = os.getenv("TRAVELPAYOUTS_TOKEN")
-    marker = os.getenv("AFFILIATE_ID_TP", "MI_PARTNER_ID")
-    if _is_simulation() or not token:
-        return _stub_offers("travelpayouts", origin, destination, date, currency)
-
-    import requests  # local import
 
-    date_iso = _iso_date(date) or dt.date.today().isoformat()
+def _travelpayouts_params(origin: str, destination: str, date_iso: str, currency: str, token: str) -> Dict[str, Any]:
     # Use prices_for_dates as a simple example
-    url = "https://api.travelpayouts.com/aviasales/v3/prices_for_dates"
-    params = {
+    return {
         "origin": origin,
         "destination": destination,
         "departure_at": date_iso,
@@ -97,14 +94,10 @@ def fetch_travelpayouts(origin: str, destination: str, date: Optional[str], curr
         "sorting": "price",
         "token": token,
     }
-    try:
-        r = requests.get(url, params=params, timeout=20)
-        r.raise_for_status()
-        j = r.json() or {}
-        data = (j.get("data") or [])[:5]
-    except Exception:
-        return _stub_offers("travelpayouts", origin, destination, date, currency)
 
+
+def _parse_travelpayouts(j: Dict[str, Any], origin: str, destination: str, date_iso: str, currency: str, marker: str) -> List[Dict[str, Any]]:
+    data = ((j or {}).get("data") or [])[:5]
     offers: List[Dict[str, Any]] = []
     for it in data:
         price = it.get("price") or it.get("value")
@@ -115,41 +108,8 @@ def fetch_travelpayouts(origin: str, destination: str, date: Optional[str], curr
     return offers
 
 
-def fetch_amadeus(origin: str, destination: str, date: Optional[str], currency: str = "USD") -> List[Dict[str, Any]]:
-    """
-    Amadeus Flight Offers Search (test env) minimal integration.
-
-    Env vars:
-      - AMADEUS_CLIENT_ID
-      - AMADEUS_CLIENT_SECRET
-      - AFFILIATE_ID_AMA (for deeplink placeholder)
-    """
-    client_id = os.getenv("AMADEUS_CLIENT_ID")
-    client_secret = os.getenv("AMADEUS_CLIENT_SECRET")
-    aff = os.getenv("AFFILIATE_ID_AMA", "")
-    if _is_simulation() or not (client_id and client_secret):
-        return _stub_offers("amadeus", origin, destination, date, currency)
-
-    import requests  # local import
-
-    date_iso = _iso_date(date) or dt.date.today().isoformat()
-    token_url = "https://test.api.amadeus.com/v1/security/oauth2/token"
-    try:
-        t = requests.post(
-            token_url,
-            data={"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret},
-            timeout=15,
-        )
-        t.raise_for_status()
-        access_token = (t.json() or {}).get("access_token")
-        if not access_token:
-            return _stub_offers("amadeus", origin, destination, date, currency)
-    except Exception:
-        return _stub_offers("amadeus", origin, destination, date, currency)
-
-    url = "https://test.api.amadeus.com/v2/shopping/flight-offers"
-    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    payload = {
+def _amadeus_payload(origin: str, destination: str, date_iso: str, currency: str) -> Dict[str, Any]:
+    return {
         "currencyCode": currency,
         "originDestinations": [
             {
@@ -163,14 +123,10 @@ def fetch_amadeus(origin: str, destination: str, date: Optional[str], currency:
         "sources": ["GDS"],
         "max": 5,
     }
-    try:
-        r = requests.post(url, json=payload, headers=headers, timeout=20)
-        r.raise_for_status()
-        j = r.json() or {}
-        data = (j.get("data") or [])[:5]
-    except Exception:
-        return _stub_offers("amadeus", origin, destination, date, currency)
 
+
+def _parse_amadeus(j: Dict[str, Any], origin: str, destination: str, date_iso: str, currency: str, aff: str) -> List[Dict[str, Any]]:
+    data = ((j or {}).get("data") or [])[:5]
     offers: List[Dict[str, Any]] = []
     for it in data:
         price_obj = (it.get("price") or {})
@@ -182,27 +138,119 @@ def fetch_amadeus(origin: str, destination: str, date: Optional[str], currency:
     return offers
 
 
-def fetch_from_providers(origin: str, destination: str, date: Optional[str], currency: str = "USD") -> List[Dict[str, Any]]:
-    """Combine providers and return a normalized list sorted by price asc."""
-    offers: List[Dict[str, Any]] = []
+def fetch_travelpayouts(origin: str, destination: str, date: Optional[str], currency: str = "USD", budget_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Travelpayouts API basic integration. Returns normalized offers with affiliate links.
+    Stub offers only in simulation / without a token; live failures return [] (see app/provider_guard.py).
+
+    Env vars:
+      - TRAVELPAYOUTS_TOKEN
+      - AFFILIATE_ID_TP (used to build deeplink)
+    """
+    token = os.getenv("TRAVELPAYOUTS_TOKEN")
+    marker = os.getenv("AFFILIATE_ID_TP", "MI_PARTNER_ID")
+    if _is_simulation() or not token:
+        return _stub_offers("travelpayouts", origin, destination, date, currency)
+
+    import requests  # local import
+
+    guard = guards["travelpayouts"]
+    try:
+        guard.before(budget_s)
+    except ProviderUnavailable:
+        return []
+    date_iso = _iso_date(date) or dt.date.today().isoformat()
+    t = time.perf_counter()
     try:
-        offers.extend(fetch_travelpayouts(origin, destination, date, currency))
+        r = requests.get(TRAVELPAYOUTS_URL, params=_travelpayouts_params(origin, destination, date_iso, currency, token), timeout=min(20.0, budget_s or 20.0))
+        r.raise_for_status()
+        j = r.json() or {}
     except Exception:
-        pass
+        guard.record(False, time.perf_counter() - t)
+        return []
+    guard.record(True, time.perf_counter() - t)
+    return _parse_travelpayouts(j, origin, destination, date_iso, currency, marker)
+
+
+def fetch_amadeus(origin: str, destination: str, date: Optional[str], currency: str = "USD", budget_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Amadeus Flight Offers Search (test env) minimal integration.
+    Stub offers only in simulation / without credentials; live failures return [].
+
+    Env vars:
+      - AMADEUS_CLIENT_ID
+      - AMADEUS_CLIENT_SECRET
+      - AFFILIATE_ID_AMA (for deeplink placeholder)
+    """
+    client_id = os.getenv("AMADEUS_CLIENT_ID")
+    client_secret = os.getenv("AMADEUS_CLIENT_SECRET")
+    aff = os.getenv("AFFILIATE_ID_AMA", "")
+    if _is_simulation() or not (client_id and client_secret):
+        return _stub_offers("amadeus", origin, destination, date, currency)
+
+    import requests  # local import
+
+    guard = guards["amadeus"]
+    try:
+        guard.before(budget_s)
+    except ProviderUnavailable:
+        return []
+    date_iso = _iso_date(date) or dt.date.today().isoformat()
+    # Token comes from the process-wide cache (app/amadeus_auth.py); a 401 drops it and retries once
+    payload = _amadeus_payload(origin, destination, date_iso, currency)
+    t = time.perf_counter()
     try:
-        offers.extend(fetch_amadeus(origin, destination, date, currency))
+        for attempt in range(2):
+            access_token = amadeus_tokens.get_token()
+            if not access_token:
+                raise RuntimeError("no Amadeus access token")
+            headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+            r = requests.post(AMADEUS_SEARCH_URL, json=payload, headers=headers, timeout=min(20.0, budget_s or 20.0))
+            if r.status_code == 401 and attempt == 0:
+                amadeus_tokens.invalidate(access_token)
+                continue
+            r.raise_for_status()
+            break
+        j = r.json() or {}
     except Exception:
-        pass
+        guard.record(False, time.perf_counter() - t)
+        return []
+    guard.record(True, time.perf_counter() - t)
+    return _parse_amadeus(j, origin, destination, date_iso, currency, aff)
+
+
+def _sorted_offers(offers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     offers = [o for o in offers if isinstance(o.get("price"), (int, float))]
     offers.sort(key=lambda x: x["price"])  # cheapest first
     return offers
 
 
+def offer_cache_key(provider: str, origin: str, destination: str, date: Optional[str], currency: str) -> OfferKey:
+    return (provider, origin.upper(), destination.upper(), _iso_date(date) or dt.date.today().isoformat(), currency.upper())
+
+
+def fetch_from_providers(origin: str, destination: str, date: Optional[str], currency: str = "USD", budget_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Combine providers and return a normalized list sorted by price asc (served via app/offer_cache.py).
+    Providers share one latency budget (CHECK_BUDGET_S); each call only gets what is left of it.
+    """
+    deadline = time.monotonic() + (budget_s if budget_s is not None else check_budget_s())
+    offers: List[Dict[str, Any]] = []
+    for provider, fn in (("travelpayouts", fetch_travelpayouts), ("amadeus", fetch_amadeus)):
+        call = lambda fn=fn: fn(origin, destination, date, currency, budget_s=deadline - time.monotonic())
+        try:
+            if _offer_cache_enabled():
+                offers.extend(offer_cache.get_or_fetch(offer_cache_key(provider, origin, destination, date, currency), call))
+            else:
+                offers.extend(call())
+        except Exception:
+            pass
+    return _sorted_offers(offers)
+
+
 def fetch_test_offers(origin: str, destination: str, date: Optional[str], currency: str = "USD") -> List[Dict[str, Any]]:
     """Always return combined stub offers from both providers for debugging/QA."""
     offers: List[Dict[str, Any]] = []
     offers.extend(_stub_offers("travelpayouts", origin, destination, date, currency))
     offers.extend(_stub_offers("amadeus", origin, destination, date, currency))
-    offers = [o for o in offers if isinstance(o.get("price"), (int, float))]
-    offers.sort(key=lambda x: x["price"])  # cheapest first
-    return offers
+    return _sorted_offers(offers)
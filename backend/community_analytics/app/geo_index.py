@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import rollups
+
+# Geohash tile pyramid in communityGeoTiles, bumped in the same write batch as each
+# communityAnalysis doc that has coordinates (next to the rollups day bucket). Two levels:
+#   - precision-1 tiles holding precision-3 cells (~156 km), used at low zoom
+#   - precision-3 tiles holding precision-5 cells (~4.9 km), used from city zoom in
+# A tile holds at most 32^2 cells, so one doc per (tile, UTC day) stays small. Doc shape:
+#   { tile, day, cells: {geohash: {count, sentiments: {label: n}, latSum, lngSum}}, updatedAt }
+# /analysis/locations?bbox=...&zoom=... reads the tiles covering the viewport by ID and
+# clusters their cells at the geohash precision that fits the zoom level. Like the rollups, the
+# tiles are only read once a rebuild has covered the window (communityAggregatesMeta/geoTiles);
+# before that the endpoint clusters a raw scan. A viewport costs tiles x days point reads, so a
+# request stays under GEO_MAX_READS: the finest level that fits is used, and when even the
+# coarsest does not fit the endpoint scans instead. bbox windows are limited to MAX_BBOX_DAYS.
+
+TILES = "communityGeoTiles"
+LEVELS: Tuple[Tuple[int, int], ...] = ((1, 3), (3, 5))  # (tile precision, cell precision)
+MAX_PRECISION = LEVELS[-1][1]
+MAX_BBOX_DAYS = 31
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+BBox = Tuple[float, float, float, float]  # south, west, north, east
+
+
+def is_enabled() -> bool:
+    val = (os.getenv("GEO_INDEX_ENABLED") or "1").strip().lower()
+    return val in ("1", "true", "yes", "y", "on")
+
+
+def max_tiles() -> int:
+    """Tile reads per day of the window before falling back to the coarser level (env GEO_MAX_TILES)."""
+    try:
+        return max(1, int(os.getenv("GEO_MAX_TILES", "32")))
+    except ValueError:
+        return 32
+
+
+def max_reads() -> int:
+    """Tile point reads (tiles x days) allowed per viewport request (env GEO_MAX_READS)."""
+    try:
+        return max(1, int(os.getenv("GEO_MAX_READS", "512")))
+    except ValueError:
+        return 512
+
+
+def encode(lat: float, lng: float, precision: int) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    out: List[str] = []
+    bits = 0
+    n = 0
+    even = True
+    while len(out) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                bits = bits * 2 + 1
+                lng_lo = mid
+            else:
+                bits *= 2
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = bits * 2 + 1
+                lat_lo = mid
+            else:
+                bits *= 2
+                lat_hi = mid
+        even = not even
+        n += 1
+        if n == 5:
+            out.append(_BASE32[bits])
+            bits = n = 0
+    return "".join(out)
+
+
+def bounds(geohash: str) -> BBox:
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+    for c in geohash:
+        v = _DECODE[c]
+        for shift in range(4, -1, -1):
+            bit = (v >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                lng_lo, lng_hi = (mid, lng_hi) if bit else (lng_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lat_lo, lng_lo, lat_hi, lng_hi
+
+
+def parse_bbox(value: str) -> BBox:
+    """"south,west,north,east" in degrees; west > east crosses the antimeridian."""
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be south,west,north,east")
+    s, w, n, e = parts
+    if not (-90.0 <= s <= n <= 90.0) or not (-180.0 <= w <= 180.0 and -180.0 <= e <= 180.0):
+        raise ValueError("bbox out of range")
+    return s, w, n, e
+
+
+def in_bbox(lat: float, lng: float, bbox: BBox) -> bool:
+    s, w, n, e = bbox
+    if not s <= lat <= n:
+        return False
+    return w <= lng <= e if w <= e else (lng >= w or lng <= e)
+
+
+def precision_for_zoom(zoom: int) -> int:
+    """Web-map zoom (0 world .. ~20 street) to cluster precision: about four clusters across a 256px tile."""
+    return max(1, min(MAX_PRECISION, int(round((zoom + 2) * 2 / 5))))
+
+
+def cover(bbox: BBox, precision: int, limit: int) -> Optional[List[str]]:
+    """Geohashes of `precision` that intersect bbox, or None if there are more than `limit`."""
+    s, w, n, e = bbox
+    b = bounds(encode(s, w, precision))
+    dlat, dlng = b[2] - b[0], b[3] - b[1]
+    spans = [(w, e)] if w <= e else [(w, 180.0), (-180.0, e)]
+    out = set()
+    for w0, e0 in spans:
+        lat = s
+        while True:
+            lng = w0
+            while True:
+                out.add(encode(lat, lng, precision))
+                if len(out) > limit:
+                    return None
+                if lng >= e0:
+                    break
+                lng = min(lng + dlng, e0)
+            if lat >= n:
+                break
+            lat = min(lat + dlat, n)
+    return sorted(out)
+
+
+def tile_id(tile: str, day: str) -> str:
+    return f"{tile}__{day}"
+
+
+def _has_coords(doc: Dict[str, Any]) -> bool:
+    return isinstance(doc.get("lat"), (int, float)) and isinstance(doc.get("lng"), (int, float))
+
+
+def tile_deltas(doc: Dict[str, Any], inc: Callable[[float], Any]) -> Dict[str, Dict[str, Any]]:
+    """{tile geohash: nested cell update} for one analysis doc (empty without coordinates)."""
+    if not _has_coords(doc):
+        return {}
+    lat, lng = float(doc["lat"]), float(doc["lng"])
+    sentiment = (doc.get("sentiment") or "unknown").lower()
+    out: Dict[str, Dict[str, Any]] = {}
+    for tile_p, cell_p in LEVELS:
+        cell = encode(lat, lng, cell_p)
+        out[cell[:tile_p]] = {
+            "cells": {cell: {"count": inc(1), "sentiments": {sentiment: inc(1)}, "latSum": inc(lat), "lngSum": inc(lng)}},
+        }
+    return out
+
+
+def build_tiles(rows: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Group raw communityAnalysis docs into {tile_id: tile} (backfill/rebuild)."""
+    tiles: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        created = r.get("createdAt")
+        if not isinstance(created, datetime):
+            continue
+        day = rollups.day_key(created)
+        for tile, delta in tile_deltas(r, lambda v: v).items():
+            t = tiles.setdefault(tile_id(tile, day), {"tile": tile, "day": day, "cells": {}})
+            for cell, d in delta["cells"].items():
+                c = t["cells"].setdefault(cell, {"count": 0, "sentiments": {}, "latSum": 0.0, "lngSum": 0.0})
+                c["count"] += d["count"]
+                c["latSum"] += d["latSum"]
+                c["lngSum"] += d["lngSum"]
+                for k, v in d["sentiments"].items():
+                    c["sentiments"][k] = c["sentiments"].get(k, 0) + v
+    return tiles
+
+
+def plan(bbox: BBox, zoom: int, days: int = 1) -> Optional[Tuple[int, int, List[str]]]:
+    """
+    (cluster precision, tile precision, tiles to read) for a viewport over `days` day docs per tile;
+    coarser when the finer level needs too many tiles, None when no level fits max_reads().
+    """
+    precision = precision_for_zoom(zoom)
+    limit = min(max_tiles(), max_reads() // max(1, days))
+    if limit < 1:
+        return None
+    for tile_p, cell_p in reversed(LEVELS):
+        if tile_p >= precision and tile_p != LEVELS[0][0]:
+            continue
+        tiles = cover(bbox, tile_p, limit)
+        if tiles is not None:
+            return min(precision, cell_p), tile_p, tiles
+    if len(_BASE32) * max(1, days) <= max_reads():
+        # A world-wide viewport at the coarsest level: every precision-1 tile
+        return min(precision, LEVELS[0][1]), LEVELS[0][0], list(_BASE32)
+    return None
+
+
+def _add(acc: Dict[str, Any], count: int, sentiments: Dict[str, Any], lat_sum: float, lng_sum: float) -> None:
+    acc["count"] += count
+    acc["latSum"] += lat_sum
+    acc["lngSum"] += lng_sum
+    for k, v in sentiments.items():
+        acc["sentiments"][k] = acc["sentiments"].get(k, 0) + int(v)
+
+
+def _finish(groups: Dict[str, Dict[str, Any]], bbox: BBox) -> List[Dict[str, Any]]:
+    clusters = []
+    for gh, acc in groups.items():
+        if not acc["count"]:
+            continue
+        lat, lng = acc["latSum"] / acc["count"], acc["lngSum"] / acc["count"]
+        # Edge cells straddle the viewport; keep the clusters whose centroid is on screen
+        if in_bbox(lat, lng, bbox):
+            clusters.append({"geohash": gh, "lat": lat, "lng": lng, "count": acc["count"], "sentiments": acc["sentiments"]})
+    clusters.sort(key=lambda c: -c["count"])
+    return clusters
+
+
+def cluster_tiles(tiles: Iterable[Dict[str, Any]], bbox: BBox, precision: int) -> List[Dict[str, Any]]:
+    """Merge the cells of the fetched tile docs (all days) into clusters at `precision`."""
+    groups: Dict[str, Dict[str, Any]] = {}
+    for t in tiles:
+        for cell, c in (t.get("cells") or {}).items():
+            acc = groups.setdefault(cell[:precision], {"count": 0, "sentiments": {}, "latSum": 0.0, "lngSum": 0.0})
+            _add(acc, int(c.get("count", 0) or 0), c.get("sentiments") or {}, float(c.get("latSum", 0.0) or 0.0), float(c.get("lngSum", 0.0) or 0.0))
+    return _finish(groups, bbox)
+
+
+def cluster_rows(rows: Iterable[Dict[str, Any]], bbox: BBox, precision: int) -> List[Dict[str, Any]]:
+    """Same clusters straight from communityAnalysis rows (GEO_INDEX_ENABLED=0)."""
+    groups: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        if not _has_coords(r) or not in_bbox(float(r["lat"]), float(r["lng"]), bbox):
+            continue
+        lat, lng = float(r["lat"]), float(r["lng"])
+        acc = groups.setdefault(encode(lat, lng, precision), {"count": 0, "sentiments": {}, "latSum": 0.0, "lngSum": 0.0})
+        _add(acc, 1, {(r.get("sentiment") or "unknown").lower(): 1}, lat, lng)
+    return _finish(groups, bbox)
+
+
+def main() -> None:
+    """python -m app.geo_index --sinceDays 90: rebuild geohash tiles from communityAnalysis."""
+    import argparse
+
+    from .store import Store
+
+    ap = argparse.ArgumentParser(description="Backfill/rebuild communityGeoTiles")
+    ap.add_argument("--sinceDays", type=int, default=90)
+    args = ap.parse_args()
+
+    store = Store(project_id=os.getenv("FIRESTORE_PROJECT_ID"))
+    print(store.rebuild_geo_tiles(since_days=args.sinceDays))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .price_predictor import PriceSeries
+
+# loader(origin, destination, after, inclusive) -> [(ts, price), ...] ordered by ts asc
+HistoryLoader = Callable[[str, str, datetime, bool], List[Tuple[Any, float]]]
+
+
+def _epoch(ts: Any) -> float:
+    if isinstance(ts, datetime):
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return ts.timestamp()
+    if hasattr(ts, "timestamp"):
+        return float(ts.timestamp())
+    return 0.0
+
+
+class _RouteSeries:
+    __slots__ = ("points", "high_water", "checked_at", "lock")
+
+    def __init__(self) -> None:
+        self.points = PriceSeries()  # epoch seconds + price, time-ordered
+        self.high_water: Optional[Any] = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+
+class HistoryCache:
+    """
+    Per-route price history kept incrementally.
+
+    The first call for a route loads the whole window; later calls only ask the loader for
+    documents with createdAt > high-water mark, append them, and pop expired points off the
+    left of the PriceSeries. Calls within `min_refresh_s` of the last check skip the query entirely.
+    """
+
+    def __init__(self, loader: HistoryLoader, window_hours: int = 720, max_routes: int = 1024, min_refresh_s: float = 30.0) -> None:
+        self.loader = loader
+        self.window_hours = window_hours
+        self.max_routes = max_routes
+        self.min_refresh_s = min_refresh_s
+        self._lock = threading.Lock()
+        self._routes: "OrderedDict[Tuple[str, str], _RouteSeries]" = OrderedDict()
+        self._stats = {"fullLoads": 0, "incrementalLoads": 0, "skippedQueries": 0, "docsRead": 0, "evictions": 0}
+
+    def _series(self, key: Tuple[str, str]) -> _RouteSeries:
+        with self._lock:
+            s = self._routes.get(key)
+            if s is None:
+                s = self._routes[key] = _RouteSeries()
+                while len(self._routes) > self.max_routes:
+                    self._routes.popitem(last=False)
+                    self._stats["evictions"] += 1
+            else:
+                self._routes.move_to_end(key)
+            return s
+
+    def _sync(self, origin: str, destination: str) -> _RouteSeries:
+        s = self._series((origin, destination))
+        with s.lock:
+            now = time.time()
+            if s.high_water is not None and now - s.checked_at < self.min_refresh_s:
+                with self._lock:
+                    self._stats["skippedQueries"] += 1
+            else:
+                full = s.high_water is None
+                after = s.high_water if not full else datetime.utcnow() - timedelta(hours=self.window_hours)
+                rows = self.loader(origin, destination, after, full)
+                for ts, price in rows:
+                    e = _epoch(ts)
+                    if len(s.points) and e < s.points.ts[-1]:
+                        continue  # keep the series time-ordered
+                    s.points.append(e, price)
+                    s.high_water = ts
+                if full and s.high_water is None:
+                    s.high_water = after
+                s.checked_at = now
+                with self._lock:
+                    self._stats["fullLoads" if full else "incrementalLoads"] += 1
+                    self._stats["docsRead"] += len(rows)
+            s.points.expire_before(now - self.window_hours * 3600)
+        return s
+
+    def get_series(self, origin: str, destination: str, since_hours: Optional[int] = None) -> PriceSeries:
+        """Snapshot of the route's series (a copy, safe to use after the lock is released)."""
+        s = self._sync(origin, destination)
+        cutoff = time.time() - (since_hours or self.window_hours) * 3600
+        with s.lock:
+            out = s.points.copy()
+        out.expire_before(cutoff)
+        return out
+
+    def get(self, origin: str, destination: str, since_hours: Optional[int] = None) -> List[Dict[str, Any]]:
+        series = self.get_series(origin, destination, since_hours)
+        return [{"ts": datetime.fromtimestamp(float(e), tz=timezone.utc), "price": float(p)} for e, p in zip(series.ts, series.prices)]
+
+    def invalidate(self, origin: Optional[str] = None, destination: Optional[str] = None) -> None:
+        with self._lock:
+            if origin is None:
+                self._routes.clear()
+            else:
+                self._routes.pop((origin, destination), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["routes"] = len(self._routes)
+            out["points"] = sum(len(s.points) for s in self._routes.values())
+        return out
+
+
+def _is_enabled() -> bool:
+    val = (os.getenv("HISTORY_CACHE_ENABLED") or "1").strip().lower()
+    return val in ("1", "true", "yes", "y", "on")
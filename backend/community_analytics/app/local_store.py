@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import secrets
+import sqlite3
+import string
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Embedded stand-in for the subset of google.cloud.firestore.Client the stores use:
+# collection().document().set/get/delete, where/order_by/limit/start_after/stream, batch(),
+# get_all() and single-document transactions (transact(), see storage.transact). Documents are
+# JSON rows in one SQLite (WAL) table; the fields the app filters and sorts on get expression
+# indexes, so reads are local B-tree lookups instead of RPCs.
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+# Datetimes are stored as tagged UTC ISO strings so they sort correctly and decode back to datetime
+_DT_TAG = "\u001fdt:"
+_FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+_ID_CHARS = string.ascii_letters + string.digits
+
+# Indexed as (collection, fields..., id) so filtered, cursor-ordered reads need no sort; covers the queries in store.py / store_flights.py
+INDEXES: List[Tuple[str, ...]] = [
+    ("location", "createdAt"),  # communityAnalysis, communityMessages
+    ("createdAt",),
+    ("day",),  # communityAggregates, communityGeoTiles
+    ("origin", "destination", "createdAt"),  # flightMonitorEvents
+    ("status",),  # flightAlertsBackend
+    ("status", "nextCheckAt"),  # flightAlertsBackend due alerts (app/scheduler.py)
+    ("status", "shard", "nextCheckAt"),  # flightAlertsBackend per-shard due alerts (app/shard_leases.py)
+    ("expiresAt",),  # flightAlertWorkers
+]
+
+
+class Sentinel:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Sentinel({self.name})"
+
+
+SERVER_TIMESTAMP = Sentinel("SERVER_TIMESTAMP")
+
+
+class Increment:
+    def __init__(self, value: float) -> None:
+        self.value = value
+
+
+def _is_server_timestamp(v: Any) -> bool:
+    return v is SERVER_TIMESTAMP or type(v).__name__ == "Sentinel" and "timestamp" in repr(v).lower()
+
+
+def _increment_value(v: Any) -> Optional[float]:
+    # Accept our Increment and google.cloud.firestore.Increment (stores the amount in _value)
+    if isinstance(v, Increment):
+        return v.value
+    if type(v).__name__ == "Increment":
+        return getattr(v, "value", getattr(v, "_value", None))
+    return None
+
+
+def _encode(v: Any) -> Any:
+    if isinstance(v, datetime):
+        if v.tzinfo is None:
+            v = v.replace(tzinfo=timezone.utc)
+        return _DT_TAG + v.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
+    if isinstance(v, dict):
+        return {k: _encode(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_encode(x) for x in v]
+    return v
+
+
+def _decode(v: Any) -> Any:
+    if isinstance(v, str) and v.startswith(_DT_TAG):
+        return datetime.strptime(v[len(_DT_TAG):], "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=timezone.utc)
+    if isinstance(v, dict):
+        return {k: _decode(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_decode(x) for x in v]
+    return v
+
+
+def _apply(old: Dict[str, Any], new: Dict[str, Any], now: datetime, merge: bool) -> Dict[str, Any]:
+    """Resolve sentinels/increments; with merge, nested maps are merged like Firestore set(merge=True)."""
+    out = dict(old)
+    for k, v in new.items():
+        if isinstance(v, dict):
+            prev = out.get(k) if merge and isinstance(out.get(k), dict) else {}
+            out[k] = _apply(prev, v, now, merge)
+            continue
+        inc = _increment_value(v)
+        if inc is not None:
+            base = out.get(k) if isinstance(out.get(k), (int, float)) else 0
+            out[k] = base + inc
+        elif _is_server_timestamp(v):
+            out[k] = now
+        else:
+            out[k] = v
+    return out
+
+
+def _expr(field: str) -> str:
+    if field == "__name__":
+        return "id"
+    if not _FIELD_RE.match(field):
+        raise ValueError(f"unsupported field path: {field!r}")
+    # Inlined literal path so SQLite can match the expression indexes
+    return f"json_extract(data, '$.{field}')"
+
+
+class LocalSnapshot:
+    def __init__(self, reference: "LocalDocumentRef", data: Optional[Dict[str, Any]]) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return _decode(self._data) if self._data is not None else None
+
+    def get(self, field: str) -> Any:
+        cur: Any = self._data or {}
+        for part in field.split("."):
+            cur = cur.get(part) if isinstance(cur, dict) else None
+        return _decode(cur)
+
+
+class LocalDocumentRef:
+    def __init__(self, client: "LocalClient", collection: str, doc_id: Optional[str] = None) -> None:
+        self._client = client
+        self.collection = collection
+        self.id = doc_id or "".join(secrets.choice(_ID_CHARS) for _ in range(20))
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._client._write([("set", self, data, merge)])
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self._client._write([("set", self, data, True)])
+
+    def delete(self) -> None:
+        self._client._write([("delete", self, None, False)])
+
+    def get(self) -> LocalSnapshot:
+        row = self._client._conn().execute("SELECT data FROM docs WHERE collection = ? AND id = ?", (self.collection, self.id)).fetchone()
+        return LocalSnapshot(self, json.loads(row[0]) if row else None)
+
+
+class LocalQuery:
+    def __init__(self, client: "LocalClient", collection: str) -> None:
+        self._client = client
+        self._collection = collection
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._order: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._after: Optional[LocalSnapshot] = None
+
+    def _copy(self) -> "LocalQuery":
+        q = LocalQuery(self._client, self._collection)
+        q._filters, q._order, q._limit, q._after = list(self._filters), list(self._order), self._limit, self._after
+        return q
+
+    def where(self, field: str, op: str, value: Any) -> "LocalQuery":
+        if op not in ("==", "!=", "<", "<=", ">", ">=", "in"):
+            raise ValueError(f"unsupported operator: {op}")
+        q = self._copy()
+        q._filters.append((field, op, value))
+        return q
+
+    def order_by(self, field: str, direction: str = ASCENDING) -> "LocalQuery":
+        q = self._copy()
+        q._order.append((field, DESCENDING if str(direction).upper().startswith("DESC") else ASCENDING))
+        return q
+
+    def limit(self, n: int) -> "LocalQuery":
+        q = self._copy()
+        q._limit = int(n)
+        return q
+
+    def start_after(self, snapshot: LocalSnapshot) -> "LocalQuery":
+        q = self._copy()
+        q._after = snapshot
+        return q
+
+    def _sql(self) -> Tuple[str, List[Any]]:
+        where, args = ["collection = ?"], [self._collection]
+        for field, op, value in self._filters:
+            if op == "in":
+                values = [_encode(v) for v in value]
+                where.append(f"{_expr(field)} IN ({','.join('?' * len(values))})" if values else "0")
+                args.extend(values)
+            else:
+                where.append(f"{_expr(field)} {'=' if op == '==' else op} ?")
+                args.append(_encode(value))
+        order = self._order or [("__name__", ASCENDING)]
+        if self._after is not None:
+            # Cursor: (order fields..., id) strictly after the snapshot's values
+            keys = [(f, d, _encode(self._after.get(f)) if f != "__name__" else self._after.id) for f, d in order]
+            if order[-1][0] != "__name__":
+                keys.append(("__name__", order[-1][1], self._after.id))
+            ors = []
+            for i, (f, d, v) in enumerate(keys):
+                eqs = [f"{_expr(pf)} = ?" for pf, _, _ in keys[:i]]
+                ors.append("(" + " AND ".join(eqs + [f"{_expr(f)} {'<' if d == DESCENDING else '>'} ?"]) + ")")
+                args.extend([pv for _, _, pv in keys[:i]] + [v])
+            where.append("(" + " OR ".join(ors) + ")")
+        sql = f"SELECT id, data FROM docs WHERE {' AND '.join(where)} ORDER BY "
+        sql += ", ".join(f"{_expr(f)} {'DESC' if d == DESCENDING else 'ASC'}" for f, d in order)
+        if order[-1][0] != "__name__":
+            sql += f", id {'DESC' if order[-1][1] == DESCENDING else 'ASC'}"
+        if self._limit is not None:
+            sql += f" LIMIT {int(self._limit)}"
+        return sql, args
+
+    def stream(self) -> Iterator[LocalSnapshot]:
+        sql, args = self._sql()
+        for doc_id, data in self._client._conn().execute(sql, args).fetchall():
+            yield LocalSnapshot(LocalDocumentRef(self._client, self._collection, doc_id), json.loads(data))
+
+    def get(self) -> List[LocalSnapshot]:
+        return list(self.stream())
+
+
+class LocalCollection(LocalQuery):
+    def document(self, doc_id: Optional[str] = None) -> LocalDocumentRef:
+        return LocalDocumentRef(self._client, self._collection, doc_id)
+
+
+class AlreadyExists(Exception):
+    """create() of a document that exists (mirrors google.api_core.exceptions.AlreadyExists)."""
+
+
+class LocalBatch:
+    def __init__(self, client: "LocalClient") -> None:
+        self._client = client
+        self._writes: List[Tuple[str, LocalDocumentRef, Optional[Dict[str, Any]], bool]] = []
+
+    def set(self, ref: LocalDocumentRef, data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append(("set", ref, data, merge))
+
+    def create(self, ref: LocalDocumentRef, data: Dict[str, Any]) -> None:
+        self._writes.append(("create", ref, data, False))
+
+    def update(self, ref: LocalDocumentRef, data: Dict[str, Any]) -> None:
+        self._writes.append(("set", ref, data, True))
+
+    def delete(self, ref: LocalDocumentRef) -> None:
+        self._writes.append(("delete", ref, None, False))
+
+    def commit(self) -> None:
+        self._client._write(self._writes)
+        self._writes = []
+
+
+class LocalClient:
+    """SQLite (WAL) document store with the Firestore client surface used by Store/FlightStore."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self._local = threading.local()
+        c = self._conn()
+        c.execute("CREATE TABLE IF NOT EXISTS docs (collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (collection, id))")
+        for fields in INDEXES:
+            cols = ", ".join(_expr(f) for f in fields)
+            c.execute(f"CREATE INDEX IF NOT EXISTS ix_{'_'.join(fields)} ON docs (collection, {cols}, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = c
+        return c
+
+    def collection(self, name: str) -> LocalCollection:
+        return LocalCollection(self, name)
+
+    def batch(self) -> LocalBatch:
+        return LocalBatch(self)
+
+    def get_all(self, refs: Iterable[LocalDocumentRef]) -> Iterator[LocalSnapshot]:
+        for ref in refs:
+            yield ref.get()
+
+    def transact(self, ref: LocalDocumentRef, fn: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """Atomic read-modify-write of one document: fn(current or None) returns the new document, or None to leave it."""
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute("SELECT data FROM docs WHERE collection = ? AND id = ?", (ref.collection, ref.id)).fetchone()
+            new = fn(_decode(json.loads(row[0])) if row else None)
+            if new is not None:
+                doc = _apply({}, new, datetime.now(timezone.utc), False)
+                c.execute(
+                    "INSERT OR REPLACE INTO docs (collection, id, data) VALUES (?, ?, ?)",
+                    (ref.collection, ref.id, json.dumps(_encode(doc), default=str)),
+                )
+            c.execute("COMMIT")
+            return new
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def _write(self, writes: List[Tuple[str, LocalDocumentRef, Optional[Dict[str, Any]], bool]]) -> None:
+        c = self._conn()
+        now = datetime.now(timezone.utc)
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for op, ref, data, merge in writes:
+                if op == "delete":
+                    c.execute("DELETE FROM docs WHERE collection = ? AND id = ?", (ref.collection, ref.id))
+                    continue
+                row = c.execute("SELECT data FROM docs WHERE collection = ? AND id = ?", (ref.collection, ref.id)).fetchone()
+                if op == "create" and row:
+                    raise AlreadyExists(f"{ref.collection}/{ref.id}")
+                old = _decode(json.loads(row[0])) if row else {}
+                doc = _apply(old if merge else {}, data or {}, now, merge)
+                c.execute(
+                    "INSERT OR REPLACE INTO docs (collection, id, data) VALUES (?, ?, ?)",
+                    (ref.collection, ref.id, json.dumps(_encode(doc), default=str)),
+                )
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
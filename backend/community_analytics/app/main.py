@@ -1,16 +1,34 @@
-from fastapi import FastAPI, HTTPException, Query
+import time
+
+_IMPORT_T0 = time.perf_counter()
+
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Tuple
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+import asyncio
+import json
 import os
+import sys
+import threading
 
 from .processing import Analyzer
+from . import geo_index, rollups, scheduler, shard_leases
 from .store import Store
+from .topic_jobs import TopicJobRunner, count_topics, summarize
 from .store_flights import FlightStore
-from .price_predictor import predict_should_buy
-from .flight_providers import fetch_from_providers, fetch_test_offers
+from .price_predictor import PriceSeries, predict_should_buy, predict_should_buy_batch
+from .flight_providers import _is_simulation, fetch_from_providers, fetch_test_offers
+from .async_providers import afetch_from_providers, aclose_client
+from .amadeus_auth import amadeus_tokens
+from . import metrics, provider_guard
+from .offer_cache import offer_cache
 from .payments import router as payments_router
+from .sweep import PhaseTimer, group_by_route, run_sweep, arun_sweep
+from .fare_calendar import CalendarRequest, Matrix, afetch_calendar, calendar_for, calendar_max_calls, fetch_calendar, plan_calendar
 
 app = FastAPI(title="WadaTrip Community Analytics", version="0.1.0")
 app.add_middleware(
@@ -21,12 +39,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+_T = time.perf_counter()
 store = Store(project_id=os.getenv("FIRESTORE_PROJECT_ID"))
-analyzer = Analyzer(lang=os.getenv("ANALYSIS_LANG", "en"))
 flight_store = FlightStore(project_id=os.getenv("FIRESTORE_PROJECT_ID"))
+topic_jobs = TopicJobRunner(store)
+# Models load on first use (or via ANALYZER_WARMUP), so this is cheap and /health answers right away;
+# online topic merges run in the topic job pool, not in this process
+analyzer = Analyzer(lang=os.getenv("ANALYSIS_LANG", "en"), merge_runner=topic_jobs.merge)
+# ALERT_SHARDING=1: this instance only checks alerts of the shards it holds a lease on (app/shard_leases.py)
+shard_leaser = shard_leases.ShardLeaser(flight_store.db) if shard_leases.is_enabled() else None
 app.include_router(payments_router)
 
 
+@app.middleware("http")
+async def _observe_latency(request: Request, call_next):
+    if not metrics.ENABLED:
+        return await call_next(request)
+    t = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route template (e.g. /analysis), not the raw path, to keep label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - t, method=request.method, route=route, status=status)
+
+
+STARTUP: Dict[str, Any] = {
+    "moduleImportMs": round((_T - _IMPORT_T0) * 1000.0, 1),
+    "clientsInitMs": round((time.perf_counter() - _T) * 1000.0, 1),
+}
+
+
+@app.on_event("startup")
+async def _startup() -> None:
+    STARTUP["appReadyMs"] = round((time.perf_counter() - _IMPORT_T0) * 1000.0, 1)
+    # ANALYZER_WARMUP: "1"/"all" for every model, or a comma list of sentiment,embedder,topics
+    warm = (os.getenv("ANALYZER_WARMUP") or "").strip().lower()
+    if warm and warm not in ("0", "false", "no", "off"):
+        analyzer.warm_up(None if warm in ("1", "true", "yes", "on", "all") else [c.strip() for c in warm.split(",")])
+    if shard_leaser is not None:
+        # Shard filters skip alerts without a shard field, so stamp them before taking any leases
+        await asyncio.to_thread(_ensure_backfill)
+        await asyncio.to_thread(shard_leaser.start)
+    # ALERT_TICK_INTERVAL_S > 0 runs the deadline-aware scheduler in-process (otherwise call POST /alerts/tick)
+    interval = float(os.getenv("ALERT_TICK_INTERVAL_S", "0") or 0)
+    if interval > 0:
+        _TICKER["task"] = asyncio.create_task(_tick_loop(interval))
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    task = _TICKER.get("task")
+    if task is not None:
+        task.cancel()
+    await aclose_client()
+    topic_jobs.close()
+    # Drain write-behind buffers so queued signals/analysis docs are not lost
+    await asyncio.to_thread(flight_store.writes.close)
+    await asyncio.to_thread(store.writes.close)
+    if shard_leaser is not None:
+        # Hand shards back only after this worker's signals are committed
+        await asyncio.to_thread(shard_leaser.stop)
+
+
 class IngestPayload(BaseModel):
     uid: Optional[str] = None
     location: str
@@ -36,6 +114,10 @@ class IngestPayload(BaseModel):
     createdAt: Optional[datetime] = None
 
 
+# Widest fare-calendar window (alerts and GET /fares/calendar)
+MAX_FLEX_DAYS = 30
+
+
 class CreateAlertPayload(BaseModel):
     uid: Optional[str] = None
     origin: str
@@ -43,6 +125,8 @@ class CreateAlertPayload(BaseModel):
     budget: float
     departureDate: Optional[str] = None
     maxWaitHours: int = 168
+    # Search departureDate ± flexDays with the fare calendar (app/fare_calendar.py)
+    flexDays: int = Field(0, ge=0, le=MAX_FLEX_DAYS)
 
 
 @app.post("/alerts/create")
@@ -52,9 +136,47 @@ def create_alert(p: CreateAlertPayload):
     return {"ok": True, "alertId": alert_id}
 
 
-@app.post("/alerts/check")
-def check_alert(alertId: Optional[str] = None, origin: Optional[str] = None, destination: Optional[str] = None, budget: Optional[float] = None, maxWaitHours: int = 168):
-    """Checks one alert by ID or an ad-hoc alert by params. If buy_now/within_budget, writes a signal doc."""
+def _attach_offers(res: Dict[str, Any], offers: List[Dict[str, Any]]) -> None:
+    res["offers"] = offers
+    # Every offer carries source "live" or "stub"; summarize so clients can tell simulated prices apart
+    res["offerSources"] = {
+        "live": sum(1 for o in offers if o.get("source", "live") == "live"),
+        "stub": sum(1 for o in offers if o.get("source") == "stub"),
+    }
+    if offers:
+        # Prefer live offers, then the Travelpayouts link if available; otherwise use cheapest offer
+        pool = [o for o in offers if o.get("source", "live") == "live"] or offers
+        pref = next((o for o in pool if o.get("provider") == "travelpayouts" and o.get("affiliate_link")), None)
+        res["affiliate_link"] = (pref or pool[0]).get("affiliate_link")
+
+
+def _flex_requests(alerts: List[Dict[str, Any]]) -> List[CalendarRequest]:
+    out: List[CalendarRequest] = []
+    for a in alerts:
+        try:
+            # Alerts stored before flexDays was validated may hold any value
+            flex = min(int(a.get("flexDays") or 0), MAX_FLEX_DAYS)
+        except (TypeError, ValueError):
+            flex = 0
+        if flex > 0 and a.get("departureDate") and a.get("origin") and a.get("destination"):
+            out.append((a["origin"], a["destination"], a["departureDate"], flex))
+    return out
+
+
+def _attach_calendar(res: Dict[str, Any], a: Dict[str, Any], matrix: Optional[Matrix], budget: float) -> bool:
+    """Adds fareCalendar for flexible alerts; True when the best date in the window is within budget."""
+    req = _flex_requests([a])
+    if not req or matrix is None:
+        return False
+    res["fareCalendar"] = calendar_for(matrix, *req[0])
+    best = res["fareCalendar"]["bestPrice"]
+    # Stub prices never trigger a real alert (they are only meaningful under SIMULATE_FLIGHTS)
+    live = res["fareCalendar"]["bestSource"] == "live" or _is_simulation()
+    return best is not None and best <= budget and live
+
+
+def _resolve_check(alertId: Optional[str], origin: Optional[str], destination: Optional[str], budget: Optional[float], maxWaitHours: int):
+    alert = None
     if alertId:
         alert = flight_store.get_alert(alertId)
         if not alert:
@@ -65,19 +187,16 @@ def check_alert(alertId: Optional[str] = None, origin: Optional[str] = None, des
         maxWaitHours = int(alert.get("maxWaitHours", maxWaitHours))
     if not (origin and destination and budget is not None):
         raise HTTPException(status_code=400, detail="missing parameters")
+    departure = alert.get("departureDate") if alert else None
+    return alert, origin, destination, float(budget), maxWaitHours, departure
 
-    departure = (alert.get("departureDate") if alertId else None) if 'alert' in locals() and alert else None
-    history = flight_store.fetch_history_prices(origin, destination, departure)
-    # Fetch live offers from providers (Kiwi/Skyscanner)
-    offers = fetch_from_providers(origin, destination, departure)
+
+def _finish_check(alertId: Optional[str], alert: Optional[Dict[str, Any]], origin: str, destination: str, budget: float, maxWaitHours: int, history: PriceSeries, offers: List[Dict[str, Any]], calendar: Optional[Matrix] = None) -> Dict[str, Any]:
     res = predict_should_buy(history, float(budget), float(maxWaitHours))
     # Attach providers and choose affiliate link from cheapest if available
-    res["offers"] = offers
-    if offers:
-        # Prefer Travelpayouts link if available; otherwise use cheapest offer
-        pref = next((o for o in offers if o.get("provider") == "travelpayouts" and o.get("affiliate_link")), None)
-        res["affiliate_link"] = (pref or offers[0]).get("affiliate_link")
-    triggered = res.get("withinBudget") or res.get("recommendation") == "buy_now"
+    _attach_offers(res, offers)
+    flex_hit = _attach_calendar(res, alert, calendar, float(budget)) if alert else False
+    triggered = res.get("withinBudget") or res.get("recommendation") == "buy_now" or flex_hit
     signal_id = None
     if triggered:
         payload = {
@@ -87,52 +206,291 @@ def check_alert(alertId: Optional[str] = None, origin: Optional[str] = None, des
             "budget": float(budget),
             "result": res,
         }
-        if alertId and alert:
+        if alert:
             payload["uid"] = alert.get("uid")
-        signal_id = flight_store.save_signal(payload)
-        # Save notification stub (frontend can pick and send push/email)
+        # Signal and notification stub (frontend can pick and send push/email) share one batch,
+        # committed before the response so the returned signalId always exists
         try:
-            flight_store.save_notification({
-                "uid": (alert.get("uid") if alertId and alert else None),
+            signal_id = flight_store.save_signal_with_notification(payload, {
+                "uid": (alert.get("uid") if alert else None),
                 "type": "flight_alert",
                 "title": "Flight Deal Found",
                 "body": f"{origin} → {destination} appears favorable. Book here: {res.get('affiliate_link', '')}",
-                "meta": {"origin": origin, "destination": destination, "budget": float(budget), "result": res, "signalId": signal_id},
-            })
-        except Exception:
-            pass
+                "meta": {"origin": origin, "destination": destination, "budget": float(budget), "result": res},
+            }, dedupe_key=_signal_key(alertId), sync=True)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"signal write failed: {e}")
     return {"ok": True, "result": res, "triggered": triggered, "signalId": signal_id}
 
 
+@app.post("/alerts/check")
+def check_alert(alertId: Optional[str] = None, origin: Optional[str] = None, destination: Optional[str] = None, budget: Optional[float] = None, maxWaitHours: int = 168):
+    """Checks one alert by ID or an ad-hoc alert by params. If buy_now/within_budget, writes a signal doc."""
+    alert, origin, destination, budget, maxWaitHours, departure = _resolve_check(alertId, origin, destination, budget, maxWaitHours)
+    history = flight_store.fetch_history_series(origin, destination, departure)
+    # Fetch live offers from providers (Travelpayouts/Amadeus)
+    offers = fetch_from_providers(origin, destination, departure)
+    flex = _flex_requests([alert]) if alert else []
+    calendar = fetch_calendar(plan_calendar(flex)) if flex else None
+    return _finish_check(alertId, alert, origin, destination, budget, maxWaitHours, history, offers, calendar)
+
+
+@app.post("/alerts/check_async")
+async def check_alert_async(alertId: Optional[str] = None, origin: Optional[str] = None, destination: Optional[str] = None, budget: Optional[float] = None, maxWaitHours: int = 168):
+    """Same as /alerts/check, but providers are queried concurrently on the event loop (see app/async_providers.py)."""
+    alert, origin, destination, budget, maxWaitHours, departure = await asyncio.to_thread(_resolve_check, alertId, origin, destination, budget, maxWaitHours)
+    flex = _flex_requests([alert]) if alert else []
+    history, offers, calendar = await asyncio.gather(
+        asyncio.to_thread(flight_store.fetch_history_series, origin, destination, departure),
+        afetch_from_providers(origin, destination, departure),
+        afetch_calendar(plan_calendar(flex)) if flex else asyncio.sleep(0, None),
+    )
+    return await asyncio.to_thread(_finish_check, alertId, alert, origin, destination, budget, maxWaitHours, history, offers, calendar)
+
+
+def _sweep_fetch_route(key):
+    origin, destination, departure = key
+    return {
+        "history": flight_store.fetch_history_series(origin, destination, departure),
+        "offers": fetch_from_providers(origin, destination, departure),
+    }
+
+
+def _sweep_evaluate(batch: List[Tuple[Dict[str, Any], Dict[str, Any]]], calendar: Optional[Matrix] = None) -> List[Any]:
+    """Scores every alert of the sweep with one predict_should_buy_batch call."""
+    out: List[Any] = [None] * len(batch)
+    idx: List[int] = []
+    series, budgets, hours = [], [], []
+    for i, (a, data) in enumerate(batch):
+        try:
+            budget, wait = float(a.get("budget")), float(a.get("maxWaitHours", 168))
+        except Exception as e:
+            out[i] = e
+            continue
+        idx.append(i)
+        series.append(data["history"])
+        budgets.append(budget)
+        hours.append(wait)
+    for j, (i, res) in enumerate(zip(idx, predict_should_buy_batch(series, budgets, hours))):
+        _attach_offers(res, batch[i][1]["offers"])
+        flex_hit = _attach_calendar(res, batch[i][0], calendar, budgets[j])
+        res["triggered"] = res.get("withinBudget") or res.get("recommendation") == "buy_now" or flex_hit
+        out[i] = res
+    return out
+
+
+def _signal_key(alert_id: Optional[str]) -> Optional[str]:
+    """Deterministic signal/notification id per alert and SIGNAL_DEDUPE_WINDOW_S window (one deal notice per window)."""
+    if not alert_id:
+        return None
+    window = max(1, int(float(os.getenv("SIGNAL_DEDUPE_WINDOW_S", "3600"))))
+    return f"{alert_id}-{int(time.time()) // window}"
+
+
+def _shards() -> Optional[List[int]]:
+    return shard_leaser.owned_shards() if shard_leaser is not None else None
+
+
+def _sweep_persist(a: Dict[str, Any], res: Dict[str, Any], committed: Dict[str, bool]) -> Optional[str]:
+    res = {k: v for k, v in res.items() if k != "triggered"}
+    key = _signal_key(a.get("_id"))
+    payload = {"alertId": a.get("_id"), "uid": a.get("uid"), "origin": a.get("origin"), "destination": a.get("destination"), "budget": float(a.get("budget")), "result": res}
+    return flight_store.save_signal_with_notification(payload, {
+        "uid": a.get("uid"),
+        "type": "flight_alert",
+        "title": "Flight Deal Found",
+        "body": f"{a.get('origin')} → {a.get('destination')} appears favorable. Book here: {res.get('affiliate_link', '')}",
+        "meta": {"origin": a.get("origin"), "destination": a.get("destination"), "budget": float(a.get("budget")), "result": res},
+    }, dedupe_key=key, on_done=lambda ok: committed.__setitem__(key, ok))
+
+
+def _sweep_persister() -> Tuple[Callable[[Dict[str, Any], Dict[str, Any]], Optional[str]], Dict[str, bool]]:
+    """persist callback for one sweep plus {signalId: committed}, filled in as the write buffer commits."""
+    committed: Dict[str, bool] = {}
+    return (lambda a, res: _sweep_persist(a, res, committed)), committed
+
+
+def _fenced(alerts: List[Dict[str, Any]], fetch_route: Callable[..., Any], persist: Callable[..., Optional[str]]):
+    """
+    With ALERT_SHARDING, wrap a sweep's callbacks in a lease Fence: a route whose shards were lost
+    mid-sweep makes no upstream calls and writes no signals. Returns (fetch_route, persist, fence or None).
+    """
+    if shard_leaser is None:
+        return fetch_route, persist, None
+    fence = shard_leases.Fence(shard_leaser)
+    routes = group_by_route(alerts)
+
+    if asyncio.iscoroutinefunction(fetch_route):
+        async def _fetch(key):
+            fence.check(routes.get(key, []))
+            return await fetch_route(key)
+    else:
+        def _fetch(key):
+            fence.check(routes.get(key, []))
+            return fetch_route(key)
+
+    def _persist(a: Dict[str, Any], res: Dict[str, Any]) -> Optional[str]:
+        fence.check([a])
+        return persist(a, res)
+
+    return _fetch, _persist, fence
+
+
+def _fence_stats(fence: Optional[shard_leases.Fence]) -> Dict[str, Any]:
+    return {"epochs": {str(s): e for s, e in fence.epochs.items()}, "skippedAlerts": fence.skipped} if fence is not None else {}
+
+
+def _settle_signals(results: List[Dict[str, Any]], committed: Dict[str, bool]) -> None:
+    """After the flush: keep signalId only for committed signals; the rest are marked pending or failed."""
+    for r in results:
+        sid = r.get("signalId")
+        if sid is None or committed.get(sid):
+            continue
+        r["signalId"] = None
+        if sid in committed:
+            r["signalError"] = "signal write failed"
+        else:
+            r["signalPending"] = True
+
+
 @app.post("/alerts/run_checks")
 def run_checks():
-    alerts = flight_store.get_active_alerts()
-    results = []
-    for a in alerts:
+    """Checks every active alert, fetching history/offers once per unique route (see app/sweep.py)."""
+    timer = PhaseTimer()
+    _ensure_backfill()
+    alerts = flight_store.get_active_alerts(_shards())
+    timer.mark("load")
+    # One deduped, call-budgeted fare calendar for every flexible alert of the sweep
+    plan = plan_calendar(_flex_requests(alerts))
+    calendar = fetch_calendar(plan) if plan.months or plan.dates else {}
+    timer.mark("calendar")
+    persist, committed = _sweep_persister()
+    fetch, persist, fence = _fenced(alerts, _sweep_fetch_route, persist)
+    results, stats = run_sweep(alerts, fetch, lambda b: _sweep_evaluate(b, calendar), persist, timer=timer)
+    stats["fareCalendar"] = plan.stats()
+    stats["fence"] = _fence_stats(fence)
+    # persist only queued the writes; commit them as a handful of batches before answering
+    stats["writes"] = flight_store.writes.flush()
+    _settle_signals(results, committed)
+    timer.mark("commit")
+    return {"ok": True, "count": len(results), "results": results, "stats": stats}
+
+
+async def _asweep_fetch_route(key):
+    origin, destination, departure = key
+    history, offers = await asyncio.gather(
+        asyncio.to_thread(flight_store.fetch_history_series, origin, destination, departure),
+        afetch_from_providers(origin, destination, departure),
+    )
+    return {"history": history, "offers": offers}
+
+
+@app.post("/alerts/run_checks_async")
+async def run_checks_async():
+    """Async variant of /alerts/run_checks: route jobs run as coroutines bounded by SWEEP_MAX_WORKERS."""
+    timer = PhaseTimer()
+    await asyncio.to_thread(_ensure_backfill)
+    alerts = await asyncio.to_thread(flight_store.get_active_alerts, _shards())
+    timer.mark("load")
+    plan = plan_calendar(_flex_requests(alerts))
+    calendar = await afetch_calendar(plan) if plan.months or plan.dates else {}
+    timer.mark("calendar")
+    persist, committed = _sweep_persister()
+    fetch, persist, fence = _fenced(alerts, _asweep_fetch_route, persist)
+    results, stats = await arun_sweep(alerts, fetch, lambda b: _sweep_evaluate(b, calendar), persist, timer=timer)
+    stats["fareCalendar"] = plan.stats()
+    stats["fence"] = _fence_stats(fence)
+    stats["writes"] = await asyncio.to_thread(flight_store.writes.flush)
+    _settle_signals(results, committed)
+    timer.mark("commit")
+    return {"ok": True, "count": len(results), "results": results, "stats": stats}
+
+
+_TICKER: Dict[str, Any] = {"task": None, "backfilled": False, "ticks": 0, "errors": 0, "lastError": None, "lastTickAt": None}
+_BACKFILL_LOCK = threading.Lock()
+
+
+def _ensure_backfill() -> int:
+    """Alerts created before scheduling/sharding lack nextCheckAt/shard; fill them once per process."""
+    with _BACKFILL_LOCK:
+        if _TICKER["backfilled"]:
+            return 0
+        n = flight_store.backfill_alerts(datetime.now(timezone.utc))
+        flight_store.writes.flush()
+        _TICKER["backfilled"] = True
+        return n
+
+
+def _run_tick(max_calls: Optional[int] = None) -> Dict[str, Any]:
+    timer = PhaseTimer()
+    now = datetime.now(timezone.utc)
+    backfilled = _ensure_backfill()
+    due, expired = scheduler.split_expired(flight_store.get_due_alerts(now, scheduler.max_due(), _shards()), now)
+    flight_store.expire_alerts([a["_id"] for a in expired], now)
+    timer.mark("load")
+    plan = scheduler.plan_tick(due, scheduler.max_calls() if max_calls is None else max_calls)
+    # Flexible alerts' calendar calls come out of the same per-tick budget
+    cal_budget = min(calendar_max_calls(), max(0, plan.max_calls - plan.cost))
+    cal_plan = plan_calendar(_flex_requests(plan.alerts), max_calls=cal_budget)
+    calendar = fetch_calendar(cal_plan) if cal_plan.months or cal_plan.dates else {}
+    timer.mark("calendar")
+    persist, committed = _sweep_persister()
+    fetch, persist, fence = _fenced(plan.alerts, _sweep_fetch_route, persist)
+    results, stats = run_sweep(plan.alerts, fetch, lambda b: _sweep_evaluate(b, calendar), persist, timer=timer)
+    # Only reschedule alerts whose shard is still ours; the new owner schedules the rest
+    held = [a for a in plan.alerts if fence is None or fence.holds(a)]
+    flight_store.schedule_alerts(scheduler.reschedule(held, results, now))
+    timer.mark("schedule")
+    stats["fareCalendar"] = cal_plan.stats()
+    stats["scheduler"] = {**plan.stats(), "backfilled": backfilled, "expired": len(expired)}
+    stats["fence"] = _fence_stats(fence)
+    stats["writes"] = flight_store.writes.flush()
+    _settle_signals(results, committed)
+    timer.mark("commit")
+    return {"ok": True, "count": len(results), "results": results, "stats": stats}
+
+
+async def _tick_loop(interval: float) -> None:
+    while True:
         try:
-            history = flight_store.fetch_history_prices(a.get("origin"), a.get("destination"), a.get("departureDate"))
-            offers = fetch_from_providers(a.get("origin"), a.get("destination"), a.get("departureDate"))
-            res = predict_should_buy(history, float(a.get("budget")), float(a.get("maxWaitHours", 168)))
-            res["offers"] = offers
-            if offers:
-                pref = next((o for o in offers if o.get("provider") == "travelpayouts" and o.get("affiliate_link")), None)
-                res["affiliate_link"] = (pref or offers[0]).get("affiliate_link")
-            triggered = res.get("withinBudget") or res.get("recommendation") == "buy_now"
-            signal_id = None
-            if triggered:
-                payload = {"alertId": a.get("_id"), "uid": a.get("uid"), "origin": a.get("origin"), "destination": a.get("destination"), "budget": float(a.get("budget")), "result": res}
-                signal_id = flight_store.save_signal(payload)
-                flight_store.save_notification({
-                    "uid": a.get("uid"),
-                    "type": "flight_alert",
-                    "title": "Flight Deal Found",
-                    "body": f"{a.get('origin')} → {a.get('destination')} appears favorable. Book here: {res.get('affiliate_link', '')}",
-                    "meta": {"origin": a.get("origin"), "destination": a.get("destination"), "budget": float(a.get("budget")), "result": res, "signalId": signal_id},
-                })
-            results.append({"alertId": a.get("_id"), "triggered": triggered, "result": res, "signalId": signal_id})
+            await asyncio.to_thread(_run_tick)
+            _TICKER["ticks"] += 1
+            metrics.inc("alert_ticks_total", result="ok")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            results.append({"alertId": a.get("_id"), "error": str(e)})
-    return {"ok": True, "count": len(results), "results": results}
+            # Keep ticking, but make the failure visible in GET /alerts/tick/stats and /metrics
+            _TICKER["errors"] += 1
+            _TICKER["lastError"] = f"{type(e).__name__}: {e}"
+            metrics.inc("alert_ticks_total", result="error")
+        _TICKER["lastTickAt"] = datetime.now(timezone.utc).isoformat()
+        await asyncio.sleep(interval)
+
+
+@app.post("/alerts/tick")
+def alerts_tick(maxCalls: Optional[int] = Query(None, ge=0)):
+    """Checks only the alerts whose nextCheckAt is due, within a per-tick upstream call budget (app/scheduler.py)."""
+    return _run_tick(maxCalls)
+
+
+@app.get("/alerts/tick/stats")
+def alerts_tick_stats():
+    """In-process scheduler loop (ALERT_TICK_INTERVAL_S) counters."""
+    return {"ok": True, "running": _TICKER["task"] is not None, **{k: _TICKER[k] for k in ("ticks", "errors", "lastError", "lastTickAt")}}
+
+
+@app.get("/alerts/shards")
+def alerts_shards():
+    """Shard leases held by this instance (ALERT_SHARDING=1)."""
+    return {"ok": True, "enabled": shard_leaser is not None, "leaser": shard_leaser.stats() if shard_leaser else None}
+
+
+@app.get("/fares/calendar")
+async def fares_calendar(origin: str, destination: str, date: str, flexDays: int = Query(3, ge=0, le=MAX_FLEX_DAYS), currency: str = "USD"):
+    """Cheapest fare per day for date ± flexDays plus the best date (see app/fare_calendar.py)."""
+    plan = plan_calendar([(origin, destination, date, flexDays)], currency=currency)
+    matrix = await afetch_calendar(plan)
+    return {"ok": True, "origin": origin, "destination": destination, **calendar_for(matrix, origin, destination, date, flexDays), "stats": plan.stats()}
 
 
 @app.get("/providers/test")
@@ -145,11 +503,42 @@ def providers_test(origin: str, destination: str, date: str | None = None, curre
     return {"ok": True, "origin": origin, "destination": destination, "date": date, "currency": currency, "offers": offers}
 
 
+@app.get("/providers/stats")
+def providers_stats():
+    """Process-local provider counters (health/latency per provider, Amadeus token cache, offer cache, price-history cache)."""
+    return {"ok": True, "providers": provider_guard.stats(), "amadeusToken": amadeus_tokens.stats(), "offerCache": offer_cache.stats(), "historyCache": flight_store.history.stats()}
+
+
+@app.get("/analyzer/stats")
+def analyzer_stats():
+    """Micro-batching settings, batch-size and queue-latency histograms for the Analyzer."""
+    return {"ok": True, "analyzer": analyzer.stats()}
+
+
+@app.get("/writes/stats")
+def writes_stats():
+    """Write-behind buffer counters (pending, commits, retries, failed writes, backpressure waits)."""
+    return {"ok": True, "analysis": store.writes.stats(), "flights": flight_store.writes.stats()}
+
+
+@app.get("/metrics")
+def metrics_text():
+    """Prometheus text exposition of the hot-path histograms/counters (METRICS_ENABLED=1)."""
+    body = metrics.render() if metrics.ENABLED else "# metrics disabled (set METRICS_ENABLED=1)\n"
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 def health():
     return {"ok": True}
 
 
+@app.get("/health/startup")
+def health_startup():
+    """Startup cost breakdown: app import/init time plus import/load time per Analyzer model."""
+    return {"ok": True, "app": STARTUP, "models": analyzer.startup_report()}
+
+
 @app.post("/ingest")
 def ingest(payload: IngestPayload):
     if not payload.text or not payload.location:
@@ -157,7 +546,8 @@ def ingest(payload: IngestPayload):
     created = payload.createdAt or datetime.utcnow()
 
     sent = analyzer.sentiment(payload.text)
-    topics = analyzer.topics_batch([payload.text])
+    topics = [analyzer.topics_one(payload.text)]
+    analyzer.observe([payload.text])
     analysis_doc = {
         "uid": payload.uid,
         "location": payload.location,
@@ -169,45 +559,172 @@ def ingest(payload: IngestPayload):
         "sentimentScore": sent["score"],
         "topics": topics[0].get("labels", []),
     }
-    store.save_analysis(analysis_doc)
+    try:
+        store.save_analysis(analysis_doc, sync=True)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"analysis write failed: {e}")
     return {"ok": True, "analysis": analysis_doc}
 
 
+def _json_default(o: Any) -> Any:
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return str(o)
+
+
+def _ndjson(lines: Iterator[Dict[str, Any]]) -> StreamingResponse:
+    """One JSON object per line, produced as the underlying store cursor advances."""
+    return StreamingResponse((json.dumps(x, default=_json_default) + "\n" for x in lines), media_type="application/x-ndjson")
+
+
+def _chunks(it: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _count_analysis(r: Dict[str, Any], sentiments: Dict[str, int], topics: Dict[str, int]) -> None:
+    s = (r.get("sentiment") or "unknown").lower()
+    sentiments[s] = sentiments.get(s, 0) + 1
+    for t in r.get("topics", []) or []:
+        topics[t] = topics.get(t, 0) + 1
+
+
 @app.get("/analysis")
-def get_analysis(location: str = Query(...), sinceDays: int = Query(7)):
+def get_analysis(location: str = Query(...), sinceDays: int = Query(7), format: str = Query("json")):
+    """Aggregates for a location; format=ndjson streams every analysis row and ends with a summary line."""
     since = datetime.utcnow() - timedelta(days=sinceDays)
-    rows = store.fetch_analysis(location=location, since=since)
-    # Aggregate sentiments and topics
+    if format == "ndjson":
+        def _lines():
+            sentiments: Dict[str, int] = {}
+            topics: Dict[str, int] = {}
+            count = 0
+            for r in store.iter_analysis(location, since):
+                _count_analysis(r, sentiments, topics)
+                count += 1
+                yield r
+            yield {"summary": {"location": location, "sinceDays": sinceDays, "sentiments": sentiments, "topics": topics, "count": count}}
+
+        return _ndjson(_lines())
+    if store.rollups_cover(sinceDays, location):
+        # Merge the location's day buckets (window is whole UTC days) instead of scanning raw rows
+        agg = rollups.merge_buckets(store.fetch_rollups(location, sinceDays))
+        return {"ok": True, "location": location, "sinceDays": sinceDays, "sentiments": agg["sentiments"], "topics": agg["topics"], "count": agg["count"]}
+    # Aggregate sentiments and topics while paging through the window
     sentiments: Dict[str, int] = {}
     topics: Dict[str, int] = {}
-    for r in rows:
-        s = (r.get("sentiment") or "unknown").lower()
-        sentiments[s] = sentiments.get(s, 0) + 1
-        for t in r.get("topics", []) or []:
-            topics[t] = topics.get(t, 0) + 1
-    return {"ok": True, "location": location, "sinceDays": sinceDays, "sentiments": sentiments, "topics": topics, "count": len(rows)}
+    count = 0
+    for r in store.iter_analysis(location, since):
+        _count_analysis(r, sentiments, topics)
+        count += 1
+    return {"ok": True, "location": location, "sinceDays": sinceDays, "sentiments": sentiments, "topics": topics, "count": count}
 
 
 @app.get("/topics")
-def get_topics(location: str = Query(...), sinceDays: int = Query(30)):
+def get_topics(location: str = Query(...), sinceDays: int = Query(30), format: str = Query("json")):
+    """Topic label counts; texts are paged from the store and transformed TOPICS_CHUNK at a time.
+
+    format=ndjson streams {text, labels} per message and ends with a summary line.
+    """
     since = datetime.utcnow() - timedelta(days=sinceDays)
-    texts = store.fetch_texts(location=location, since=since)
-    if not texts:
-        return {"ok": True, "topics": [], "count": 0}
-    res = analyzer.topics_batch(texts)
-    # Summarize labels
-    label_counts: Dict[str, int] = {}
-    for r in res:
-        for l in r.get("labels", []):
-            label_counts[l] = label_counts.get(l, 0) + 1
-    topics = sorted([{ "label": k, "count": v } for k, v in label_counts.items()], key=lambda x: -x["count"])
-    return {"ok": True, "topics": topics, "count": len(texts)}
+    chunk_size = int(os.getenv("TOPICS_CHUNK", "256"))
+
+    def _rows() -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for chunk in _chunks(store.iter_texts(location, since), chunk_size):
+            yield from zip(chunk, analyzer.topics_batch(chunk))
+
+    if format == "ndjson":
+        def _lines():
+            label_counts: Dict[str, int] = {}
+            count = 0
+            for text, r in _rows():
+                for l in r.get("labels", []):
+                    label_counts[l] = label_counts.get(l, 0) + 1
+                count += 1
+                yield {"text": text, "labels": r.get("labels", [])}
+            yield {"summary": {"topics": summarize(label_counts), "count": count}}
+
+        return _ndjson(_lines())
+    return {"ok": True, **count_topics(store, analyzer, location, since, chunk_size)}
+
+
+@app.post("/topics/jobs")
+def submit_topic_job(location: str = Query(...), sinceDays: int = Query(30)):
+    """Queues GET /topics work on the topic job process pool; poll GET /topics/jobs/{jobId}."""
+    return {"ok": True, **topic_jobs.submit(location, sinceDays)}
+
+
+@app.get("/topics/jobs/stats")
+def topic_job_stats():
+    return {"ok": True, **topic_jobs.stats()}
+
+
+@app.get("/topics/jobs/{jobId}")
+def get_topic_job(jobId: str):
+    job = topic_jobs.get(jobId)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return {"ok": True, **job}
+
+
+@app.post("/topics/model/fit")
+def fit_topic_model(sinceDays: int = Query(90, ge=1, le=365)):
+    """Refits and publishes the topic model on recent messages in the topic job pool (admin/cron); poll GET /topics/jobs/{jobId}."""
+    return {"ok": True, "scheduled": True, "sinceDays": sinceDays, **topic_jobs.submit_fit(sinceDays)}
+
+
+_REBUILDS: Dict[str, Dict[str, Any]] = {
+    k: {"runs": 0, "errors": 0, "lastError": None, "lastResult": None, "finishedAt": None} for k in ("rollups", "geoTiles")
+}
+
+
+def _rebuild(kind: str, fn: Callable[[], Dict[str, Any]]) -> None:
+    """Runs a background rebuild; failures are logged and kept for GET /analysis/rebuild/stats and /metrics."""
+    rec = _REBUILDS[kind]
+    try:
+        rec["lastResult"] = fn()
+        rec["runs"] += 1
+        metrics.inc("aggregate_rebuilds_total", kind=kind, result="ok")
+    except Exception as e:
+        rec["errors"] += 1
+        rec["lastError"] = f"{type(e).__name__}: {e}"
+        metrics.inc("aggregate_rebuilds_total", kind=kind, result="error")
+        print(json.dumps({"event": "rebuild_failed", "kind": kind, "error": rec["lastError"]}), file=sys.stderr, flush=True)
+    rec["finishedAt"] = datetime.now(timezone.utc).isoformat()
+
+
+@app.post("/analysis/rollups/rebuild")
+def rebuild_rollups(background: BackgroundTasks, sinceDays: int = Query(90, ge=1, le=365), location: Optional[str] = None):
+    """Recomputes communityAggregates day buckets from raw analysis docs in the background (admin/backfill)."""
+    background.add_task(_rebuild, "rollups", lambda: store.rebuild_rollups(since_days=sinceDays, location=location))
+    return {"ok": True, "scheduled": True, "sinceDays": sinceDays, "location": location}
+
+
+@app.post("/analysis/geo/rebuild")
+def rebuild_geo_tiles(background: BackgroundTasks, sinceDays: int = Query(90, ge=1, le=365)):
+    """Recomputes communityGeoTiles from raw analysis docs in the background (admin/backfill)."""
+    background.add_task(_rebuild, "geoTiles", lambda: store.rebuild_geo_tiles(since_days=sinceDays))
+    return {"ok": True, "scheduled": True, "sinceDays": sinceDays}
+
+
+@app.get("/analysis/rebuild/stats")
+def rebuild_stats():
+    """Outcome of the background rollup/geo tile rebuilds of this instance."""
+    return {"ok": True, **_REBUILDS}
 
 
 @app.get("/analysis/locations")
-def get_locations_overview(sinceDays: int = Query(7)):
+def get_locations_overview(sinceDays: int = Query(7, ge=1, le=365), bbox: Optional[str] = Query(None), zoom: int = Query(10)):
+    """Per-location points; with bbox=south,west,north,east (and map zoom) only the clusters in the viewport."""
+    if bbox is not None:
+        return _locations_in_viewport(sinceDays, bbox, zoom)
+    if store.rollups_cover(sinceDays):
+        return _locations_from_rollups(sinceDays)
     since = datetime.utcnow() - timedelta(days=sinceDays)
-    rows = store.fetch_analysis_since(since)
+    rows = store.iter_analysis(None, since)
     by_loc: Dict[str, Dict[str, int]] = {}
     accum_coords: Dict[str, Dict[str, float]] = {}
     counts: Dict[str, int] = {}
@@ -235,3 +752,39 @@ def get_locations_overview(sinceDays: int = Query(7)):
             lng = accum_coords[loc]["lng"] / counts[loc]
         points.append({"location": loc, "sentiments": senti, "count": sum(senti.values()), "lat": lat, "lng": lng})
     return {"ok": True, "sinceDays": sinceDays, "locations": by_loc, "points": points}
+
+
+def _locations_in_viewport(sinceDays: int, bbox: str, zoom: int) -> Dict[str, Any]:
+    if sinceDays > geo_index.MAX_BBOX_DAYS:
+        raise HTTPException(status_code=400, detail=f"sinceDays must be <= {geo_index.MAX_BBOX_DAYS} with bbox")
+    try:
+        box = geo_index.parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Over GEO_MAX_READS tile reads (tiles x days) at every level, the scan is the cheaper read
+    tile_plan = geo_index.plan(box, zoom, sinceDays) if store.geo_tiles_cover(sinceDays) else None
+    if tile_plan is not None:
+        precision, tile_precision, tiles = tile_plan
+        clusters = geo_index.cluster_tiles(store.fetch_geo_tiles(tiles, sinceDays), box, precision)
+        source = {"index": "geoTiles", "tilePrecision": tile_precision, "tiles": len(tiles), "reads": len(tiles) * sinceDays}
+    else:
+        precision = geo_index.precision_for_zoom(zoom)
+        since = datetime.utcnow() - timedelta(days=sinceDays)
+        clusters = geo_index.cluster_rows(store.iter_analysis(None, since), box, precision)
+        source = {"index": "scan"}
+    return {"ok": True, "sinceDays": sinceDays, "bbox": list(box), "zoom": zoom, "precision": precision, "clusters": clusters, **source}
+
+
+def _locations_from_rollups(sinceDays: int) -> Dict[str, Any]:
+    by_bucket: Dict[str, List[Dict[str, Any]]] = {}
+    for b in store.fetch_rollups_all(sinceDays):
+        by_bucket.setdefault(b.get("location") or "unknown", []).append(b)
+    by_loc: Dict[str, Dict[str, int]] = {}
+    points = []
+    for loc, buckets in by_bucket.items():
+        agg = rollups.merge_buckets(buckets)
+        by_loc[loc] = agg["sentiments"]
+        lat = agg["latSum"] / agg["coords"] if agg["coords"] else None
+        lng = agg["lngSum"] / agg["coords"] if agg["coords"] else None
+        points.append({"location": loc, "sentiments": agg["sentiments"], "count": sum(agg["sentiments"].values()), "lat": lat, "lng": lng})
+    return {"ok": True, "sinceDays": sinceDays, "locations": by_loc, "points": points}
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Minimal Prometheus text-format registry (counters + histograms with labels), no extra
+# dependency. Collection is switched on with METRICS_ENABLED=1; when it is off every helper
+# returns right away, so the instrumented hot paths pay a single boolean check.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _is_enabled() -> bool:
+    val = (os.getenv("METRICS_ENABLED") or "0").strip().lower()
+    return val in ("1", "true", "yes", "y", "on")
+
+
+ENABLED = _is_enabled()
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels: Any) -> None:
+        k = _key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_fmt_labels(k)} {_fmt_num(v)}" for k, v in sorted(values.items())]
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List[float]] = {}  # per-bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        k = _key(labels)
+        with self._lock:
+            s = self._series.get(k)
+            if s is None:
+                s = self._series[k] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+                    break
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for k, s in sorted(series.items()):
+            cum = 0.0
+            for b, n in zip(self.buckets, s):
+                cum += n
+                out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', _fmt_num(b)))} {_fmt_num(cum)}")
+            out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', '+Inf'))} {_fmt_num(s[-1])}")
+            out.append(f"{self.name}_sum{_fmt_labels(k)} {repr(s[-2])}")
+            out.append(f"{self.name}_count{_fmt_labels(k)} {_fmt_num(s[-1])}")
+        return out
+
+
+_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+REGISTRY: Dict[str, Any] = {
+    m.name: m
+    for m in (
+        Histogram("http_request_duration_seconds", "HTTP request latency by method, route and status."),
+        Histogram("provider_request_duration_seconds", "Live upstream provider call latency by provider and outcome."),
+        Counter("provider_skipped_total", "Provider calls not made, by provider and reason (circuit_open, rate_limited, budget)."),
+        Counter("provider_stub_offers_total", "Stub offer sets served instead of live data, by provider."),
+        Histogram("store_query_duration_seconds", "Document store read latency by collection and operation."),
+        Counter("store_documents_read_total", "Documents read from the store by collection."),
+        Counter("store_documents_written_total", "Documents written (set/delete) to the store by collection."),
+        Histogram("analyzer_inference_duration_seconds", "Analyzer model inference latency by operation."),
+        Counter("analyzer_cache_requests_total", "Analyzer result cache lookups by cache (sentiment, topics) and result (hit, miss)."),
+        Histogram("analyzer_batch_size", "Texts per Analyzer inference call by operation.", _SIZE_BUCKETS),
+        Histogram("predictor_duration_seconds", "predict_should_buy latency by mode (single, batch)."),
+        Histogram("sweep_phase_duration_seconds", "Alert sweep phase latency by phase."),
+        Counter("alert_ticks_total", "In-process scheduler ticks by result (ok, error)."),
+        Counter("aggregate_rebuilds_total", "Background rollup/geo tile rebuilds by kind and result (ok, error)."),
+    )
+}
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    if ENABLED:
+        REGISTRY[name].inc(value, **labels)
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    if ENABLED:
+        REGISTRY[name].observe(value, **labels)
+
+
+@contextmanager
+def timer(name: str, **labels: Any) -> Iterator[None]:
+    """Observe the wall time of the block in seconds (no-op when metrics are disabled)."""
+    if not ENABLED:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY[name].observe(time.perf_counter() - t, **labels)
+
+
+def timed(name: str, **labels: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of timer(); the enabled check happens per call, so it is free when off."""
+
+    def deco(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                REGISTRY[name].observe(time.perf_counter() - t, **labels)
+
+        return wrapper
+
+    return deco
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in REGISTRY.values():
+        lines += m.render()
+    return "\n".join(lines) + "\n"
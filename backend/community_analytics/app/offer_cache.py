@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# (provider, origin, destination, date, currency)
+OfferKey = Tuple[str, str, str, str, str]
+Offers = List[Dict[str, Any]]
+
+_DEFAULT_TTL = {"travelpayouts": 900.0, "amadeus": 300.0}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class SQLiteOfferBackend:
+    """Shared second-level store so several uvicorn workers on one host reuse each other's fetches."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS offers (k TEXT PRIMARY KEY, stored_at REAL NOT NULL, payload TEXT NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = c
+        return c
+
+    @staticmethod
+    def _k(key: OfferKey) -> str:
+        return "|".join(key)
+
+    def get(self, key: OfferKey) -> Optional[Tuple[float, Offers]]:
+        row = self._conn().execute("SELECT stored_at, payload FROM offers WHERE k = ?", (self._k(key),)).fetchone()
+        if not row:
+            return None
+        return float(row[0]), json.loads(row[1])
+
+    def set(self, key: OfferKey, stored_at: float, offers: Offers) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO offers (k, stored_at, payload) VALUES (?, ?, ?)",
+            (self._k(key), stored_at, json.dumps(offers)),
+        )
+
+    def purge(self, older_than: float) -> int:
+        return self._conn().execute("DELETE FROM offers WHERE stored_at < ?", (older_than,)).rowcount
+
+
+class OfferCache:
+    """
+    Bounded LRU of provider offers with per-provider TTL.
+
+    Entries younger than ttl(provider) are served directly. Entries within the following
+    stale window are served as-is while one background refresh runs (stale-while-revalidate).
+    Concurrent misses for the same key share a single upstream call.
+    """
+
+    def __init__(self, max_entries: int = 2048, backend: Optional[SQLiteOfferBackend] = None, purge_every: int = 500) -> None:
+        self.max_entries = max_entries
+        self.backend = backend
+        # Every purge_every backend writes, rows past TTL + stale window (of any provider seen) are deleted
+        self.purge_every = max(1, int(purge_every))
+        self._writes = 0
+        self._providers = set(_DEFAULT_TTL)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[OfferKey, Tuple[float, Offers]]" = OrderedDict()
+        self._inflight: Dict[OfferKey, Future] = {}
+        self._ainflight: Dict[OfferKey, asyncio.Future] = {}
+        self._stats = {"hits": 0, "staleHits": 0, "misses": 0, "coalesced": 0, "backendHits": 0, "refreshes": 0, "evictions": 0, "errors": 0, "purged": 0}
+
+    def ttl(self, provider: str) -> float:
+        return _env_float(f"OFFER_CACHE_TTL_{provider.upper()}_S", _DEFAULT_TTL.get(provider, 600.0))
+
+    def stale_window(self, provider: str) -> float:
+        return _env_float("OFFER_CACHE_STALE_S", self.ttl(provider))
+
+    def _bump(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _lookup(self, key: OfferKey) -> Optional[Tuple[float, Offers]]:
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                return hit
+        if self.backend is not None:
+            try:
+                hit = self.backend.get(key)
+            except Exception:
+                hit = None
+            if hit is not None:
+                self._bump("backendHits")
+                self._put_local(key, hit[0], hit[1])
+                return hit
+        return None
+
+    def _put_local(self, key: OfferKey, stored_at: float, offers: Offers) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at, offers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _store(self, key: OfferKey, offers: Offers) -> None:
+        if not offers:
+            return
+        now = time.time()
+        self._put_local(key, now, offers)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, now, offers)
+            except Exception:
+                pass
+            self._maybe_purge(key[0], now)
+
+    def _maybe_purge(self, provider: str, now: float) -> None:
+        with self._lock:
+            self._providers.add(provider)
+            self._writes += 1
+            if self._writes % self.purge_every:
+                return
+            providers = list(self._providers)
+        max_age = max(self.ttl(p) + self.stale_window(p) for p in providers)
+        try:
+            n = self.backend.purge(now - max_age)
+        except Exception:
+            return
+        with self._lock:
+            self._stats["purged"] += n
+
+    def _classify(self, key: OfferKey) -> Tuple[str, Optional[Offers]]:
+        hit = self._lookup(key)
+        if hit is None:
+            return "miss", None
+        age = time.time() - hit[0]
+        ttl = self.ttl(key[0])
+        if age <= ttl:
+            return "fresh", hit[1]
+        if age <= ttl + self.stale_window(key[0]):
+            return "stale", hit[1]
+        return "miss", None
+
+    def state(self, key: OfferKey) -> str:
+        """Cache state of key ("fresh", "stale" or "miss") without touching the hit/miss counters."""
+        return self._classify(key)[0]
+
+    # --- sync path -------------------------------------------------------------------------
+
+    def _fetch_single_flight(self, key: OfferKey, fetch: Callable[[], Offers]) -> Offers:
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            return fut.result()
+        try:
+            offers = fetch()
+            self._store(key, offers)
+            fut.set_result(offers)
+            return offers
+        except BaseException as e:
+            self._bump("errors")
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key: OfferKey, fetch: Callable[[], Offers]) -> None:
+        with self._lock:
+            if key in self._inflight:
+                return
+            self._stats["refreshes"] += 1
+
+        def _run() -> None:
+            try:
+                self._fetch_single_flight(key, fetch)
+            except Exception:
+                pass
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def get_or_fetch(self, key: OfferKey, fetch: Callable[[], Offers]) -> Offers:
+        state, offers = self._classify(key)
+        if state == "fresh":
+            self._bump("hits")
+            return offers
+        if state == "stale":
+            self._bump("staleHits")
+            self._refresh_in_background(key, fetch)
+            return offers
+        self._bump("misses")
+        return self._fetch_single_flight(key, fetch)
+
+    # --- asyncio path ----------------------------------------------------------------------
+
+    async def _afetch_single_flight(self, key: OfferKey, fetch: Callable[[], Awaitable[Offers]]) -> Offers:
+        fut = self._ainflight.get(key)
+        if fut is not None:
+            self._bump("coalesced")
+            return await asyncio.shield(fut)
+        fut = self._ainflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            offers = await fetch()
+            self._store(key, offers)
+            fut.set_result(offers)
+            return offers
+        except BaseException as e:
+            self._bump("errors")
+            if isinstance(e, asyncio.CancelledError):
+                fut.cancel()
+            else:
+                fut.set_exception(e)
+                fut.exception()  # mark retrieved when nobody else is waiting
+            raise
+        finally:
+            self._ainflight.pop(key, None)
+
+    async def aget_or_fetch(self, key: OfferKey, fetch: Callable[[], Awaitable[Offers]]) -> Offers:
+        state, offers = self._classify(key)
+        if state == "fresh":
+            self._bump("hits")
+            return offers
+        if state == "stale":
+            self._bump("staleHits")
+            if key not in self._ainflight:
+                self._bump("refreshes")
+                task = asyncio.ensure_future(self._afetch_single_flight(key, fetch))
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return offers
+        self._bump("misses")
+        return await self._afetch_single_flight(key, fetch)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["entries"] = len(self._entries)
+            out["maxEntries"] = self.max_entries
+        out["backend"] = "sqlite" if self.backend is not None else None
+        return out
+
+
+def _is_enabled() -> bool:
+    val = (os.getenv("OFFER_CACHE_ENABLED") or "1").strip().lower()
+    return val in ("1", "true", "yes", "y", "on")
+
+
+def _build_cache() -> OfferCache:
+    path = os.getenv("OFFER_CACHE_SQLITE")
+    backend = None
+    if path:
+        try:
+            backend = SQLiteOfferBackend(path)
+        except Exception:
+            backend = None
+    return OfferCache(
+        max_entries=int(_env_float("OFFER_CACHE_MAX_ENTRIES", 2048)),
+        backend=backend,
+        purge_every=int(_env_float("OFFER_CACHE_PURGE_EVERY", 500)),
+    )
+
+
+offer_cache = _build_cache()
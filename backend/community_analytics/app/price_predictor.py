@@ -1,11 +1,156 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Union, Iterable
+import math
 import numpy as np
 
+from . import metrics
 
-def simple_downtrend_signal(history: List[Dict[str, Any]]) -> Tuple[float, float, float]:
+
+class PriceSeries:
+    """
+    Time-ordered price series backed by contiguous float64 arrays.
+
+    Points are appended at the right and expire from the left. x is the position within the
+    live window (0..n-1, same as np.arange in simple_downtrend_signal), so the running sums
+    n, Σx, Σy, Σxy, Σx², Σy² update in O(1) on append/popleft and slope/volatility need no refit.
+    Sums are recomputed exactly whenever the buffer is compacted to bound float drift.
+    """
+
+    __slots__ = ("_ts", "_price", "_start", "_end", "n", "sx", "sy", "sxy", "sxx", "syy")
+
+    def __init__(self, capacity: int = 64) -> None:
+        capacity = max(8, int(capacity))
+        self._ts = np.empty(capacity, dtype=np.float64)
+        self._price = np.empty(capacity, dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        self._recompute()
+
+    @classmethod
+    def from_arrays(cls, ts: Iterable[float], prices: Iterable[float]) -> "PriceSeries":
+        ts_arr = np.asarray(ts, dtype=np.float64)
+        price_arr = np.asarray(prices, dtype=np.float64)
+        s = cls(capacity=max(64, len(price_arr) * 2))
+        s._ts[: len(ts_arr)] = ts_arr
+        s._price[: len(price_arr)] = price_arr
+        s._end = len(price_arr)
+        s._recompute()
+        return s
+
+    @classmethod
+    def from_history(cls, history: List[Dict[str, Any]]) -> "PriceSeries":
+        ts = [h["ts"].timestamp() if hasattr(h.get("ts"), "timestamp") else float(h.get("ts") or 0.0) for h in history]
+        return cls.from_arrays(ts, [h["price"] for h in history])
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def ts(self) -> np.ndarray:
+        return self._ts[self._start:self._end]
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self._price[self._start:self._end]
+
+    def copy(self) -> "PriceSeries":
+        return PriceSeries.from_arrays(self.ts, self.prices)
+
+    def _recompute(self) -> None:
+        y = self._price[self._start:self._end]
+        n = len(y)
+        x = np.arange(n, dtype=np.float64)
+        self.n = n
+        self.sx = float(n * (n - 1) / 2.0)
+        self.sxx = float((n - 1) * n * (2 * n - 1) / 6.0)
+        self.sy = float(y.sum()) if n else 0.0
+        self.syy = float(np.dot(y, y)) if n else 0.0
+        self.sxy = float(np.dot(x, y)) if n else 0.0
+
+    def _make_room(self) -> None:
+        n = len(self)
+        if self._start > 0 and n <= len(self._price) // 2:
+            # Compact in place and refresh the sums from the data
+            self._ts[:n] = self._ts[self._start:self._end]
+            self._price[:n] = self._price[self._start:self._end]
+        else:
+            cap = len(self._price) * 2
+            ts, price = np.empty(cap, dtype=np.float64), np.empty(cap, dtype=np.float64)
+            ts[:n] = self._ts[self._start:self._end]
+            price[:n] = self._price[self._start:self._end]
+            self._ts, self._price = ts, price
+        self._start, self._end = 0, n
+        self._recompute()
+
+    def append(self, ts: float, price: float) -> None:
+        if self._end == len(self._price):
+            self._make_room()
+        y = float(price)
+        x = float(self.n)
+        self._ts[self._end] = ts
+        self._price[self._end] = y
+        self._end += 1
+        self.n += 1
+        self.sx += x
+        self.sxx += x * x
+        self.sy += y
+        self.syy += y * y
+        self.sxy += x * y
+
+    def popleft(self) -> Tuple[float, float]:
+        if not len(self):
+            raise IndexError("popleft from empty PriceSeries")
+        ts, y = float(self._ts[self._start]), float(self._price[self._start])
+        self._start += 1
+        # Drop the point at x=0, then shift every remaining x down by one
+        n = self.n - 1
+        self.n = n
+        self.sy -= y
+        self.syy -= y * y
+        self.sxy -= self.sy
+        self.sx = n * (n - 1) / 2.0
+        self.sxx = (n - 1) * n * (2 * n - 1) / 6.0
+        if n == 0:
+            self._start = self._end = 0
+            self._recompute()
+        return ts, y
+
+    def expire_before(self, cutoff: float) -> int:
+        dropped = 0
+        while len(self) and self._ts[self._start] < cutoff:
+            self.popleft()
+            dropped += 1
+        return dropped
+
+    def last(self) -> float:
+        return float(self._price[self._end - 1]) if len(self) else 0.0
+
+    def slope(self) -> float:
+        n = self.n
+        if n < 2:
+            return 0.0
+        # Centered form; Σ(x - x̄)² for x = 0..n-1 is exactly n(n²-1)/12
+        return (self.sxy - self.sx * self.sy / n) / (n * (n * n - 1) / 12.0)
+
+    def volatility(self) -> float:
+        n = self.n
+        if n < 2:
+            return 0.0
+        mean = self.sy / n
+        return math.sqrt(max(0.0, self.syy / n - mean * mean))
+
+    def to_history(self) -> List[Dict[str, Any]]:
+        return [{"ts": float(t), "price": float(p)} for t, p in zip(self.ts, self.prices)]
+
+
+History = Union[List[Dict[str, Any]], PriceSeries]
+
+
+def simple_downtrend_signal(history: History) -> Tuple[float, float, float]:
     """
     Returns (last_price, slope, volatility) using linear fit and std dev.
     """
+    if isinstance(history, PriceSeries):
+        return (history.last(), float(history.slope()), float(history.volatility()))
     if not history:
         return (0.0, 0.0, 0.0)
     y = np.array([h["price"] for h in history], dtype=float)
@@ -20,7 +165,9 @@ def simple_downtrend_signal(history: List[Dict[str, Any]]) -> Tuple[float, float
     return (float(y[-1]), float(slope), vol)
 
 
-def predict_should_buy(history: List[Dict[str, Any]], budget: float, hours_left: float) -> Dict[str, Any]:
+@metrics.timed("predictor_duration_seconds", mode="single")
+def predict_should_buy(history: History, budget: float, hours_left: float) -> Dict[str, Any]:
+    """Accepts either a list of {"ts", "price"} dicts or a PriceSeries (O(1) signal)."""
     last, slope, vol = simple_downtrend_signal(history)
     # Forecast naive: next 24h price change ~ slope*24 (normalized over series length)
     n = len(history)
@@ -40,3 +187,92 @@ def predict_should_buy(history: List[Dict[str, Any]], budget: float, hours_left:
         "recommendation": recommendation,
     }
 
+
+def _as_prices(h: Any) -> np.ndarray:
+    if isinstance(h, PriceSeries):
+        return h.prices
+    if isinstance(h, np.ndarray):
+        return h[~np.isnan(h)] if h.dtype.kind == "f" else h.astype(np.float64)
+    return np.array([p["price"] if isinstance(p, dict) else p for p in h], dtype=np.float64)
+
+
+def _pad(series_matrix: Any, lengths: Any = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns (Y, lengths, row_of) with Y left-aligned and zero-padded; identical inputs share a row."""
+    if isinstance(series_matrix, np.ndarray) and series_matrix.ndim == 2:
+        Y = np.asarray(series_matrix, dtype=np.float64)
+        if lengths is None:
+            lengths = (~np.isnan(Y)).sum(axis=1)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        Y = np.where(np.arange(Y.shape[1])[None, :] < lengths[:, None], np.nan_to_num(Y), 0.0)
+        return Y, lengths, np.arange(len(Y))
+    rows: List[np.ndarray] = []
+    seen: Dict[int, int] = {}
+    row_of = np.empty(len(series_matrix), dtype=np.int64)
+    for i, h in enumerate(series_matrix):
+        r = seen.get(id(h))
+        if r is None:
+            r = seen[id(h)] = len(rows)
+            rows.append(_as_prices(h))
+        row_of[i] = r
+    lens = np.array([len(r) for r in rows], dtype=np.int64)
+    Y = np.zeros((len(rows), max(1, int(lens.max())) if len(rows) else 1), dtype=np.float64)
+    for r, y in enumerate(rows):
+        Y[r, : len(y)] = y
+    return Y, lens, row_of
+
+
+@metrics.timed("predictor_duration_seconds", mode="batch")
+def predict_should_buy_batch(series_matrix: Any, budgets: Any, hours_left: Any, lengths: Any = None) -> List[Dict[str, Any]]:
+    """
+    Vectorized predict_should_buy for many alerts.
+
+    series_matrix is either a 2-D array (rows left-aligned, padded with NaN or described by
+    `lengths`) or a ragged sequence of price lists / PriceSeries; the same object passed for
+    several alerts (e.g. alerts sharing a route) is only reduced once. budgets and hours_left
+    are scalars or one value per alert. Returns one result dict per alert, identical in shape
+    and values to predict_should_buy.
+    """
+    Y, lens, row_of = _pad(series_matrix, lengths)
+    m = len(row_of)
+    if m == 0:
+        return []
+    if Y.shape[1] == 0:
+        Y = np.zeros((len(Y), 1), dtype=np.float64)
+    n = lens.astype(np.float64)
+    L = Y.shape[1]
+    x = np.arange(L, dtype=np.float64)
+    mask = x[None, :] < n[:, None]
+    safe_n = np.maximum(n, 1.0)
+
+    sy = Y.sum(axis=1)
+    sxy = Y @ x
+    sx = n * (n - 1) / 2.0
+    denom = np.maximum(n * (n * n - 1) / 12.0, 1e-12)
+    slope = np.where(n >= 2, (sxy - sx * sy / safe_n) / denom, 0.0)
+    mean = sy / safe_n
+    var = (np.where(mask, Y - mean[:, None], 0.0) ** 2).sum(axis=1) / safe_n
+    vol = np.where(n >= 2, np.sqrt(var), 0.0)
+    last = np.where(n >= 1, Y[np.arange(len(Y)), np.maximum(lens - 1, 0)], 0.0)
+
+    # Broadcast per-route signals to alerts
+    n_a, last_a, slope_a, vol_a = n[row_of], last[row_of], slope[row_of], vol[row_of]
+    budgets_a = np.broadcast_to(np.asarray(budgets, dtype=np.float64), (m,))
+    hours_a = np.broadcast_to(np.asarray(hours_left, dtype=np.float64), (m,))
+
+    forecast = last_a + slope_a * np.minimum(48.0, np.maximum(1.0, n_a))
+    within = last_a <= budgets_a
+    trending_down = (slope_a < 0) & (np.abs(slope_a) > np.where(vol_a > 0, vol_a * 0.02, 0.5))
+    buy_now = within | ((hours_a <= 24) & ~trending_down)
+    rec = np.where(buy_now, "buy_now", np.where(trending_down, "watch", "wait"))
+
+    return [
+        {
+            "lastPrice": float(last_a[i]),
+            "slope": float(slope_a[i]),
+            "volatility": float(vol_a[i]),
+            "forecast48h": float(forecast[i]),
+            "withinBudget": bool(within[i]),
+            "recommendation": str(rec[i]),
+        }
+        for i in range(m)
+    ]
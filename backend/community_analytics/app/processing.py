@@ -1,77 +1,412 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 import os
+import queue
+import threading
+import time
 
-try:
-    from transformers import pipeline
-    HAVE_HF = True
-except Exception:
-    HAVE_HF = False
+import importlib.util
 
-try:
-    from bertopic import BERTopic
-    from sentence_transformers import SentenceTransformer
-    HAVE_BERTOPIC = True
-except Exception:
-    HAVE_BERTOPIC = False
+# Heavy ML packages (transformers/torch, sentence-transformers, bertopic) are only imported when a
+# component is first used or warmed up, so importing this module (and answering /health) stays cheap.
+HAVE_HF = importlib.util.find_spec("transformers") is not None
+HAVE_BERTOPIC = importlib.util.find_spec("bertopic") is not None and importlib.util.find_spec("sentence_transformers") is not None
+
+from . import metrics
+from .embedding_cache import CachedEncoder, build_embedding_cache
+from .result_cache import ResultCache, build_result_cache, cached_batch
+from .sentiment_backends import load_sentiment_backend, normalize
+from .topic_model import EMBEDDING_MODEL, TopicModelManager
+
+
+def _heuristic_only() -> bool:
+    """ANALYZER_HEURISTIC=1 keeps the keyword fallbacks even when the ML packages are installed (offline runs, benchmarks)."""
+    return (os.getenv("ANALYZER_HEURISTIC") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and processes them with one batched call.
+
+    A batch is flushed when it reaches `max_batch` items or when the oldest item has waited
+    `max_wait_ms`. Each submit() returns a Future resolved with that item's result. If the
+    batched call raises or returns a result count that does not match its items, the items are
+    retried one by one so a bad item only fails its own future and no future is left unresolved.
+    """
+
+    _SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+    _LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch: int = 32, max_wait_ms: float = 10.0, name: str = "batcher") -> None:
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.name = name
+        self._q: "queue.Queue[Tuple[Any, Future, float]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._size_hist = [0] * (len(self._SIZE_BUCKETS) + 1)
+        self._wait_hist = [0] * (len(self._LATENCY_BUCKETS_MS) + 1)
+        self._batches = 0
+        self._items = 0
+        self._wait_sum_ms = 0.0
+        self._errors = 0
+        self._timeouts = 0
+        self._thread = threading.Thread(target=self._run, name=f"{name}-microbatch", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        fut: Future = Future()
+        self._q.put((item, fut, time.perf_counter()))
+        return fut
+
+    def __call__(self, item: Any, timeout: Optional[float] = None) -> Any:
+        try:
+            return self.submit(item).result(timeout=timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._timeouts += 1
+            raise
+
+    @staticmethod
+    def _bucket(edges: Tuple[float, ...], value: float) -> int:
+        for i, edge in enumerate(edges):
+            if value <= edge:
+                return i
+        return len(edges)
+
+    def _call(self, items: List[Any]) -> List[Any]:
+        results = list(self.fn(items))
+        if len(results) != len(items):
+            raise ValueError(f"{self.name}: {len(results)} results for {len(items)} items")
+        return results
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            deadline = batch[0][2] + self.max_wait_ms / 1000.0
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            try:
+                results = self._call([it for it, _, _ in batch])
+                for (_, fut, _), res in zip(batch, results):
+                    fut.set_result(res)
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                for it, fut, _ in batch:
+                    if fut.done():
+                        continue
+                    if len(batch) == 1:
+                        fut.set_exception(e)
+                        continue
+                    try:
+                        fut.set_result(self._call([it])[0])
+                    except Exception as item_error:
+                        fut.set_exception(item_error)
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._size_hist[self._bucket(self._SIZE_BUCKETS, len(batch))] += 1
+                for _, _, enq in batch:
+                    waited = (started - enq) * 1000.0
+                    self._wait_sum_ms += waited
+                    self._wait_hist[self._bucket(self._LATENCY_BUCKETS_MS, waited)] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size_labels = [f"<={b}" for b in self._SIZE_BUCKETS] + [f">{self._SIZE_BUCKETS[-1]}"]
+            wait_labels = [f"<={b}ms" for b in self._LATENCY_BUCKETS_MS] + [f">{self._LATENCY_BUCKETS_MS[-1]}ms"]
+            return {
+                "maxBatch": self.max_batch,
+                "maxWaitMs": self.max_wait_ms,
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "timeouts": self._timeouts,
+                "avgBatchSize": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "avgQueueMs": round(self._wait_sum_ms / self._items, 3) if self._items else 0.0,
+                "queued": self._q.qsize(),
+                "batchSizeHistogram": dict(zip(size_labels, self._size_hist)),
+                "queueLatencyHistogram": dict(zip(wait_labels, self._wait_hist)),
+            }
 
 
 class Analyzer:
-    def __init__(self, lang: str = "en") -> None:
+    """
+    Sentiment + topic analysis with lazily loaded models.
+
+    Each component ("sentiment", "embedder", "topics") is imported and loaded on first use, or
+    ahead of time via warm_up(); startup_report() gives the import/load cost per component.
+    """
+
+    COMPONENTS = ("sentiment", "embedder", "topics")
+
+    def __init__(
+        self,
+        lang: str = "en",
+        max_batch: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        merge_runner: Optional[Callable[[List[str]], Future]] = None,
+    ) -> None:
         self.lang = lang
+        # Where online topic merges run (the web app passes TopicJobRunner.merge); None disables them
+        self.merge_runner = merge_runner
         self._sent = None
+        self.sentiment_backend = "heuristic"
         self._topic_model = None
         self._emb = None
+        self._emb_cache = None
+        # Per-text results keyed on normalized text, versioned by model (app/result_cache.py)
+        self._sent_cache: Optional[ResultCache] = None
+        self._topic_cache: Optional[ResultCache] = None
+        # Concurrent sentiment() calls (e.g. bursty /ingest traffic) share one pipeline forward pass
+        self.max_batch = int(max_batch if max_batch is not None else os.getenv("INGEST_MAX_BATCH", "32"))
+        self.max_wait_ms = float(max_wait_ms if max_wait_ms is not None else os.getenv("INGEST_MAX_WAIT_MS", "10"))
+        self._sent_batcher: Optional[MicroBatcher] = None
+        self._topic_batcher: Optional[MicroBatcher] = None
+        # Longest a request waits on a batcher before answering with the heuristic/keyword fallback
+        self.batch_timeout_s = float(os.getenv("INGEST_BATCH_TIMEOUT_S", "30"))
+        self._locks = {c: threading.Lock() for c in self.COMPONENTS}
+        self._loaded = {c: False for c in self.COMPONENTS}
+        # A failed load (download timeout, OOM) is retried after a backoff instead of pinning heuristics
+        self._retry_at = {c: 0.0 for c in self.COMPONENTS}
+        self._failures = {c: 0 for c in self.COMPONENTS}
+        self._startup: Dict[str, Dict[str, Any]] = {c: {"status": "not_loaded", "importMs": None, "loadMs": None} for c in self.COMPONENTS}
 
-        if HAVE_HF:
-            # Choose a multilingual sentiment if Spanish is needed; fallback to English
-            model = "cardiffnlp/twitter-roberta-base-sentiment" if lang == "en" else "nlptown/bert-base-multilingual-uncased-sentiment"
-            try:
-                self._sent = pipeline("sentiment-analysis", model=model)
-            except Exception:
-                self._sent = pipeline("sentiment-analysis")
+    # --- lazy loading ----------------------------------------------------------------------
 
-        if HAVE_BERTOPIC:
+    def _ensure(self, component: str) -> None:
+        """Loads a component once; "ready"/"unavailable" are final, an "error" is retried with exponential backoff."""
+        if self._loaded[component] or time.monotonic() < self._retry_at[component]:
+            return
+        with self._locks[component]:
+            if self._loaded[component] or time.monotonic() < self._retry_at[component]:
+                return
+            rec = self._startup[component]
+            rec["status"] = "loading"
             try:
-                self._emb = SentenceTransformer("all-MiniLM-L6-v2")
-                self._topic_model = BERTopic(language=lang if lang in ("en", "multilingual") else "multilingual", verbose=False)
-            except Exception:
-                self._topic_model = None
+                getattr(self, f"_load_{component}")(rec)
+                if rec["status"] == "loading":
+                    rec["status"] = "ready"
+                rec.pop("error", None)
+                rec.pop("retryInS", None)
+                self._loaded[component] = True
+            except Exception as e:
+                self._failures[component] += 1
+                base = float(os.getenv("ANALYZER_RETRY_S", "30"))
+                delay = min(float(os.getenv("ANALYZER_RETRY_MAX_S", "600")), base * 2 ** (self._failures[component] - 1))
+                self._retry_at[component] = time.monotonic() + delay
+                rec.update({"status": "error", "error": str(e), "failures": self._failures[component], "retryInS": delay})
 
-    def sentiment(self, text: str) -> Dict[str, Any]:
+    @staticmethod
+    def _ms(t: float) -> float:
+        return round((time.perf_counter() - t) * 1000.0, 1)
+
+    def _load_sentiment(self, rec: Dict[str, Any]) -> None:
+        if not HAVE_HF or _heuristic_only():
+            rec["status"] = "unavailable"
+            return
+        t = time.perf_counter()
+        import transformers  # noqa: F401  (torch comes with it)
+
+        rec["importMs"] = self._ms(t)
+        t = time.perf_counter()
+        # SENTIMENT_BACKEND=hf|torch_int8|onnx, see app/sentiment_backends.py
+        loaded = load_sentiment_backend(self.lang)
+        self._sent = loaded["pipe"]
+        self.sentiment_backend = loaded["backend"]
+        rec.update({"backend": loaded["backend"], "model": loaded["model"], "fallback": loaded["fallback"]})
+        rec["loadMs"] = self._ms(t)
+        self._sent_cache = build_result_cache("sentiment", f"{loaded['backend']}:{loaded['model']}:{self.lang}")
+        if self.max_batch > 1:
+            self._sent_batcher = MicroBatcher(self._sentiment_uncached, self.max_batch, self.max_wait_ms, name="sentiment")
+
+    def _load_embedder(self, rec: Dict[str, Any]) -> None:
+        if not HAVE_BERTOPIC or _heuristic_only():
+            rec["status"] = "unavailable"
+            return
+        t = time.perf_counter()
+        from sentence_transformers import SentenceTransformer
+
+        rec["importMs"] = self._ms(t)
+        t = time.perf_counter()
+        self._emb = SentenceTransformer(EMBEDDING_MODEL)
+        self._emb_cache = build_embedding_cache(EMBEDDING_MODEL)
+        rec["loadMs"] = self._ms(t)
+
+    def _load_topics(self, rec: Dict[str, Any]) -> None:
+        self._ensure("embedder")
+        if self._emb is None:
+            if self._startup["embedder"]["status"] == "error":
+                # Retry along with the embedder rather than settling on keyword topics for good
+                raise RuntimeError(f"embedder failed to load: {self._startup['embedder'].get('error')}")
+            rec["status"] = "unavailable"
+            return
+        t = time.perf_counter()
+        import bertopic  # noqa: F401  (pulls in umap/hdbscan; the manager imports BERTopic lazily too)
+
+        rec["importMs"] = self._ms(t)
+        t = time.perf_counter()
+        self._topic_model = TopicModelManager(
+            embedder=self._emb,
+            encoder=CachedEncoder(self._emb, self._emb_cache) if self._emb_cache else None,
+            lang=self.lang,
+            min_fit_docs=int(os.getenv("TOPIC_MIN_FIT_DOCS", "50")),
+            update_batch=int(os.getenv("TOPIC_UPDATE_BATCH", "200")),
+            merge_runner=self.merge_runner,
+        )
+        # Persisted model (see `python -m app.topic_model`); requests only ever transform()
+        rec["persistedModel"] = self._topic_model.load()
+        rec["loadMs"] = self._ms(t)
+        self._topic_cache = build_result_cache("topics", self._topic_model.version or "unfitted")
+        if self.max_batch > 1:
+            self._topic_batcher = MicroBatcher(self._topics_uncached, self.max_batch, self.max_wait_ms, name="topics")
+
+    def warm_up(self, components: Optional[List[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """Load components ahead of the first request; in a daemon thread unless background=False."""
+        wanted = [c for c in (components or self.COMPONENTS) if c in self.COMPONENTS]
+
+        def _run() -> None:
+            for c in wanted:
+                self._ensure(c)
+
+        if not background:
+            _run()
+            return None
+        th = threading.Thread(target=_run, name="analyzer-warmup", daemon=True)
+        th.start()
+        return th
+
+    def startup_report(self) -> Dict[str, Any]:
+        return {c: dict(rec) for c, rec in self._startup.items()}
+
+    @staticmethod
+    def _heuristic_sentiment(text: str) -> Dict[str, Any]:
+        lower = text.lower()
+        score = 0.5
+        label = "neutral"
+        if any(w in lower for w in ["amazing", "great", "awesome", "love"]):
+            score, label = 0.9, "positive"
+        elif any(w in lower for w in ["bad", "terrible", "hate", "awful"]):
+            score, label = 0.1, "negative"
+        return {"label": label, "score": score}
+
+    def _sentiment_uncached(self, texts: List[str]) -> List[Dict[str, Any]]:
+        metrics.observe("analyzer_batch_size", len(texts), op="sentiment")
+        with metrics.timer("analyzer_inference_duration_seconds", op="sentiment"):
+            return normalize(self._sent(list(texts), batch_size=len(texts)))
+
+    def sentiment_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        if not texts:
+            return []
+        self._ensure("sentiment")
         if not self._sent:
             # Heuristic fallback
-            lower = text.lower()
-            score = 0.5
-            label = "neutral"
-            if any(w in lower for w in ["amazing", "great", "awesome", "love"]):
-                score, label = 0.9, "positive"
-            elif any(w in lower for w in ["bad", "terrible", "hate", "awful"]):
-                score, label = 0.1, "negative"
-            return {"label": label, "score": score}
-        out = self._sent(text)[0]
-        # Normalize to {label, score}
-        label = str(out.get("label", "neutral")).lower()
-        score = float(out.get("score", 0.5))
-        return {"label": label, "score": score}
+            return [self._heuristic_sentiment(t) for t in texts]
+        return cached_batch(self._sent_cache, texts, self._sentiment_uncached)
+
+    def sentiment(self, text: str) -> Dict[str, Any]:
+        self._ensure("sentiment")
+        if not self._sent:
+            return self._heuristic_sentiment(text)
+        hit = self._sent_cache.get(text) if self._sent_cache else None
+        if hit is not None:
+            return hit
+        if self._sent_batcher is not None:
+            try:
+                res = self._sent_batcher(text, timeout=self.batch_timeout_s)
+            except FutureTimeout:
+                return self._heuristic_sentiment(text)
+        else:
+            res = self._sentiment_uncached([text])[0]
+        if self._sent_cache:
+            self._sent_cache.put(text, res)
+        return res
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sentimentModel": bool(self._sent),
+            "sentimentBackend": self.sentiment_backend,
+            "startup": self.startup_report(),
+            "topicModel": self._topic_model.stats() if self._topic_model else None,
+            "sentimentBatcher": self._sent_batcher.stats() if self._sent_batcher else {"maxBatch": 1, "maxWaitMs": 0.0},
+            "topicBatcher": self._topic_batcher.stats() if self._topic_batcher else {"maxBatch": 1, "maxWaitMs": 0.0},
+            "embeddingCache": self._emb_cache.stats() if self._emb_cache else None,
+            "sentimentCache": self._sent_cache.stats() if self._sent_cache else None,
+            "topicCache": self._topic_cache.stats() if self._topic_cache else None,
+        }
+
+    @staticmethod
+    def _keyword_topics(texts: List[str]) -> List[Dict[str, Any]]:
+        # Fallback: extract naive keywords
+        res = []
+        for t in texts:
+            words = [w.strip(".,!?:;()[]{}\"' ") for w in t.lower().split()]
+            kept = [w for w in words if len(w) > 4][:3]
+            res.append({"labels": kept})
+        return res
+
+    def _topics_uncached(self, texts: List[str]) -> List[Dict[str, Any]]:
+        metrics.observe("analyzer_batch_size", len(texts), op="topics")
+        with metrics.timer("analyzer_inference_duration_seconds", op="topics"):
+            if not self._topic_model or not self._topic_model.ready:
+                return self._keyword_topics(texts)
+            return [{"topic": tid, "labels": [lab]} for tid, lab in self._topic_model.transform(texts)]
+
+    def _live_topic_cache(self) -> Optional[ResultCache]:
+        """Topic cache for the current model version (emptied when a fit/merge swaps the model); None for keywords."""
+        if self._topic_cache is None or not self._topic_model or not self._topic_model.ready:
+            return None
+        self._topic_cache.set_version(self._topic_model.version or "unfitted")
+        return self._topic_cache
 
     def topics_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Assigns topics with the fitted model (transform only); keyword fallback until one is fitted."""
         if not texts:
             return []
-        if not self._topic_model or not self._emb:
-            # Fallback: extract naive keywords
-            res = []
-            for t in texts:
-                words = [w.strip(".,!?:;()[]{}\"' ") for w in t.lower().split()]
-                kept = [w for w in words if len(w) > 4][:3]
-                res.append({"labels": kept})
-            return res
-        topics, _ = self._topic_model.fit_transform(texts, embeddings=self._emb.encode(texts))
-        # Map topic IDs to representative labels
-        labels = self._topic_model.generate_topic_labels(nr_words=3)
-        id2label = {idx: lab for idx, lab in enumerate(labels)}
-        out: List[Dict[str, Any]] = []
-        for tid in topics:
-            lab = id2label.get(tid, "topic")
-            out.append({"topic": int(tid), "labels": [lab]})
-        return out
+        self._ensure("topics")
+        return cached_batch(self._live_topic_cache(), texts, self._topics_uncached)
+
+    def topics_one(self, text: str) -> Dict[str, Any]:
+        """Single-text topic assignment for /ingest, micro-batched like sentiment()."""
+        self._ensure("topics")
+        cache = self._live_topic_cache()
+        hit = cache.get(text) if cache else None
+        if hit is not None:
+            return hit
+        version = cache.version if cache else None
+        if self._topic_batcher is not None and self._topic_model.ready:
+            try:
+                res = self._topic_batcher(text, timeout=self.batch_timeout_s)
+            except FutureTimeout:
+                return self._keyword_topics([text])[0]
+        else:
+            res = self._topics_uncached([text])[0]
+        if cache:
+            cache.put(text, res, version)
+        return res
+
+    def observe(self, texts: List[str]) -> None:
+        """Feed newly ingested texts to the online topic update buffer."""
+        self._ensure("topics")
+        if self._topic_model:
+            self._topic_model.observe(texts)
+
+    def fit_topics(self, texts: List[str]) -> Dict[str, Any]:
+        """Full refit, published under the same lock as merges; called in a topic job process."""
+        self._ensure("topics")
+        if not self._topic_model:
+            raise RuntimeError("BERTopic is not available")
+        return self._topic_model.refit(texts)
 
+    def merge_topics(self, texts: List[str]) -> Dict[str, Any]:
+        """Fold texts into the persisted topic model and publish it; called in a topic job process."""
+        self._ensure("topics")
+        if not self._topic_model:
+            raise RuntimeError("BERTopic is not available")
+        return self._topic_model.merge_now(texts)
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from . import metrics
+
+# Per-provider protection for live upstream calls: a token bucket caps the request rate, a
+# circuit breaker skips a provider that keeps failing until a cooldown passes (then lets one
+# probe through), and counters/latency percentiles are kept for /providers/stats.
+
+
+class ProviderUnavailable(Exception):
+    """Raised instead of calling a provider that is rate limited, circuit-open or out of time budget."""
+
+    def __init__(self, provider: str, reason: str) -> None:
+        super().__init__(f"{provider}: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, burst: float) -> None:
+        self.rate = max(0.0, rate_per_s)
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if available; otherwise return seconds until one is."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._at) * self.rate)
+            self._at = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def acquire(self, timeout: float = 0.0) -> bool:
+        end = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0.0:
+                return True
+            if time.monotonic() + wait > end:
+                return False
+            time.sleep(wait)
+
+    async def aacquire(self, timeout: float = 0.0) -> bool:
+        end = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0.0:
+                return True
+            if time.monotonic() + wait > end:
+                return False
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive errors; open -> half-open after `cooldown_s`."""
+
+    def __init__(self, failures: int = 5, cooldown_s: float = 30.0) -> None:
+        self.failures = max(1, failures)
+        self.cooldown_s = cooldown_s
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self._opened_at >= self.cooldown_s else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            st = self._state()
+            if st == "closed":
+                return True
+            if st == "half_open" and not self._probing:
+                self._probing = True  # exactly one trial call
+                return True
+            return False
+
+    def release(self) -> None:
+        """Give back a half-open trial slot that ended up not being used."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._consecutive = 0
+                self._opened_at = None
+                return
+            self._consecutive += 1
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+
+
+class ProviderGuard:
+    def __init__(self, name: str, rate_per_s: float, burst: float, failures: int, cooldown_s: float) -> None:
+        self.name = name
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.breaker = CircuitBreaker(failures, cooldown_s)
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=512)
+        self._stats = {"calls": 0, "success": 0, "errors": 0, "rateLimited": 0, "shortCircuited": 0, "budgetExceeded": 0, "stubServed": 0}
+
+    def _bump(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _skip(self, stat: str, label: str, reason: str) -> ProviderUnavailable:
+        self._bump(stat)
+        metrics.inc("provider_skipped_total", provider=self.name, reason=label)
+        return ProviderUnavailable(self.name, reason)
+
+    def _check(self, budget_s: Optional[float]) -> None:
+        if budget_s is not None and budget_s <= 0:
+            raise self._skip("budgetExceeded", "budget", "latency budget exhausted")
+        if not self.breaker.allow():
+            raise self._skip("shortCircuited", "circuit_open", "circuit open")
+
+    def before(self, budget_s: Optional[float] = None) -> None:
+        """Raise ProviderUnavailable unless a live call may go out now (waits up to 1 s / budget for a token)."""
+        self._check(budget_s)
+        if not self.bucket.acquire(min(1.0, budget_s) if budget_s is not None else 1.0):
+            self.breaker.release()
+            raise self._skip("rateLimited", "rate_limited", "rate limited")
+
+    async def abefore(self, budget_s: Optional[float] = None) -> None:
+        self._check(budget_s)
+        if not await self.bucket.aacquire(min(1.0, budget_s) if budget_s is not None else 1.0):
+            self.breaker.release()
+            raise self._skip("rateLimited", "rate_limited", "rate limited")
+
+    def record(self, ok: bool, latency_s: float) -> None:
+        self.breaker.record(ok)
+        metrics.observe("provider_request_duration_seconds", latency_s, provider=self.name, outcome="ok" if ok else "error")
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["success" if ok else "errors"] += 1
+            self._latencies.append(latency_s * 1000.0)
+
+    def stub_served(self) -> None:
+        self._bump("stubServed")
+        metrics.inc("provider_stub_offers_total", provider=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            lat = sorted(self._latencies)
+        pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))], 1) if lat else None
+        out.update({"circuit": self.breaker.state, "latencyMs": {"p50": pct(0.5), "p95": pct(0.95), "max": round(lat[-1], 1) if lat else None}})
+        return out
+
+
+def _build(name: str, rate: float, burst: float) -> ProviderGuard:
+    p = name.upper()
+    return ProviderGuard(
+        name,
+        rate_per_s=_env_float(f"{p}_RATE_PER_S", rate),
+        burst=_env_float(f"{p}_BURST", burst),
+        failures=int(_env_float(f"{p}_BREAKER_FAILURES", 5)),
+        cooldown_s=_env_float(f"{p}_BREAKER_COOLDOWN_S", 30.0),
+    )
+
+
+guards: Dict[str, ProviderGuard] = {
+    "travelpayouts": _build("travelpayouts", 10.0, 20.0),
+    "amadeus": _build("amadeus", 5.0, 10.0),
+}
+
+
+def check_budget_s() -> float:
+    """Overall wall-clock budget for the provider part of one check (env CHECK_BUDGET_S)."""
+    return _env_float("CHECK_BUDGET_S", 12.0)
+
+
+def stats() -> Dict[str, Any]:
+    return {name: g.stats() for name, g in guards.items()}
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from . import metrics
+
+# Per-text inference results (sentiment labels, topic labels) keyed on a hash of the normalized
+# text, so reposts and templated messages skip the model. Each cache is a bounded in-process LRU
+# tagged with the model version that produced it; a different version empties it. With
+# RESULT_CACHE_PATH set, entries are also written through to a SQLite (WAL) file and the most
+# recent ones are loaded back on start, as long as the version still matches. Hits are recorded
+# in memory and written to the file's `used` column in bulk every SYNC_EVERY puts or hits; the
+# same sync trims the table back to max_entries.
+
+SYNC_EVERY = 256
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """NFKC, casefolded, whitespace collapsed and trimmed: "Great  trip!" and "great trip!" share an entry."""
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text or "").casefold()).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, namespace: str, version: str, max_entries: int = 20000, path: Optional[str] = None) -> None:
+        self.namespace = namespace
+        self.version = version
+        self.max_entries = max(1, int(max_entries))
+        self.path = path or None
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "loaded": 0, "trimmed": 0}
+        self._touched: Dict[str, float] = {}
+        self._puts = 0
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            c = self._conn()
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS results (ns TEXT NOT NULL, h TEXT NOT NULL, version TEXT NOT NULL, "
+                "value TEXT NOT NULL, used REAL NOT NULL, PRIMARY KEY (ns, h))"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS results_used ON results (ns, used)")
+            self._load()
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = c
+        return c
+
+    def _trim(self, c: sqlite3.Connection) -> int:
+        return c.execute(
+            "DELETE FROM results WHERE ns = ? AND h NOT IN (SELECT h FROM results WHERE ns = ? ORDER BY used DESC LIMIT ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        ).rowcount
+
+    def _sync(self) -> None:
+        """Write buffered hit times to `used`, then trim the table to max_entries (least recently used first)."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._puts = 0
+        try:
+            c = self._conn()
+            if touched:
+                c.executemany("UPDATE results SET used = ? WHERE ns = ? AND h = ?", [(t, self.namespace, h) for h, t in touched.items()])
+            trimmed = self._trim(c)
+        except Exception:
+            return
+        with self._lock:
+            self._stats["trimmed"] += trimmed
+
+    def _load(self) -> None:
+        """Drop rows from other model versions, trim to max_entries and warm the LRU with the rest."""
+        c = self._conn()
+        c.execute("DELETE FROM results WHERE ns = ? AND version != ?", (self.namespace, self.version))
+        self._trim(c)
+        rows = c.execute("SELECT h, value FROM results WHERE ns = ? ORDER BY used ASC", (self.namespace,)).fetchall()
+        with self._lock:
+            for h, value in rows:
+                self._data[h] = json.loads(value)
+            self._stats["loaded"] = len(rows)
+
+    def set_version(self, version: str) -> None:
+        """Model/backend changed: everything cached so far is stale."""
+        if version == self.version:
+            return
+        with self._lock:
+            self.version = version
+            self._data.clear()
+            self._stats["invalidations"] += 1
+        if self.path:
+            try:
+                self._conn().execute("DELETE FROM results WHERE ns = ? AND version != ?", (self.namespace, version))
+            except Exception:
+                pass
+
+    def _count(self, hit: bool) -> None:
+        self._stats["hits" if hit else "misses"] += 1
+        metrics.inc("analyzer_cache_requests_total", cache=self.namespace, result="hit" if hit else "miss")
+
+    def get(self, text: str) -> Optional[Any]:
+        h = text_hash(text)
+        sync = False
+        with self._lock:
+            value = self._data.get(h)
+            if value is not None:
+                self._data.move_to_end(h)
+                if self.path:
+                    self._touched[h] = time.time()
+                    sync = len(self._touched) >= SYNC_EVERY
+            self._count(value is not None)
+        if sync:
+            self._sync()
+        return copy.deepcopy(value) if value is not None else None
+
+    def put(self, text: str, value: Any, version: Optional[str] = None) -> None:
+        """`version` is the one seen before computing `value`; the put is dropped if the model changed meanwhile."""
+        h = text_hash(text)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[h] = copy.deepcopy(value)
+            self._data.move_to_end(h)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+            version = self.version
+            self._puts += 1
+            sync = self._puts >= SYNC_EVERY
+        if self.path:
+            try:
+                self._conn().execute(
+                    "INSERT OR REPLACE INTO results (ns, h, version, value, used) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, h, version, json.dumps(value), time.time()),
+                )
+            except Exception:
+                pass
+            if sync:
+                self._sync()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["size"] = len(self._data)
+        lookups = out["hits"] + out["misses"]
+        out.update({
+            "hitRate": round(out["hits"] / lookups, 4) if lookups else 0.0,
+            "maxEntries": self.max_entries,
+            "version": self.version,
+            "persisted": bool(self.path),
+        })
+        return out
+
+
+def cached_batch(cache: Optional[ResultCache], texts: List[str], compute: Any) -> List[Any]:
+    """Serves texts from `cache`, runs compute() once on the distinct misses and stores the results."""
+    if cache is None:
+        return compute(list(texts))
+    out: List[Any] = [cache.get(t) for t in texts]
+    todo: Dict[str, List[int]] = {}
+    for i, (t, r) in enumerate(zip(texts, out)):
+        if r is None:
+            todo.setdefault(normalize_text(t), []).append(i)
+    if todo:
+        version = cache.version
+        firsts = [idx[0] for idx in todo.values()]
+        for idx, res in zip(todo.values(), compute([texts[i] for i in firsts])):
+            cache.put(texts[idx[0]], res, version)
+            for i in idx:
+                out[i] = copy.deepcopy(res)
+    return out
+
+
+def build_result_cache(namespace: str, version: str) -> Optional[ResultCache]:
+    """RESULT_CACHE_MAX entries per cache (default 20000, 0 disables); RESULT_CACHE_PATH persists them (default off)."""
+    try:
+        max_entries = int(os.getenv("RESULT_CACHE_MAX", "20000"))
+    except ValueError:
+        max_entries = 20000
+    if max_entries <= 0:
+        return None
+    try:
+        return ResultCache(namespace, version, max_entries=max_entries, path=os.getenv("RESULT_CACHE_PATH") or None)
+    except Exception:
+        return ResultCache(namespace, version, max_entries=max_entries)
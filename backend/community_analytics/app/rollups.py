@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# Per-location, per-UTC-day buckets in communityAggregates, bumped in the same write batch as
+# each communityAnalysis doc. /analysis and /analysis/locations merge at most `sinceDays`
+# buckets instead of scanning raw rows. Bucket shape:
+#   { location, day: "YYYY-MM-DD", count, sentiments: {label: n}, topics: {label: n},
+#     coords: {latSum, lngSum, n}, updatedAt }
+# Buckets only exist for days a rebuild (or ingest since deploy) has covered, so every rebuild
+# records the first day it covered in communityAggregatesMeta/<name>; reads whose window starts
+# earlier keep using the raw scan. Marker shape: { coveredFrom: "YYYY-MM-DD", locations: {loc: day} }
+
+AGGREGATES = "communityAggregates"
+META = "communityAggregatesMeta"
+
+
+def is_enabled() -> bool:
+    val = (os.getenv("ROLLUPS_ENABLED") or "1").strip().lower()
+    return val in ("1", "true", "yes", "y", "on")
+
+
+def day_key(ts: Optional[datetime] = None) -> str:
+    ts = ts or datetime.utcnow()
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return ts.strftime("%Y-%m-%d")
+
+
+def bucket_id(location: str, day: str) -> str:
+    # Firestore document IDs cannot contain "/"
+    return f"{location.replace('/', '_')}__{day}"
+
+
+def window_days(since_days: int, now: Optional[datetime] = None) -> List[str]:
+    """Today plus the previous since_days-1 UTC days (day-granular version of now - sinceDays)."""
+    now = now or datetime.utcnow()
+    return [day_key(now - timedelta(days=i)) for i in range(max(1, int(since_days)))]
+
+
+def covered_from(marker: Optional[Dict[str, Any]], location: Optional[str] = None) -> Optional[str]:
+    """First day with complete buckets (for one location, or all of them when location is None)."""
+    marker = marker or {}
+    days = [marker.get("coveredFrom")]
+    if location:
+        days.append((marker.get("locations") or {}).get(location))
+    days = [d for d in days if d]
+    return min(days) if days else None
+
+
+def covers(marker: Optional[Dict[str, Any]], since_days: int, location: Optional[str] = None) -> bool:
+    first = covered_from(marker, location)
+    return first is not None and window_days(since_days)[-1] >= first
+
+
+def _has_coords(doc: Dict[str, Any]) -> bool:
+    return isinstance(doc.get("lat"), (int, float)) and isinstance(doc.get("lng"), (int, float))
+
+
+def bucket_delta(doc: Dict[str, Any], inc: Callable[[float], Any]) -> Dict[str, Any]:
+    """Nested field update for one analysis doc; `inc` wraps values (e.g. firestore.Increment)."""
+    delta: Dict[str, Any] = {
+        "count": inc(1),
+        "sentiments": {(doc.get("sentiment") or "unknown").lower(): inc(1)},
+        "topics": {t: inc(1) for t in doc.get("topics", []) or []},
+    }
+    if _has_coords(doc):
+        delta["coords"] = {"latSum": inc(float(doc["lat"])), "lngSum": inc(float(doc["lng"])), "n": inc(1)}
+    return delta
+
+
+def add_to_bucket(bucket: Dict[str, Any], doc: Dict[str, Any]) -> None:
+    """In-memory equivalent of applying bucket_delta; used by the backfill."""
+    bucket["count"] = bucket.get("count", 0) + 1
+    s = (doc.get("sentiment") or "unknown").lower()
+    sentiments = bucket.setdefault("sentiments", {})
+    sentiments[s] = sentiments.get(s, 0) + 1
+    topics = bucket.setdefault("topics", {})
+    for t in doc.get("topics", []) or []:
+        topics[t] = topics.get(t, 0) + 1
+    if _has_coords(doc):
+        c = bucket.setdefault("coords", {"latSum": 0.0, "lngSum": 0.0, "n": 0})
+        c["latSum"] += float(doc["lat"])
+        c["lngSum"] += float(doc["lng"])
+        c["n"] += 1
+
+
+def merge_buckets(buckets: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"count": 0, "sentiments": {}, "topics": {}, "latSum": 0.0, "lngSum": 0.0, "coords": 0}
+    for b in buckets:
+        out["count"] += int(b.get("count", 0) or 0)
+        for k, v in (b.get("sentiments") or {}).items():
+            out["sentiments"][k] = out["sentiments"].get(k, 0) + int(v)
+        for k, v in (b.get("topics") or {}).items():
+            out["topics"][k] = out["topics"].get(k, 0) + int(v)
+        c = b.get("coords") or {}
+        out["latSum"] += float(c.get("latSum", 0.0) or 0.0)
+        out["lngSum"] += float(c.get("lngSum", 0.0) or 0.0)
+        out["coords"] += int(c.get("n", 0) or 0)
+    return out
+
+
+def build_buckets(rows: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Group raw communityAnalysis docs into {bucket_id: bucket} (backfill/rebuild)."""
+    buckets: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        created = r.get("createdAt")
+        if not isinstance(created, datetime):
+            continue
+        loc = r.get("location") or "unknown"
+        day = day_key(created)
+        b = buckets.setdefault(bucket_id(loc, day), {"location": loc, "day": day})
+        add_to_bucket(b, r)
+    return buckets
+
+
+def main() -> None:
+    """python -m app.rollups --sinceDays 90 [--location LIM]: rebuild buckets from communityAnalysis."""
+    import argparse
+
+    from .store import Store
+
+    ap = argparse.ArgumentParser(description="Backfill/rebuild communityAggregates day buckets")
+    ap.add_argument("--sinceDays", type=int, default=90)
+    ap.add_argument("--location", default=None)
+    args = ap.parse_args()
+
+    store = Store(project_id=os.getenv("FIRESTORE_PROJECT_ID"))
+    print(store.rebuild_rollups(since_days=args.sinceDays, location=args.location))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import datetime as dt
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from .flight_providers import _is_simulation, _iso_date, offer_cache_key
+from .offer_cache import offer_cache, _is_enabled as _offer_cache_enabled
+from .sweep import RouteKey, group_by_route
+
+# Deadline-aware alert scheduling. Every alert carries nextCheckAt; a tick loads only the alerts
+# that are due (oldest nextCheckAt first), checks as many whole routes as the per-tick upstream
+# call budget allows, and reschedules each checked alert from how urgent it is:
+#   - the time left before maxWaitHours runs out or the flight departs (checked ~N times per window)
+#   - recent volatility (simple_downtrend_signal, relative to the last price)
+#   - how close the last price is to the budget
+# Alerts that did not fit the budget stay due and lead the next tick. Alerts whose window has
+# closed (maxWaitHours elapsed or departure day reached) are expired instead of checked.
+
+SCHEDULE_FIELD = "nextCheckAt"
+PROVIDERS = ("travelpayouts", "amadeus")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def max_calls() -> int:
+    """Upstream provider calls one tick may spend (env SCHED_MAX_CALLS_PER_TICK)."""
+    return int(_env_float("SCHED_MAX_CALLS_PER_TICK", 200))
+
+
+def max_due() -> int:
+    """Due alerts loaded per tick (env SCHED_MAX_DUE)."""
+    return int(_env_float("SCHED_MAX_DUE", 5000))
+
+
+def _utc(v: Any) -> Optional[dt.datetime]:
+    if not isinstance(v, dt.datetime):
+        return None
+    return v if v.tzinfo is not None else v.replace(tzinfo=dt.timezone.utc)
+
+
+class SchedulePolicy:
+    def __init__(
+        self,
+        min_interval_s: float = 900.0,
+        max_interval_s: float = 86400.0,
+        checks_per_window: float = 8.0,
+        volatility_weight: float = 10.0,
+        budget_band: float = 0.25,
+    ) -> None:
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max(min_interval_s, max_interval_s)
+        self.checks_per_window = max(1.0, checks_per_window)
+        self.volatility_weight = volatility_weight
+        self.budget_band = budget_band
+
+    @classmethod
+    def from_env(cls) -> "SchedulePolicy":
+        return cls(
+            min_interval_s=_env_float("SCHED_MIN_INTERVAL_MIN", 15.0) * 60.0,
+            max_interval_s=_env_float("SCHED_MAX_INTERVAL_H", 24.0) * 3600.0,
+            checks_per_window=_env_float("SCHED_CHECKS_PER_WINDOW", 8.0),
+            volatility_weight=_env_float("SCHED_VOLATILITY_WEIGHT", 10.0),
+            budget_band=_env_float("SCHED_BUDGET_BAND", 0.25),
+        )
+
+    def horizon_s(self, alert: Dict[str, Any], now: dt.datetime) -> Optional[float]:
+        """Seconds until the alert stops mattering: maxWaitHours after creation or departure day, whichever is first."""
+        ends: List[dt.datetime] = []
+        created = _utc(alert.get("createdAt"))
+        try:
+            wait_h = float(alert.get("maxWaitHours", 168))
+        except (TypeError, ValueError):
+            wait_h = 168.0
+        if created is not None:
+            ends.append(created + dt.timedelta(hours=wait_h))
+        dep = _iso_date(alert.get("departureDate"))
+        if dep:
+            ends.append(dt.datetime.fromisoformat(dep).replace(tzinfo=dt.timezone.utc))
+        return min((e - now).total_seconds() for e in ends) if ends else None
+
+    def interval_s(self, alert: Dict[str, Any], result: Optional[Dict[str, Any]], now: dt.datetime) -> float:
+        if result is None:
+            # Failed check: retry soon, but do not hammer a broken route
+            return self.min_interval_s
+        interval = self.max_interval_s
+        horizon = self.horizon_s(alert, now)
+        if horizon is not None and horizon > 0:
+            interval = min(interval, horizon / self.checks_per_window)
+        last = float(result.get("lastPrice") or 0.0)
+        if last > 0:
+            # Noisy routes move faster: 5% relative volatility halves the interval at the default weight
+            interval /= 1.0 + self.volatility_weight * float(result.get("volatility") or 0.0) / last
+            try:
+                gap = (last - float(alert.get("budget"))) / last
+            except (TypeError, ValueError):
+                gap = None
+            if gap is not None and self.budget_band > 0 and gap < self.budget_band:
+                # Within the band above budget (or already under it) the interval shrinks down to a quarter
+                interval *= max(0.25, gap / self.budget_band)
+        return max(self.min_interval_s, min(self.max_interval_s, interval))
+
+
+def expire_on_max_wait() -> bool:
+    """ALERT_EXPIRE_ON_MAX_WAIT=1 also expires alerts maxWaitHours after creation (off: it only shortens intervals)."""
+    return (os.getenv("ALERT_EXPIRE_ON_MAX_WAIT") or "0").strip().lower() in ("1", "true", "yes", "y", "on")
+
+
+def departed(alert: Dict[str, Any], now: dt.datetime) -> bool:
+    """True once the whole departure day (UTC) is in the past."""
+    dep = _iso_date(alert.get("departureDate"))
+    if not dep:
+        return False
+    return now >= dt.datetime.fromisoformat(dep).replace(tzinfo=dt.timezone.utc) + dt.timedelta(days=1)
+
+
+def split_expired(
+    due: List[Dict[str, Any]], now: dt.datetime, policy: Optional[SchedulePolicy] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """(alerts still worth checking, alerts whose departure has passed), order preserved."""
+    by_wait = expire_on_max_wait()
+    policy = policy or SchedulePolicy.from_env()
+    live: List[Dict[str, Any]] = []
+    expired: List[Dict[str, Any]] = []
+    for a in due:
+        done = departed(a, now)
+        if not done and by_wait:
+            horizon = policy.horizon_s(a, now)
+            done = horizon is not None and horizon <= 0
+        (expired if done else live).append(a)
+    return live, expired
+
+
+def route_cost(key: RouteKey, currency: str = "USD") -> int:
+    """Upstream calls a route check would make now (fresh offer-cache entries and simulation are free)."""
+    if _is_simulation():
+        return 0
+    origin, destination, departure = key
+    if not (origin and destination):
+        return 0
+    if not _offer_cache_enabled():
+        return len(PROVIDERS)
+    return sum(offer_cache.state(offer_cache_key(p, origin, destination, departure, currency)) != "fresh" for p in PROVIDERS)
+
+
+class TickPlan:
+    """Due alerts of the routes that fit this tick's call budget, most overdue route first."""
+
+    def __init__(self, max_calls: int) -> None:
+        self.max_calls = max_calls
+        self.alerts: List[Dict[str, Any]] = []
+        self.routes = 0
+        self.deferred_alerts = 0
+        self.deferred_routes = 0
+        self.cost = 0
+        self.due = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "due": self.due,
+            "checked": len(self.alerts),
+            "routes": self.routes,
+            "deferredAlerts": self.deferred_alerts,
+            "deferredRoutes": self.deferred_routes,
+            "plannedUpstreamCalls": self.cost,
+            "maxCalls": self.max_calls,
+        }
+
+
+def plan_tick(due: List[Dict[str, Any]], max_calls: int, currency: str = "USD") -> TickPlan:
+    """`due` is ordered by nextCheckAt; a route's position is that of its most overdue alert."""
+    plan = TickPlan(max_calls)
+    plan.due = len(due)
+    for key, members in group_by_route(due).items():
+        cost = route_cost(key, currency)
+        if plan.cost + cost > plan.max_calls:
+            plan.deferred_routes += 1
+            plan.deferred_alerts += len(members)
+            continue
+        plan.cost += cost
+        plan.routes += 1
+        plan.alerts.extend(members)
+    return plan
+
+
+def reschedule(
+    alerts: List[Dict[str, Any]],
+    results: List[Dict[str, Any]],
+    now: dt.datetime,
+    policy: Optional[SchedulePolicy] = None,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """(alert id, fields to merge) for every checked alert."""
+    policy = policy or SchedulePolicy.from_env()
+    by_id = {r.get("alertId"): r for r in results}
+    out: List[Tuple[str, Dict[str, Any]]] = []
+    for a in alerts:
+        alert_id = a.get("_id")
+        if not alert_id:
+            continue
+        r = by_id.get(alert_id) or {}
+        res = r.get("result") if "error" not in r else None
+        interval = policy.interval_s(a, res, now)
+        fields: Dict[str, Any] = {
+            SCHEDULE_FIELD: now + dt.timedelta(seconds=interval),
+            "lastCheckedAt": now,
+            "checkIntervalS": round(interval, 1),
+        }
+        if res and res.get("lastPrice"):
+            fields["lastPrice"] = float(res["lastPrice"])
+        out.append((alert_id, fields))
+    return out
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+# Selectable CPU inference backends for Analyzer sentiment (env SENTIMENT_BACKEND):
+#   hf          - transformers pipeline, fp32 (default; previous behaviour)
+#   torch_int8  - same model with torch dynamic int8 quantization of Linear layers
+#   onnx        - ONNX Runtime export via optimum (pip install "optimum[onnxruntime]")
+# Every backend is wrapped in a transformers pipeline so labels/scores keep the same shape.
+
+BACKENDS = ("hf", "torch_int8", "onnx")
+
+
+def default_model(lang: str) -> str:
+    # Choose a multilingual sentiment if Spanish is needed; fallback to English
+    return "cardiffnlp/twitter-roberta-base-sentiment" if lang == "en" else "nlptown/bert-base-multilingual-uncased-sentiment"
+
+
+def selected_backend() -> str:
+    name = (os.getenv("SENTIMENT_BACKEND") or "hf").strip().lower()
+    return name if name in BACKENDS else "hf"
+
+
+def _load_hf(model_id: str) -> Callable:
+    from transformers import pipeline
+
+    try:
+        return pipeline("sentiment-analysis", model=model_id)
+    except Exception:
+        return pipeline("sentiment-analysis")
+
+
+def _load_torch_int8(model_id: str) -> Callable:
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    tok = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForSequenceClassification.from_pretrained(model_id)
+    model.eval()
+    qmodel = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("sentiment-analysis", model=qmodel, tokenizer=tok)
+
+
+def _load_onnx(model_id: str) -> Callable:
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import AutoTokenizer, pipeline
+
+    # Export once and reuse the .onnx on later starts
+    export_dir = os.path.join(os.getenv("ONNX_CACHE_DIR", os.path.join(os.getcwd(), "models", "onnx")), model_id.replace("/", "__"))
+    if os.path.isdir(export_dir):
+        model = ORTModelForSequenceClassification.from_pretrained(export_dir)
+        tok = AutoTokenizer.from_pretrained(export_dir)
+    else:
+        model = ORTModelForSequenceClassification.from_pretrained(model_id, export=True)
+        tok = AutoTokenizer.from_pretrained(model_id)
+        os.makedirs(export_dir, exist_ok=True)
+        model.save_pretrained(export_dir)
+        tok.save_pretrained(export_dir)
+    return pipeline("sentiment-analysis", model=model, tokenizer=tok)
+
+
+_LOADERS: Dict[str, Callable[[str], Callable]] = {"hf": _load_hf, "torch_int8": _load_torch_int8, "onnx": _load_onnx}
+
+
+def load_sentiment_backend(lang: str = "en", backend: Optional[str] = None, model_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Returns {"pipe", "backend", "model", "fallback"}. If the requested backend cannot be loaded
+    (missing optional package, export failure) the plain HF pipeline is used and "fallback" holds the error.
+    """
+    name = backend or selected_backend()
+    model_id = model_id or default_model(lang)
+    fallback = None
+    try:
+        pipe = _LOADERS[name](model_id)
+    except Exception as e:
+        if name == "hf":
+            raise
+        fallback = f"{name}: {e}"
+        name = "hf"
+        pipe = _load_hf(model_id)
+    return {"pipe": pipe, "backend": name, "model": model_id, "fallback": fallback}
+
+
+def normalize(outs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Normalize to {label, score}
+    return [{"label": str(o.get("label", "neutral")).lower(), "score": float(o.get("score", 0.5))} for o in outs]
@@ -0,0 +1,419 @@
+from __future__ import annotations
+
+import math
+import os
+import secrets
+import socket
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from .storage import transact
+
+# Work partitioning for running the alert sweep/tick on several instances (ALERT_SHARDING=1).
+# Alerts are split into ALERT_SHARDS shards by a stable hash of their id (stored as `shard` on the
+# alert). Each worker holds expiring leases on a fair share of shards in flightAlertShardLeases,
+# renews them every heartbeat and only checks alerts of shards it holds. A worker that dies stops
+# renewing; once its leases expire (LEASE_TTL_S) the others claim them. Claims and renewals are
+# single-document transactions, so two workers never hold the same lease at once.
+# Lease expiry uses each worker's clock, so LEASE_TTL_S must stay well above the expected skew.
+# Leases are renewed by the heartbeat thread while a sweep runs. A sweep takes a Fence (the epoch
+# of every held lease) when it starts and checks it before each route's upstream calls and
+# writes, so a worker whose lease expired or changed hands mid-sweep stops working on that shard.
+
+LEASES = "flightAlertShardLeases"
+WORKERS = "flightAlertWorkers"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def is_enabled() -> bool:
+    val = (os.getenv("ALERT_SHARDING") or "0").strip().lower()
+    return val in ("1", "true", "yes", "y", "on")
+
+
+def shard_count() -> int:
+    return max(1, int(_env_float("ALERT_SHARDS", 16)))
+
+
+def shard_of(alert_id: str, shards: Optional[int] = None) -> int:
+    return zlib.crc32(alert_id.encode("utf-8")) % (shards or shard_count())
+
+
+def default_worker_id() -> str:
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+
+
+class LeaseLost(RuntimeError):
+    """The shard lease a sweep started with is no longer held by this worker."""
+
+
+class ShardLeaser:
+    def __init__(
+        self,
+        db: Any,
+        worker_id: Optional[str] = None,
+        shards: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+        heartbeat_s: Optional[float] = None,
+    ) -> None:
+        self.db = db
+        self.worker_id = worker_id or default_worker_id()
+        self.shards = shards or shard_count()
+        self.ttl_s = ttl_s if ttl_s is not None else _env_float("LEASE_TTL_S", 30.0)
+        self.heartbeat_s = heartbeat_s if heartbeat_s is not None else _env_float("LEASE_HEARTBEAT_S", self.ttl_s / 3.0)
+        self._owned: Set[int] = set()
+        self._epochs: Dict[int, int] = {}  # epoch of each held lease, as written by the last claim/renewal
+        self._valid_until: Optional[datetime] = None  # when the leases renewed by the last heartbeat run out
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"heartbeats": 0, "claimed": 0, "lost": 0, "released": 0, "errors": 0}
+        self._last_error: Optional[str] = None
+
+    def _lease_ref(self, shard: int) -> Any:
+        return self.db.collection(LEASES).document(f"shard-{shard}")
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.now(timezone.utc)
+
+    @staticmethod
+    def _expired(lease: Optional[Dict[str, Any]], now: datetime) -> bool:
+        if not lease or not lease.get("owner"):
+            return True
+        exp = lease.get("expiresAt")
+        if isinstance(exp, datetime) and exp.tzinfo is None:
+            exp = exp.replace(tzinfo=timezone.utc)
+        return not isinstance(exp, datetime) or exp <= now
+
+    # --- leases -----------------------------------------------------------------------------
+
+    def _claim(self, shard: int, now: datetime) -> bool:
+        """Takes or renews the lease on `shard`; False when another live worker holds it."""
+
+        def _fn(cur: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            mine = bool(cur) and cur.get("owner") == self.worker_id
+            if not mine and not self._expired(cur, now):
+                return None
+            epoch = int((cur or {}).get("epoch") or 0)
+            return {
+                "shard": shard,
+                "owner": self.worker_id,
+                "epoch": epoch if mine else epoch + 1,  # bumps on every change of hands
+                "heartbeatAt": now,
+                "expiresAt": now + timedelta(seconds=self.ttl_s),
+            }
+
+        doc = transact(self.db, self._lease_ref(shard), _fn)
+        if doc is None:
+            return False
+        with self._lock:
+            self._epochs[shard] = doc["epoch"]
+        return True
+
+    def _drop(self, shard: int) -> None:
+        """Stop treating `shard` as held right away, before its lease can go to another worker."""
+        with self._lock:
+            self._owned.discard(shard)
+            self._epochs.pop(shard, None)
+
+    def _release(self, shard: int) -> None:
+        now = self._now()
+
+        def _fn(cur: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if not cur or cur.get("owner") != self.worker_id:
+                return None
+            return {**cur, "owner": None, "expiresAt": now, "heartbeatAt": now}
+
+        transact(self.db, self._lease_ref(shard), _fn)
+
+    def _live_workers(self, now: datetime) -> int:
+        live = 0
+        for d in self.db.collection(WORKERS).where("expiresAt", ">", now).stream():
+            live += 1
+        return max(1, live)
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def rebalance(self) -> List[int]:
+        """One heartbeat: renew held leases, shed shards above the fair share, claim free/expired ones."""
+        now = self._now()
+        self.db.collection(WORKERS).document(self.worker_id).set({
+            "workerId": self.worker_id,
+            "heartbeatAt": now,
+            "expiresAt": now + timedelta(seconds=self.ttl_s),
+        })
+        target = math.ceil(self.shards / self._live_workers(now))
+        with self._lock:
+            owned = set(self._owned)
+
+        for s in sorted(owned):
+            if not self._claim(s, now):
+                owned.discard(s)
+                self._drop(s)
+                self._count("lost")
+        for s in sorted(owned, reverse=True)[: max(0, len(owned) - target)]:
+            self._drop(s)
+            self._release(s)
+            owned.discard(s)
+            self._count("released")
+        if len(owned) < target:
+            leases = {d.id: d.to_dict() for d in self.db.collection(LEASES).stream()}
+            # Start at a per-worker offset so concurrent workers mostly try different shards
+            start = zlib.crc32(self.worker_id.encode("utf-8")) % self.shards
+            for i in range(self.shards):
+                s = (start + i) % self.shards
+                if len(owned) >= target:
+                    break
+                if s in owned or not self._expired(leases.get(f"shard-{s}"), now):
+                    continue
+                if self._claim(s, now):
+                    owned.add(s)
+                    self._count("claimed")
+
+        with self._lock:
+            self._owned = owned
+            self._epochs = {s: e for s, e in self._epochs.items() if s in owned}
+            self._valid_until = now + timedelta(seconds=self.ttl_s)
+            self._stats["heartbeats"] += 1
+        return sorted(owned)
+
+    def owned_shards(self) -> List[int]:
+        """Shards this worker may check now; empty once heartbeats have stalled past the lease TTL."""
+        with self._lock:
+            if self._valid_until is None or self._now() >= self._valid_until:
+                return []
+            return sorted(self._owned)
+
+    def epochs(self) -> Dict[int, int]:
+        """{shard: lease epoch} for the shards held now (see Fence)."""
+        with self._lock:
+            if self._valid_until is None or self._now() >= self._valid_until:
+                return {}
+            return {s: self._epochs[s] for s in self._owned if s in self._epochs}
+
+    def holds(self, shard: int, epoch: int) -> bool:
+        """Whether the lease on `shard` is still held, unexpired, at `epoch`."""
+        with self._lock:
+            if self._valid_until is None or self._now() >= self._valid_until:
+                return False
+            return shard in self._owned and self._epochs.get(shard) == epoch
+
+    # --- lifecycle --------------------------------------------------------------------------
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.rebalance()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                    self._last_error = str(e)
+            self._stop.wait(self.heartbeat_s)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self.rebalance()
+            self._thread = threading.Thread(target=self._run, name="shard-leaser", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops heartbeats and hands the shards back right away instead of waiting for expiry."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_s + 5.0)
+            self._thread = None
+        with self._lock:
+            held = sorted(self._owned)
+        for s in held:
+            try:
+                self._release(s)
+            except Exception:
+                pass
+        with self._lock:
+            self._owned = set()
+            self._epochs = {}
+            self._valid_until = None
+        try:
+            self.db.collection(WORKERS).document(self.worker_id).delete()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        owned = self.owned_shards()
+        with self._lock:
+            valid_until = self._valid_until
+            counters = dict(self._stats)
+            last_error = self._last_error
+        return {
+            "workerId": self.worker_id,
+            "shards": self.shards,
+            "owned": owned,
+            "validUntil": valid_until.isoformat() if valid_until else None,
+            "ttlS": self.ttl_s,
+            "heartbeatS": self.heartbeat_s,
+            **counters,
+            "lastError": last_error,
+        }
+
+
+
+class Fence:
+    """
+    Lease epochs of one sweep, taken when it starts. holds(alert) stays True only while this worker
+    still holds the alert's shard at the same epoch; check(alerts) raises LeaseLost otherwise.
+    """
+
+    def __init__(self, leaser: ShardLeaser) -> None:
+        self.leaser = leaser
+        self.epochs = leaser.epochs()
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def holds(self, alert: Dict[str, Any]) -> bool:
+        shard = alert.get("shard")
+        if not isinstance(shard, int):
+            shard = shard_of(str(alert.get("_id")), self.leaser.shards)
+        epoch = self.epochs.get(shard)
+        return epoch is not None and self.leaser.holds(shard, epoch)
+
+    def check(self, alerts: List[Dict[str, Any]]) -> None:
+        """Raise LeaseLost unless at least one of `alerts` is still covered by a held lease."""
+        if any(self.holds(a) for a in alerts):
+            return
+        with self._lock:
+            self.skipped += len(alerts)
+        raise LeaseLost("shard lease lost during sweep")
+
+def _worker(seconds: float, tick_s: float) -> None:
+    """Child process of main(): one sharded worker ticking against the shared store."""
+    import json
+    import time
+
+    from . import main as service
+
+    leaser = service.shard_leaser
+    leaser.start()
+    # Let the workers started together see each other before the first tick
+    time.sleep(2 * leaser.heartbeat_s)
+    leaser.rebalance()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        out = service._run_tick()
+        print(json.dumps({
+            "worker": service.shard_leaser.worker_id,
+            "t": time.time(),
+            "shards": service.shard_leaser.owned_shards(),
+            "checked": [r.get("alertId") for r in out["results"]],
+        }), flush=True)
+        time.sleep(tick_s)
+    service.shard_leaser.stop()
+
+
+def main() -> None:
+    """
+    python -m app.shard_leases --workers 3 --alerts 300 --seconds 20 --kill-after 6
+
+    Local multi-process check: seeds alerts into a shared store, runs N sharded workers as
+    separate processes, SIGKILLs one midway (no lease release) and reports how alerts were split,
+    duplicate checks/signals and when the dead worker's shards were picked up. Uses the local
+    SQLite store unless STORAGE_BACKEND=firestore (e.g. with FIRESTORE_EMULATOR_HOST set).
+    """
+    import argparse
+    import json
+    import subprocess
+    import sys
+    import tempfile
+    import time
+
+    ap = argparse.ArgumentParser(description="Run several sharded alert workers against one store")
+    ap.add_argument("--workers", type=int, default=3)
+    ap.add_argument("--alerts", type=int, default=300)
+    ap.add_argument("--seconds", type=float, default=20.0)
+    ap.add_argument("--kill-after", type=float, default=6.0, help="SIGKILL the first worker after this many seconds (0: never)")
+    ap.add_argument("--tick", type=float, default=0.5)
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        _worker(args.seconds, args.tick)
+        return
+
+    env = dict(os.environ)
+    env.setdefault("STORAGE_BACKEND", "local")
+    if env["STORAGE_BACKEND"] == "local":
+        env.setdefault("LOCAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="shards_"), "shards.sqlite"))
+    env.update({"ALERT_SHARDING": "1", "SIMULATE_FLIGHTS": "1", "ANALYZER_HEURISTIC": "1"})
+    env.setdefault("LEASE_TTL_S", "3")
+    env.setdefault("LEASE_HEARTBEAT_S", "1")
+    # Every alert should be checked once: its next check lands after the end of the run
+    env.setdefault("SCHED_MIN_INTERVAL_MIN", str(max(60.0, args.seconds / 60.0 + 1.0)))
+    os.environ.update(env)
+
+    from .store_flights import FlightStore
+
+    from datetime import datetime as _dt
+
+    fs = FlightStore()
+    start = _dt.now(timezone.utc) + timedelta(seconds=5)
+    for i in range(args.alerts):
+        alert_id = fs.create_alert({"origin": "LIM", "destination": ["MIA", "JFK", "MAD", "CUZ", "BOG"][i % 5], "budget": 100.0 + i, "maxWaitHours": 168})
+        # Spread due times over the run so a killed worker leaves due alerts behind in its shards
+        due = start + timedelta(seconds=args.seconds * 0.6 * i / max(1, args.alerts))
+        fs.writes.set(fs.db.collection("flightAlertsBackend").document(alert_id), {"nextCheckAt": due}, merge=True)
+    fs.writes.close()
+
+    cmd = [sys.executable, "-m", "app.shard_leases", "--worker", "--seconds", str(args.seconds), "--tick", str(args.tick)]
+    procs = [
+        subprocess.Popen(cmd, env={**env, "WORKER_ID": f"worker-{i}"}, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for i in range(args.workers)
+    ]
+    t0 = time.time()
+    killed_at = None
+    if args.kill_after > 0 and procs:
+        time.sleep(args.kill_after)
+        procs[0].kill()
+        killed_at = time.time()
+    lines = []
+    for p in procs:
+        out, _ = p.communicate()
+        lines += [json.loads(x) for x in out.splitlines() if x.startswith("{")]
+
+    checks: Dict[str, int] = {}
+    per_worker: Dict[str, int] = {}
+    dead_shards: Set[int] = set()
+    dead = "worker-0" if killed_at else None
+    for x in lines:
+        per_worker[x["worker"]] = per_worker.get(x["worker"], 0) + len(x["checked"])
+        for a in x["checked"]:
+            checks[a] = checks.get(a, 0) + 1
+        if x["worker"] == dead:
+            dead_shards = set(x["shards"])
+    taken_over = [x["t"] - killed_at for x in lines if killed_at and x["worker"] != dead and x["t"] > killed_at and dead_shards & set(x["shards"])]
+    signals = [d.to_dict() for d in fs.db.collection("flightAlertSignals").stream()]
+    print(json.dumps({
+        "workers": args.workers,
+        "alerts": args.alerts,
+        "killedWorker": dead,
+        "checksPerWorker": per_worker,
+        "alertsChecked": len(checks),
+        "unchecked": args.alerts - len(checks),
+        "duplicateChecks": sum(n - 1 for n in checks.values() if n > 1),
+        "signals": len(signals),
+        "duplicateSignals": len(signals) - len({s.get("alertId") for s in signals}),
+        "reassignedAfterS": round(min(taken_over), 2) if taken_over else None,
+        "elapsedS": round(time.time() - t0, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
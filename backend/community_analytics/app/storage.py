@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from . import metrics
+
+# Storage backend for Store/FlightStore (env STORAGE_BACKEND):
+#   firestore - google.cloud.firestore.Client (default)
+#   local     - embedded SQLite (WAL) engine in app/local_store.py at LOCAL_DB_PATH
+# Both expose the same client surface, so the stores only ever talk to `db`.
+
+try:  # sentinels from the real client when installed; the local engine understands both
+    from google.cloud.firestore import SERVER_TIMESTAMP, Increment
+except Exception:  # local-only installs
+    from .local_store import SERVER_TIMESTAMP, Increment  # noqa: F401
+
+BACKENDS = ("firestore", "local")
+
+
+def selected_backend() -> str:
+    name = (os.getenv("STORAGE_BACKEND") or "firestore").strip().lower()
+    return name if name in BACKENDS else "firestore"
+
+
+def local_db_path() -> str:
+    return os.getenv("LOCAL_DB_PATH", os.path.join(os.getcwd(), "cache", "local.sqlite"))
+
+
+def _unwrap(ref: Any) -> Any:
+    return getattr(ref, "_ref", ref)
+
+
+def already_exists(e: BaseException) -> bool:
+    """A create() on an existing document (google.api_core AlreadyExists/Conflict, or the local engine's AlreadyExists)."""
+    return type(e).__name__ in ("AlreadyExists", "Conflict")
+
+
+def _collection_of(ref: Any) -> str:
+    parent = getattr(ref, "parent", None)
+    return str(getattr(parent, "id", None) or getattr(ref, "collection", None) or "unknown")
+
+
+class _TimedQuery:
+    """Query/collection proxy that times stream() and counts documents read per collection."""
+
+    _CHAIN = ("where", "order_by", "limit", "start_after", "select", "offset")
+
+    def __init__(self, q: Any, collection: str) -> None:
+        self._q = q
+        self._collection = collection
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._q, name)
+        if name in self._CHAIN:
+            return lambda *a, **k: _TimedQuery(attr(*a, **k), self._collection)
+        return attr
+
+    def document(self, *args: Any) -> "_TimedRef":
+        return _TimedRef(self._q.document(*args), self._collection)
+
+    def stream(self) -> Iterator[Any]:
+        t = time.perf_counter()
+        n = 0
+        try:
+            for d in self._q.stream():
+                n += 1
+                yield d
+        finally:
+            metrics.observe("store_query_duration_seconds", time.perf_counter() - t, collection=self._collection, op="stream")
+            metrics.inc("store_documents_read_total", n, collection=self._collection)
+
+
+class _TimedRef:
+    def __init__(self, ref: Any, collection: str) -> None:
+        self._ref = ref
+        self._collection = collection
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._ref, name)
+
+    def get(self, *args: Any, **kwargs: Any) -> Any:
+        with metrics.timer("store_query_duration_seconds", collection=self._collection, op="get"):
+            snap = self._ref.get(*args, **kwargs)
+        metrics.inc("store_documents_read_total", 1, collection=self._collection)
+        return snap
+
+    def set(self, *args: Any, **kwargs: Any) -> Any:
+        metrics.inc("store_documents_written_total", 1, collection=self._collection)
+        return self._ref.set(*args, **kwargs)
+
+    def delete(self, *args: Any, **kwargs: Any) -> Any:
+        metrics.inc("store_documents_written_total", 1, collection=self._collection)
+        return self._ref.delete(*args, **kwargs)
+
+
+class _TimedBatch:
+    def __init__(self, batch: Any) -> None:
+        self._batch = batch
+        self._writes: dict = {}
+
+    def _count(self, ref: Any) -> Any:
+        c = ref._collection if isinstance(ref, _TimedRef) else _collection_of(ref)
+        self._writes[c] = self._writes.get(c, 0) + 1
+        return _unwrap(ref)
+
+    def set(self, ref: Any, *args: Any, **kwargs: Any) -> Any:
+        return self._batch.set(self._count(ref), *args, **kwargs)
+
+    def create(self, ref: Any, *args: Any, **kwargs: Any) -> Any:
+        return self._batch.create(self._count(ref), *args, **kwargs)
+
+    def update(self, ref: Any, *args: Any, **kwargs: Any) -> Any:
+        return self._batch.update(self._count(ref), *args, **kwargs)
+
+    def delete(self, ref: Any, *args: Any, **kwargs: Any) -> Any:
+        return self._batch.delete(self._count(ref), *args, **kwargs)
+
+    def commit(self) -> Any:
+        with metrics.timer("store_query_duration_seconds", collection="*", op="commit"):
+            out = self._batch.commit()
+        for c, n in self._writes.items():
+            metrics.inc("store_documents_written_total", n, collection=c)
+        return out
+
+
+class InstrumentedClient:
+    """Wraps either backend so reads/writes feed app/metrics.py; only used when METRICS_ENABLED=1."""
+
+    def __init__(self, client: Any) -> None:
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+    def collection(self, name: str) -> _TimedQuery:
+        return _TimedQuery(self._client.collection(name), name)
+
+    def batch(self) -> _TimedBatch:
+        return _TimedBatch(self._client.batch())
+
+    def get_all(self, refs: Iterable[Any], *args: Any, **kwargs: Any) -> Iterator[Any]:
+        refs = list(refs)
+        collection = refs[0]._collection if refs and isinstance(refs[0], _TimedRef) else "*"
+        t = time.perf_counter()
+        n = 0
+        try:
+            for snap in self._client.get_all([_unwrap(r) for r in refs], *args, **kwargs):
+                n += 1
+                yield snap
+        finally:
+            metrics.observe("store_query_duration_seconds", time.perf_counter() - t, collection=collection, op="get_all")
+            metrics.inc("store_documents_read_total", n, collection=collection)
+
+
+def _raw_client(project_id: Optional[str], backend: Optional[str]) -> Any:
+    if (backend or selected_backend()) == "local":
+        from .local_store import LocalClient
+
+        return LocalClient(local_db_path())
+    from google.cloud import firestore
+
+    return firestore.Client(project=project_id) if project_id else firestore.Client()
+
+
+def make_client(project_id: Optional[str] = None, backend: Optional[str] = None) -> Any:
+    client = _raw_client(project_id, backend)
+    return InstrumentedClient(client) if metrics.ENABLED else client
+
+
+def transact(client: Any, ref: Any, fn: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Atomic read-modify-write of one document on either backend (Firestore transaction or a
+    SQLite IMMEDIATE transaction). fn(current dict or None) returns the document to write, or None
+    to leave it unchanged; that return value is passed back to the caller.
+    """
+    client = getattr(client, "_client", client)
+    ref = _unwrap(ref)
+    if hasattr(client, "transact"):
+        return client.transact(ref, fn)
+    from google.cloud import firestore
+
+    @firestore.transactional
+    def _run(tx: Any) -> Optional[Dict[str, Any]]:
+        snap = ref.get(transaction=tx)
+        new = fn(snap.to_dict() if snap.exists else None)
+        if new is not None:
+            tx.set(ref, new)
+        return new
+
+    return _run(client.transaction())
+
+
+def main() -> None:
+    """python -m app.storage --sinceDays 30: copy recent Firestore docs into the local engine (replica/benchmark seed)."""
+    import argparse
+    from datetime import datetime, timedelta
+
+    ap = argparse.ArgumentParser(description="Copy Firestore collections into the local SQLite store")
+    ap.add_argument("--sinceDays", type=int, default=30)
+    ap.add_argument(
+        "--collections",
+        default="communityMessages,communityAnalysis,communityAggregates,flightAlertsBackend,flightMonitorEvents",
+    )
+    args = ap.parse_args()
+
+    src = make_client(os.getenv("FIRESTORE_PROJECT_ID"), backend="firestore")
+    dst = make_client(backend="local")
+    since = datetime.utcnow() - timedelta(days=args.sinceDays)
+    copied = {}
+    for name in [c.strip() for c in args.collections.split(",") if c.strip()]:
+        q = src.collection(name)
+        if name in ("communityMessages", "communityAnalysis", "flightMonitorEvents"):
+            q = q.where("createdAt", ">=", since)
+        n = 0
+        batch = dst.batch()
+        for d in q.stream():
+            batch.set(dst.collection(name).document(d.id), d.to_dict())
+            n += 1
+            if n % 500 == 0:
+                batch.commit()
+                batch = dst.batch()
+        batch.commit()
+        copied[name] = n
+    print({"copied": copied, "path": local_db_path()})
+
+
+if __name__ == "__main__":
+    main()
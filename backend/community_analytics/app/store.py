@@ -1,51 +1,209 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 from datetime import datetime
 import os
+import time
 
-from google.cloud import firestore
+from . import geo_index, rollups
+from .storage import SERVER_TIMESTAMP, Increment, make_client
+from .write_buffer import build_write_buffer
+
+# Page size for cursor-paged readers (iter_analysis / iter_texts)
+STREAM_PAGE_SIZE = int(os.getenv("STORE_PAGE_SIZE", "500"))
+# Seconds a rebuild coverage marker (rollups.META) is reused before it is read again
+COVERAGE_TTL_S = float(os.getenv("COVERAGE_TTL_S", "60"))
 
 
 class Store:
     def __init__(self, project_id: Optional[str] = None) -> None:
-        self.db = firestore.Client(project=project_id) if project_id else firestore.Client()
+        # Firestore by default; STORAGE_BACKEND=local uses the embedded SQLite engine (app/storage.py)
+        self.db = make_client(project_id)
+        self.writes = build_write_buffer(self.db)
+        self._coverage: Dict[str, Any] = {}
+
+    def save_analysis(self, doc: Dict[str, Any], sync: bool = False) -> str:
+        """Queues the analysis doc (and its day-bucket increment, in the same batch) on the write buffer.
 
-    def save_analysis(self, doc: Dict[str, Any]) -> str:
+        With sync the batch is committed before returning (raising on failure) instead of queued.
+        """
         ref = self.db.collection("communityAnalysis").document()
-        ref.set({
-            **doc,
-            "createdAt": firestore.SERVER_TIMESTAMP,
-        })
+        # create, not set: a retried commit that already landed fails instead of re-applying the increments
+        writes = [("create", ref, {**doc, "createdAt": SERVER_TIMESTAMP}, False)]
+        if rollups.is_enabled():
+            # createdAt is server time, so bucket by now
+            loc = doc.get("location") or "unknown"
+            day = rollups.day_key()
+            writes.append((
+                "set",
+                self.db.collection(rollups.AGGREGATES).document(rollups.bucket_id(loc, day)),
+                {
+                    "location": loc,
+                    "day": day,
+                    "updatedAt": SERVER_TIMESTAMP,
+                    **rollups.bucket_delta(doc, Increment),
+                },
+                True,
+            ))
+        if geo_index.is_enabled():
+            day = rollups.day_key()
+            for tile, delta in geo_index.tile_deltas(doc, Increment).items():
+                writes.append((
+                    "set",
+                    self.db.collection(geo_index.TILES).document(geo_index.tile_id(tile, day)),
+                    {"tile": tile, "day": day, "updatedAt": SERVER_TIMESTAMP, **delta},
+                    True,
+                ))
+        if sync:
+            self.writes.write(writes)
+        else:
+            self.writes.enqueue(writes)
         return ref.id
 
+    def coverage(self, name: str) -> Optional[Dict[str, Any]]:
+        """Rebuild marker `name` (rollups.META), cached for COVERAGE_TTL_S."""
+        hit = self._coverage.get(name)
+        if hit is not None and time.monotonic() - hit[0] < COVERAGE_TTL_S:
+            return hit[1]
+        snap = self.db.collection(rollups.META).document(name).get()
+        marker = snap.to_dict() if snap.exists else None
+        self._coverage[name] = (time.monotonic(), marker)
+        return marker
+
+    def _record_coverage(self, name: str, first_day: str, location: Optional[str] = None) -> None:
+        """Widens the marker to first_day; earlier days outside a rebuild window keep their buckets."""
+        ref = self.db.collection(rollups.META).document(name)
+        snap = ref.get()
+        marker = (snap.to_dict() if snap.exists else None) or {}
+        if location:
+            prev = (marker.get("locations") or {}).get(location)
+            ref.set({"locations": {location: min(first_day, prev) if prev else first_day}, "updatedAt": SERVER_TIMESTAMP}, merge=True)
+        else:
+            prev = marker.get("coveredFrom")
+            ref.set({"coveredFrom": min(first_day, prev) if prev else first_day, "updatedAt": SERVER_TIMESTAMP}, merge=True)
+        self._coverage.pop(name, None)
+
+    def rollups_cover(self, since_days: int, location: Optional[str] = None) -> bool:
+        """Whether day buckets are complete for the window (ROLLUPS_ENABLED and a rebuild covering its first day)."""
+        return rollups.is_enabled() and rollups.covers(self.coverage("rollups"), since_days, location)
+
+    def geo_tiles_cover(self, since_days: int) -> bool:
+        """Whether geohash tiles are complete for the window (GEO_INDEX_ENABLED and a rebuild covering its first day)."""
+        return geo_index.is_enabled() and rollups.covers(self.coverage("geoTiles"), since_days)
+
+    def fetch_rollups(self, location: str, since_days: int) -> List[Dict[str, Any]]:
+        """Day buckets for one location, read by ID (at most since_days point reads, no index needed)."""
+        col = self.db.collection(rollups.AGGREGATES)
+        refs = [col.document(rollups.bucket_id(location, d)) for d in rollups.window_days(since_days)]
+        return [s.to_dict() for s in self.db.get_all(refs) if s.exists]
+
+    def fetch_rollups_all(self, since_days: int) -> List[Dict[str, Any]]:
+        """Day buckets for every location in the window."""
+        first = rollups.window_days(since_days)[-1]
+        q = self.db.collection(rollups.AGGREGATES).where("day", ">=", first)
+        return [d.to_dict() for d in q.stream()]
+
+    def rebuild_rollups(self, since_days: int, location: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Recompute buckets for the completed UTC days in the window from communityAnalysis, replacing
+        existing ones. Today's buckets are left to the ingest increments: overwriting a doc that is
+        being incremented would drop or double-count the concurrent increments.
+        """
+        days = rollups.window_days(since_days)
+        today = days[0]
+        since = datetime.strptime(days[-1], "%Y-%m-%d")
+        buckets = {k: b for k, b in rollups.build_buckets(self.iter_analysis(location, since)).items() if b["day"] != today}
+
+        col = self.db.collection(rollups.AGGREGATES)
+        q = col.where("day", ">=", days[-1]).where("day", "<", today)
+        stale = [d.reference for d in q.stream() if d.id not in buckets and (not location or (d.to_dict() or {}).get("location") == location)]
+        writes = [("delete", r, None) for r in stale] + [("set", col.document(k), b) for k, b in buckets.items()]
+        for i in range(0, len(writes), 400):
+            batch = self.db.batch()
+            for op, ref, b in writes[i:i + 400]:
+                if op == "delete":
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, {**b, "updatedAt": SERVER_TIMESTAMP})
+            batch.commit()
+        self._record_coverage("rollups", days[-1], location)
+        return {"docs": sum(b["count"] for b in buckets.values()), "buckets": len(buckets), "deleted": len(stale), "sinceDay": days[-1]}
+
+    def fetch_geo_tiles(self, tiles: List[str], since_days: int) -> List[Dict[str, Any]]:
+        """Tile docs for the window, read by ID (len(tiles) * since_days point reads, no index needed)."""
+        col = self.db.collection(geo_index.TILES)
+        refs = [col.document(geo_index.tile_id(t, d)) for t in tiles for d in rollups.window_days(since_days)]
+        return [s.to_dict() for s in self.db.get_all(refs) if s.exists]
+
+    def rebuild_geo_tiles(self, since_days: int) -> Dict[str, Any]:
+        """Recompute geohash tiles for the completed UTC days in the window (today is left to the ingest increments)."""
+        days = rollups.window_days(since_days)
+        today = days[0]
+        since = datetime.strptime(days[-1], "%Y-%m-%d")
+        tiles = {k: t for k, t in geo_index.build_tiles(self.iter_analysis(None, since)).items() if t["day"] != today}
+
+        col = self.db.collection(geo_index.TILES)
+        stale = [d.reference for d in col.where("day", ">=", days[-1]).where("day", "<", today).stream() if d.id not in tiles]
+        writes = [("delete", r, None) for r in stale] + [("set", col.document(k), t) for k, t in tiles.items()]
+        for i in range(0, len(writes), 400):
+            batch = self.db.batch()
+            for op, ref, t in writes[i:i + 400]:
+                if op == "delete":
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, {**t, "updatedAt": SERVER_TIMESTAMP})
+            batch.commit()
+        self._record_coverage("geoTiles", days[-1])
+        return {"tiles": len(tiles), "deleted": len(stale), "sinceDay": days[-1]}
+
+    def _paged(self, q: Any, page_size: Optional[int] = None) -> Iterator[Any]:
+        """Streams a createdAt-ordered query page by page with start_after cursors (bounded memory)."""
+        size = page_size or STREAM_PAGE_SIZE
+        q = q.order_by("createdAt")
+        last = None
+        while True:
+            page = q.start_after(last).limit(size) if last is not None else q.limit(size)
+            n = 0
+            for d in page.stream():
+                n += 1
+                last = d
+                yield d
+            if n < size:
+                return
+
+    def iter_analysis(self, location: Optional[str], since: datetime, page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """communityAnalysis docs since `since` (all locations when location is None), oldest first."""
+        q = self.db.collection("communityAnalysis")
+        if location:
+            q = q.where("location", "==", location)
+        q = q.where("createdAt", ">=", since)
+        for d in self._paged(q, page_size):
+            yield d.to_dict()
+
+    def iter_texts(self, location: Optional[str], since: datetime, page_size: Optional[int] = None) -> Iterator[str]:
+        """communityMessages texts since `since` (all locations when location is None), oldest first."""
+        q = self.db.collection("communityMessages")
+        if location:
+            q = q.where("location", "==", location)
+        q = q.where("createdAt", ">=", since)
+        for d in self._paged(q, page_size):
+            t = d.to_dict().get("text")
+            if t:
+                yield t
+
+    def latest_text_at(self, location: str) -> Optional[datetime]:
+        """createdAt of the newest communityMessages doc for a location (None if there are none)."""
+        q = self.db.collection("communityMessages").where("location", "==", location)
+        for d in q.order_by("createdAt", direction="DESCENDING").limit(1).stream():
+            return d.to_dict().get("createdAt")
+        return None
+
     def fetch_analysis(self, location: str, since: datetime) -> List[Dict[str, Any]]:
-        q = (
-            self.db.collection("communityAnalysis")
-            .where("location", "==", location)
-            .where("createdAt", ">=", since)
-        )
-        rows = []
-        for d in q.stream():
-            x = d.to_dict()
-            rows.append(x)
-        return rows
+        return list(self.iter_analysis(location, since))
 
     def fetch_analysis_since(self, since: datetime) -> List[Dict[str, Any]]:
-        q = self.db.collection("communityAnalysis").where("createdAt", ">=", since)
-        rows = []
-        for d in q.stream():
-            rows.append(d.to_dict())
-        return rows
+        return list(self.iter_analysis(None, since))
 
     def fetch_texts(self, location: str, since: datetime) -> List[str]:
-        q = (
-            self.db.collection("communityMessages")
-            .where("location", "==", location)
-            .where("createdAt", ">=", since)
-        )
-        out: List[str] = []
-        for d in q.stream():
-            x = d.to_dict()
-            t = x.get("text")
-            if t:
-                out.append(t)
-        return out
+        return list(self.iter_texts(location, since))
+
+    def fetch_texts_since(self, since: datetime) -> List[str]:
+        return list(self.iter_texts(None, since))
@@ -1,18 +1,36 @@
-from typing import Optional, Dict, Any, List
+from typing import Optional, Callable, Dict, Any, List, Tuple
 from datetime import datetime, timedelta
-from google.cloud import firestore
+import os
+
+from .storage import SERVER_TIMESTAMP, make_client
+from .shard_leases import shard_count, shard_of
+from .history_cache import HistoryCache, _is_enabled as _history_cache_enabled
+from .price_predictor import PriceSeries
+from .write_buffer import build_write_buffer
 
 
 class FlightStore:
     def __init__(self, project_id: Optional[str] = None) -> None:
-        self.db = firestore.Client(project=project_id) if project_id else firestore.Client()
+        # Firestore by default; STORAGE_BACKEND=local uses the embedded SQLite engine (app/storage.py)
+        self.db = make_client(project_id)
+        # Signals/notifications go through a write-behind buffer (see app/write_buffer.py)
+        self.writes = build_write_buffer(self.db)
+        self.history = HistoryCache(
+            self._load_history,
+            window_hours=int(os.getenv("HISTORY_CACHE_WINDOW_HOURS", "720")),
+            max_routes=int(os.getenv("HISTORY_CACHE_MAX_ROUTES", "1024")),
+            min_refresh_s=float(os.getenv("HISTORY_CACHE_MIN_REFRESH_S", "30")),
+        )
 
     def create_alert(self, alert: Dict[str, Any]) -> str:
         ref = self.db.collection("flightAlertsBackend").document()
         ref.set({
             **alert,
-            "createdAt": firestore.SERVER_TIMESTAMP,
+            "createdAt": SERVER_TIMESTAMP,
             "status": "active",
+            "shard": shard_of(ref.id),
+            # Due on the next scheduler tick (app/scheduler.py)
+            "nextCheckAt": SERVER_TIMESTAMP,
         })
         return ref.id
 
@@ -22,32 +40,118 @@ class FlightStore:
 
     def save_signal(self, signal: Dict[str, Any]) -> str:
         ref = self.db.collection("flightAlertSignals").document()
-        ref.set({**signal, "createdAt": firestore.SERVER_TIMESTAMP})
+        self.writes.set(ref, {**signal, "createdAt": SERVER_TIMESTAMP})
         return ref.id
 
-    def get_active_alerts(self) -> List[Dict[str, Any]]:
+    def _active(self, shards: Optional[List[int]]) -> List[Any]:
+        """Active-alert queries, one per group of <= 30 shards (Firestore `in` limit) when sharded."""
         q = self.db.collection("flightAlertsBackend").where("status", "==", "active")
-        return [d.to_dict() | {"_id": d.id} for d in q.stream()]
+        if shards is None:
+            return [q]
+        return [q.where("shard", "in", shards[i : i + 30]) for i in range(0, len(shards), 30)]
+
+    def get_active_alerts(self, shards: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """All active alerts, or only those in `shards` (see app/shard_leases.py)."""
+        return [d.to_dict() | {"_id": d.id} for q in self._active(shards) for d in q.stream()]
+
+    def get_due_alerts(self, now: datetime, limit: int, shards: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """Active alerts with nextCheckAt <= now, most overdue first (Firestore index: status, [shard,] nextCheckAt)."""
+        out: List[Dict[str, Any]] = []
+        for q in self._active(shards):
+            q = q.where("nextCheckAt", "<=", now).order_by("nextCheckAt").limit(limit)
+            out.extend(d.to_dict() | {"_id": d.id} for d in q.stream())
+        if shards is not None and len(shards) > 30:
+            out = sorted(out, key=lambda a: a["nextCheckAt"])[:limit]
+        return out
+
+    def backfill_alerts(self, now: datetime) -> int:
+        """Fills nextCheckAt (due now) and shard on active alerts that predate them, or whose shard count changed."""
+        n = 0
+        shards = shard_count()
+        for d in self.db.collection("flightAlertsBackend").where("status", "==", "active").stream():
+            x = d.to_dict()
+            fields: Dict[str, Any] = {}
+            if x.get("nextCheckAt") is None:
+                fields["nextCheckAt"] = now
+            if x.get("shard") != shard_of(d.id, shards):
+                fields["shard"] = shard_of(d.id, shards)
+            if fields:
+                self.writes.set(d.reference, fields, merge=True)
+                n += 1
+        return n
+
+    def schedule_alerts(self, updates: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Queues nextCheckAt (and last-check fields) for each (alert id, fields) on the write buffer."""
+        for alert_id, fields in updates:
+            self.writes.set(self.db.collection("flightAlertsBackend").document(alert_id), fields, merge=True)
+
+    def expire_alerts(self, alert_ids: List[str], now: datetime) -> None:
+        """Queues status=expired for alerts whose departure has passed, taking them out of active queries."""
+        for alert_id in alert_ids:
+            self.writes.set(self.db.collection("flightAlertsBackend").document(alert_id), {"status": "expired", "expiredAt": now}, merge=True)
 
     def save_notification(self, notif: Dict[str, Any]) -> str:
         ref = self.db.collection("userNotifications").document()
-        ref.set({**notif, "createdAt": firestore.SERVER_TIMESTAMP})
+        self.writes.set(ref, {**notif, "createdAt": SERVER_TIMESTAMP})
         return ref.id
 
-    def fetch_history_prices(self, origin: str, destination: str, departure: Optional[str], since_hours: int = 720) -> List[Dict[str, Any]]:
-        # Use flightMonitorEvents as a source of observed/predicted prices
-        since = datetime.utcnow() - timedelta(hours=since_hours)
+    def save_signal_with_notification(
+        self,
+        signal: Dict[str, Any],
+        notif: Dict[str, Any],
+        dedupe_key: Optional[str] = None,
+        sync: bool = False,
+        on_done: Optional[Callable[[bool], None]] = None,
+    ) -> str:
+        """
+        Signal plus its notification (meta.signalId filled in) queued as one atomic group.
+
+        With dedupe_key both docs get deterministic ids and are merged, so a repeated write (another
+        worker, a retried sweep) lands on the same signal/notification instead of adding new ones.
+        With sync the group is committed before returning (raising on failure) instead of queued;
+        otherwise on_done(committed) is called once the write buffer has committed or dropped it.
+        """
+        sref = self.db.collection("flightAlertSignals").document(dedupe_key)
+        nref = self.db.collection("userNotifications").document(dedupe_key)
+        notif = {**notif, "meta": {**(notif.get("meta") or {}), "signalId": sref.id}}
+        merge = dedupe_key is not None
+        writes = [
+            ("set", sref, {**signal, "createdAt": SERVER_TIMESTAMP}, merge),
+            ("set", nref, {**notif, "createdAt": SERVER_TIMESTAMP}, merge),
+        ]
+        if sync:
+            self.writes.write(writes)
+        else:
+            self.writes.enqueue(writes, on_done)
+        return sref.id
+
+    def _load_history(self, origin: str, destination: str, after: datetime, inclusive: bool) -> List[Tuple[Any, float]]:
+        """Price points for a route with createdAt after `after` (>= when inclusive), oldest first."""
         q = (
             self.db.collection("flightMonitorEvents")
             .where("origin", "==", origin)
             .where("destination", "==", destination)
-            .where("createdAt", ">=", since)
+            .where("createdAt", ">=" if inclusive else ">", after)
+            .order_by("createdAt")
         )
-        rows: List[Dict[str, Any]] = []
+        rows: List[Tuple[Any, float]] = []
         for d in q.stream():
             x = d.to_dict()
             price = x.get("observedPrice") or x.get("predictedPrice")
-            if price:
-                rows.append({"ts": x.get("createdAt"), "price": float(price)})
-        rows.sort(key=lambda r: r["ts"].timestamp() if hasattr(r["ts"], "timestamp") else 0)
+            if price and x.get("createdAt") is not None:
+                rows.append((x.get("createdAt"), float(price)))
         return rows
+
+    def fetch_history_prices(self, origin: str, destination: str, departure: Optional[str], since_hours: int = 720) -> List[Dict[str, Any]]:
+        # Use flightMonitorEvents as a source of observed/predicted prices; served incrementally
+        # from the per-route HistoryCache unless disabled or the window exceeds what it keeps.
+        if _history_cache_enabled() and since_hours <= self.history.window_hours:
+            return self.history.get(origin, destination, since_hours)
+        since = datetime.utcnow() - timedelta(hours=since_hours)
+        return [{"ts": ts, "price": price} for ts, price in self._load_history(origin, destination, since, True)]
+
+    def fetch_history_series(self, origin: str, destination: str, departure: Optional[str], since_hours: int = 720) -> PriceSeries:
+        """Same data as fetch_history_prices as a PriceSeries, ready for predict_should_buy."""
+        if _history_cache_enabled() and since_hours <= self.history.window_hours:
+            return self.history.get_series(origin, destination, since_hours)
+        return PriceSeries.from_history(self.fetch_history_prices(origin, destination, departure, since_hours))
@@ -0,0 +1,203 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import time
+
+from . import metrics
+
+RouteKey = Tuple[Optional[str], Optional[str], Optional[str]]
+# evaluate([(alert, route_data), ...]) -> one result dict (or exception) per alert, in order
+BatchEvaluator = Callable[[List[Tuple[Dict[str, Any], Dict[str, Any]]]], List[Any]]
+
+
+def _max_workers() -> int:
+    try:
+        return max(1, int(os.getenv("SWEEP_MAX_WORKERS", "8")))
+    except ValueError:
+        return 8
+
+
+def route_key(alert: Dict[str, Any]) -> RouteKey:
+    return (
+        alert.get("origin"),
+        alert.get("destination"),
+        alert.get("departureDate") or None,
+    )
+
+
+def group_by_route(alerts: List[Dict[str, Any]]) -> Dict[RouteKey, List[Dict[str, Any]]]:
+    groups: Dict[RouteKey, List[Dict[str, Any]]] = {}
+    for a in alerts:
+        groups.setdefault(route_key(a), []).append(a)
+    return groups
+
+
+class PhaseTimer:
+    """Accumulates wall-clock milliseconds per named phase."""
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        self._t0 = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = round(self.phases.get(phase, 0.0) + (now - self._t0) * 1000.0, 2)
+        metrics.observe("sweep_phase_duration_seconds", now - self._t0, phase=phase)
+        self._t0 = now
+
+
+def _fan_out(
+    groups: Dict[RouteKey, List[Dict[str, Any]]],
+    route_data: Dict[RouteKey, Dict[str, Any]],
+    route_errors: Dict[RouteKey, str],
+    evaluate: BatchEvaluator,
+    results: List[Dict[str, Any]],
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    batch: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    for key, members in groups.items():
+        for a in members:
+            if key in route_errors:
+                results.append({"alertId": a.get("_id"), "error": route_errors[key]})
+            else:
+                batch.append((a, route_data[key]))
+    if not batch:
+        return []
+    try:
+        outcomes = evaluate(batch)
+    except Exception as e:
+        outcomes = [e] * len(batch)
+    evaluated: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    for (a, _), res in zip(batch, outcomes):
+        if isinstance(res, BaseException):
+            results.append({"alertId": a.get("_id"), "error": str(res)})
+        else:
+            evaluated.append((a, res))
+    return evaluated
+
+
+def _collect(
+    evaluated: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    signal_ids: Dict[int, Optional[str]],
+    persist_errors: Dict[int, str],
+    results: List[Dict[str, Any]],
+) -> None:
+    for a, res in evaluated:
+        if id(res) in persist_errors:
+            results.append({"alertId": a.get("_id"), "error": persist_errors[id(res)]})
+            continue
+        triggered = bool(res.pop("triggered", False))
+        results.append({"alertId": a.get("_id"), "triggered": triggered, "result": res, "signalId": signal_ids.get(id(res))})
+
+
+def _stats(alerts: List[Dict[str, Any]], groups: Dict[RouteKey, Any], route_errors: Dict[RouteKey, str], workers: int, timer: PhaseTimer) -> Dict[str, Any]:
+    return {
+        "alerts": len(alerts),
+        "routes": len(groups),
+        "routeErrors": len(route_errors),
+        "workers": workers,
+        "timingsMs": timer.phases,
+    }
+
+
+def run_sweep(
+    alerts: List[Dict[str, Any]],
+    fetch_route: Callable[[RouteKey], Dict[str, Any]],
+    evaluate: BatchEvaluator,
+    persist: Callable[[Dict[str, Any], Dict[str, Any]], Optional[str]],
+    timer: Optional[PhaseTimer] = None,
+    max_workers: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Checks many alerts with one upstream fetch per unique (origin, destination, departureDate).
+
+    - fetch_route(key) -> shared data for the route (e.g. {"history": [...], "offers": [...]})
+    - evaluate([(alert, route_data), ...]) -> result dict (or exception) per alert; results set "triggered"
+    - persist(alert, result) -> signal id for triggered alerts
+    Returns (results, stats) where stats carries per-phase timings in ms.
+    """
+    timer = timer or PhaseTimer()
+    workers = max_workers or _max_workers()
+    groups = group_by_route(alerts)
+    timer.mark("group")
+
+    route_data: Dict[RouteKey, Dict[str, Any]] = {}
+    route_errors: Dict[RouteKey, str] = {}
+    results: List[Dict[str, Any]] = []
+    signal_ids: Dict[int, Optional[str]] = {}
+    persist_errors: Dict[int, str] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {key: pool.submit(fetch_route, key) for key in groups}
+        for key, fut in futures.items():
+            try:
+                route_data[key] = fut.result()
+            except Exception as e:
+                route_errors[key] = str(e)
+        timer.mark("fetch")
+
+        evaluated = _fan_out(groups, route_data, route_errors, evaluate, results)
+        timer.mark("evaluate")
+
+        pending = [(res, pool.submit(persist, a, res)) for a, res in evaluated if res.get("triggered")]
+        for res, fut in pending:
+            try:
+                signal_ids[id(res)] = fut.result()
+            except Exception as e:
+                persist_errors[id(res)] = str(e)
+        timer.mark("persist")
+
+    _collect(evaluated, signal_ids, persist_errors, results)
+    return results, _stats(alerts, groups, route_errors, workers, timer)
+
+
+async def arun_sweep(
+    alerts: List[Dict[str, Any]],
+    fetch_route: Callable[[RouteKey], Awaitable[Dict[str, Any]]],
+    evaluate: BatchEvaluator,
+    persist: Callable[[Dict[str, Any], Dict[str, Any]], Optional[str]],
+    timer: Optional[PhaseTimer] = None,
+    max_workers: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Asyncio flavour of run_sweep: fetch_route is a coroutine; persist still runs in threads."""
+    timer = timer or PhaseTimer()
+    workers = max_workers or _max_workers()
+    sem = asyncio.Semaphore(workers)
+    groups = group_by_route(alerts)
+    timer.mark("group")
+
+    async def _fetch(key: RouteKey) -> Dict[str, Any]:
+        async with sem:
+            return await fetch_route(key)
+
+    async def _persist(a: Dict[str, Any], res: Dict[str, Any]) -> Optional[str]:
+        async with sem:
+            return await asyncio.to_thread(persist, a, res)
+
+    keys = list(groups)
+    outcomes = await asyncio.gather(*(_fetch(k) for k in keys), return_exceptions=True)
+    route_data: Dict[RouteKey, Dict[str, Any]] = {}
+    route_errors: Dict[RouteKey, str] = {}
+    for key, out in zip(keys, outcomes):
+        if isinstance(out, BaseException):
+            route_errors[key] = str(out)
+        else:
+            route_data[key] = out
+    timer.mark("fetch")
+
+    results: List[Dict[str, Any]] = []
+    evaluated = _fan_out(groups, route_data, route_errors, evaluate, results)
+    timer.mark("evaluate")
+
+    triggered = [(a, res) for a, res in evaluated if res.get("triggered")]
+    written = await asyncio.gather(*(_persist(a, res) for a, res in triggered), return_exceptions=True)
+    signal_ids: Dict[int, Optional[str]] = {}
+    persist_errors: Dict[int, str] = {}
+    for (a, res), out in zip(triggered, written):
+        if isinstance(out, BaseException):
+            persist_errors[id(res)] = str(out)
+        else:
+            signal_ids[id(res)] = out
+    timer.mark("persist")
+
+    _collect(evaluated, signal_ids, persist_errors, results)
+    return results, _stats(alerts, groups, route_errors, workers, timer)
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional
+
+from .storage import transact
+
+# Topic computations for (location, sinceDays) as background jobs. Work runs in a bounded
+# process pool (spawned, optionally niced / pinned to TOPIC_JOB_CPUS) with its own Store and
+# Analyzer, so a large window never competes with /ingest and /alerts/check for the web
+# workers' GIL. Job state lives in communityTopicJobs; the job id hashes the location, the
+# window and the newest message for the location, so:
+#   - identical submissions while one is running share that job (in-process and across workers)
+#   - a finished job is the cached result until a new message arrives for the location, or
+#     until its expiresAt (TOPIC_JOB_TTL_S after it finished) passes; expired docs count as missing
+# The same pool runs the online topic model merges (merge()) and full refits (submit_fit(), a
+# job doc with kind "fit"), see app/topic_model.py.
+
+JOBS = "communityTopicJobs"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _utc(v: Any) -> Optional[datetime]:
+    if not isinstance(v, datetime):
+        return None
+    return v if v.tzinfo is not None else v.replace(tzinfo=timezone.utc)
+
+
+def _expired(doc: Optional[Dict[str, Any]], now: datetime) -> bool:
+    expires = _utc((doc or {}).get("expiresAt"))
+    return expires is not None and expires <= now
+
+
+def summarize(label_counts: Dict[str, int]) -> List[Dict[str, Any]]:
+    return sorted([{"label": k, "count": v} for k, v in label_counts.items()], key=lambda x: -x["count"])
+
+
+def count_topics(store: Any, analyzer: Any, location: str, since: datetime, chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """Topic label counts for a window; texts are paged from the store and transformed chunk_size at a time."""
+    size = chunk_size or int(os.getenv("TOPICS_CHUNK", "256"))
+    texts: Iterator[str] = store.iter_texts(location, since)
+    label_counts: Dict[str, int] = {}
+    count = 0
+    while True:
+        chunk = list(islice(texts, size))
+        if not chunk:
+            break
+        for r in analyzer.topics_batch(chunk):
+            for l in r.get("labels", []):
+                label_counts[l] = label_counts.get(l, 0) + 1
+        count += len(chunk)
+    return {"topics": summarize(label_counts), "count": count}
+
+
+# --- worker process side -------------------------------------------------------------------
+
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker() -> None:
+    try:
+        os.nice(int(_env_float("TOPIC_JOB_NICE", 10)))
+    except Exception:
+        pass
+    cpus = (os.getenv("TOPIC_JOB_CPUS") or "").strip()
+    if cpus:
+        try:
+            os.sched_setaffinity(0, {int(c) for c in cpus.split(",") if c.strip()})
+        except Exception:
+            pass
+
+
+def _worker() -> Dict[str, Any]:
+    # Built once per pool process; the topic model is loaded on first use and reused across jobs
+    if not _WORKER:
+        from .processing import Analyzer
+        from .store import Store
+
+        _WORKER["store"] = Store(project_id=os.getenv("FIRESTORE_PROJECT_ID"))
+        _WORKER["analyzer"] = Analyzer(lang=os.getenv("ANALYSIS_LANG", "en"))
+    return _WORKER
+
+
+def _run_job(location: str, since_days: int) -> Dict[str, Any]:
+    w = _worker()
+    model = w["analyzer"]._topic_model
+    if model is not None:
+        model.refresh()  # a merge may have published a newer model since the last job
+    t = time.perf_counter()
+    since = datetime.utcnow() - timedelta(days=since_days)
+    out = count_topics(w["store"], w["analyzer"], location, since)
+    out["computeMs"] = round((time.perf_counter() - t) * 1000.0, 1)
+    out["pid"] = os.getpid()
+    return out
+
+
+def _run_merge(texts: List[str]) -> Dict[str, Any]:
+    return _worker()["analyzer"].merge_topics(texts)
+
+
+def _run_fit(since_days: int) -> Dict[str, Any]:
+    w = _worker()
+    t = time.perf_counter()
+    since = datetime.utcnow() - timedelta(days=since_days)
+    out = w["analyzer"].fit_topics(w["store"].fetch_texts_since(since))
+    out["computeMs"] = round((time.perf_counter() - t) * 1000.0, 1)
+    out["pid"] = os.getpid()
+    return out
+
+
+# --- web process side ----------------------------------------------------------------------
+
+
+class TopicJobRunner:
+    def __init__(self, store: Any, workers: Optional[int] = None) -> None:
+        self.store = store
+        self.workers = max(1, int(workers if workers is not None else _env_float("TOPIC_JOB_WORKERS", 1)))
+        self.ttl_s = _env_float("TOPIC_JOB_TTL_S", 86400.0)
+        self.timeout_s = _env_float("TOPIC_JOB_TIMEOUT_S", 1800.0)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "deduped": 0, "cached": 0, "completed": 0, "failed": 0, "merges": 0, "mergesFailed": 0}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: the web process has live threads (write buffers, leaser) that must not be forked
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    @staticmethod
+    def job_id(location: str, since_days: int, newest: Optional[datetime]) -> str:
+        marker = _utc(newest).isoformat() if newest is not None else "-"
+        return hashlib.sha1(f"{location}|{int(since_days)}|{marker}".encode("utf-8")).hexdigest()[:20]
+
+    def _ref(self, job_id: str) -> Any:
+        return self.store.db.collection(JOBS).document(job_id)
+
+    def submit(self, location: str, since_days: int) -> Dict[str, Any]:
+        newest = self.store.latest_text_at(location)
+        job_id = self.job_id(location, since_days, newest)
+        with self._lock:
+            if job_id in self._inflight:
+                self._stats["deduped"] += 1
+                return {"jobId": job_id, "status": "running", "deduped": True}
+        now = datetime.now(timezone.utc)
+
+        def _claim(cur: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if _expired(cur, now):
+                cur = None
+            if cur and cur.get("status") == "done":
+                return None
+            started = _utc((cur or {}).get("startedAt"))
+            if cur and cur.get("status") == "running" and started and (now - started).total_seconds() < self.timeout_s:
+                return None  # another web worker is computing it
+            return {
+                "status": "running",
+                "location": location,
+                "sinceDays": int(since_days),
+                "newestMessageAt": newest,
+                "startedAt": now,
+                "expiresAt": now + timedelta(seconds=self.ttl_s),
+            }
+
+        ref = self._ref(job_id)
+        if transact(self.store.db, ref, _claim) is None:
+            job = self.get(job_id) or {"jobId": job_id, "status": "running"}
+            flag = "cached" if job.get("status") == "done" else "deduped"
+            with self._lock:
+                self._stats[flag] += 1
+            return {**job, flag: True}
+        fut = self._executor().submit(_run_job, location, int(since_days))
+        with self._lock:
+            self._inflight[job_id] = fut
+            self._stats["submitted"] += 1
+        fut.add_done_callback(lambda f: self._finish(job_id, ref, f))
+        return {"jobId": job_id, "status": "running"}
+
+    def _finish(self, job_id: str, ref: Any, fut: Future) -> None:
+        now = datetime.now(timezone.utc)
+        fields: Dict[str, Any] = {"finishedAt": now, "expiresAt": now + timedelta(seconds=self.ttl_s)}
+        try:
+            fields.update({"status": "done", "result": fut.result()})
+            key = "completed"
+        except Exception as e:
+            fields.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+            key = "failed"
+        try:
+            ref.set(fields, merge=True)
+        except Exception:
+            pass
+        with self._lock:
+            self._inflight.pop(job_id, None)
+            self._stats[key] += 1
+
+    def submit_fit(self, since_days: int) -> Dict[str, Any]:
+        """Full topic model refit on the pool; at most one per web process runs at a time."""
+        with self._lock:
+            for job_id in self._inflight:
+                if job_id.startswith("fit-"):
+                    self._stats["deduped"] += 1
+                    return {"jobId": job_id, "kind": "fit", "status": "running", "deduped": True}
+        now = datetime.now(timezone.utc)
+        job_id = "fit-" + hashlib.sha1(f"{int(since_days)}|{now.isoformat()}|{os.getpid()}".encode("utf-8")).hexdigest()[:16]
+        ref = self._ref(job_id)
+        ref.set({"status": "running", "kind": "fit", "sinceDays": int(since_days), "startedAt": now, "expiresAt": now + timedelta(seconds=self.ttl_s)})
+        fut = self._executor().submit(_run_fit, int(since_days))
+        with self._lock:
+            self._inflight[job_id] = fut
+            self._stats["submitted"] += 1
+        fut.add_done_callback(lambda f: self._finish(job_id, ref, f))
+        return {"jobId": job_id, "kind": "fit", "status": "running"}
+
+    def merge(self, texts: List[str]) -> Future:
+        """Online topic model update off the web process (Analyzer merge_runner)."""
+        fut = self._executor().submit(_run_merge, list(texts))
+        fut.add_done_callback(self._merge_done)
+        return fut
+
+    def _merge_done(self, fut: Future) -> None:
+        with self._lock:
+            self._stats["merges" if fut.exception() is None else "mergesFailed"] += 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        snap = self._ref(job_id).get()
+        if not snap.exists:
+            return None
+        doc = snap.to_dict() or {}
+        if _expired(doc, datetime.now(timezone.utc)):
+            return None
+        out = {"jobId": job_id, "kind": doc.get("kind", "topics"), "status": doc.get("status"), "location": doc.get("location"), "sinceDays": doc.get("sinceDays")}
+        for k in ("startedAt", "finishedAt"):
+            if doc.get(k) is not None:
+                out[k] = doc[k].isoformat()
+        if doc.get("status") == "done":
+            out["result"] = doc.get("result")
+        elif doc.get("status") == "error":
+            out["error"] = doc.get("error")
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "inflight": len(self._inflight), "workers": self.workers, "started": self._pool is not None}
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# BERTopic lifecycle: fit offline/periodically on a corpus, persist to disk, load at startup and
+# only call transform() on the request path. New messages are buffered and folded in with
+# BERTopic.merge_models so topic IDs of the base model stay stable between refits.
+#
+# Merges never run in the web process: observe() hands each full batch to `merge_runner` (the
+# topic job process pool, app/topic_jobs.py), where merge_now() takes a file lock next to the
+# model, folds the batch into the newest persisted model and publishes it. Every web worker
+# picks up a newly published model within TOPIC_RELOAD_S (loaded on a background thread).
+#
+# Publishing is atomic: the model is saved to a fresh `<path>.<stamp>` directory and `path` is a
+# symlink swapped to it with a rename, so a reader never sees a half-written model and
+# concurrent writers cannot interleave files. The previous directory is kept for readers that
+# are still loading it; older ones are removed.
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+def _publish(model: Any, path: str) -> str:
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    target = f"{path}.{time.time_ns()}-{os.getpid()}"
+    model.save(target, serialization="safetensors", save_ctfidf=True, save_embedding_model=EMBEDDING_MODEL)
+    prev = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A model saved before versioned directories: move it aside so the symlink can take its place
+        prev = f"{target}-legacy"
+        os.rename(path, prev)
+    link = f"{target}.link"
+    os.symlink(os.path.basename(target), link)
+    os.replace(link, path)
+    parent, name = os.path.split(path)
+    for entry in os.listdir(parent):
+        full = os.path.join(parent, entry)
+        if entry.startswith(name + ".") and full not in (target, prev) and os.path.isdir(full) and not os.path.islink(full):
+            shutil.rmtree(full, ignore_errors=True)
+    return target
+
+
+class _FileLock:
+    """Exclusive flock on `path`, serializing merges across processes; a no-op where fcntl is missing."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fh = None
+
+    def __enter__(self) -> "_FileLock":
+        try:
+            import fcntl
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._fh = open(self.path, "a")
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+        except Exception:
+            self._fh = None
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self._fh is not None:
+            self._fh.close()  # releases the flock
+
+
+class TopicModelManager:
+    def __init__(
+        self,
+        embedder: Any = None,
+        encoder: Any = None,
+        lang: str = "en",
+        path: Optional[str] = None,
+        min_fit_docs: int = 50,
+        update_batch: int = 200,
+        min_similarity: float = 0.7,
+        merge_runner: Optional[Callable[[List[str]], Future]] = None,
+    ) -> None:
+        self.embedder = embedder
+        # Anything with .encode(texts), e.g. a CachedEncoder over the same SentenceTransformer
+        self.encoder = encoder or embedder
+        self.lang = lang
+        self.path = path or os.getenv("TOPIC_MODEL_PATH", os.path.join(os.getcwd(), "models", "bertopic"))
+        self.min_fit_docs = min_fit_docs
+        self.update_batch = update_batch
+        self.min_similarity = min_similarity
+        # Runs merge_now(batch) in another process and returns its Future; without one, online updates are off
+        self.merge_runner = merge_runner
+        self.reload_s = float(os.getenv("TOPIC_RELOAD_S", "30"))
+        self._source: Optional[str] = None  # directory the live model was loaded from or saved to
+        self._next_check = 0.0
+        self._reloading = False
+        self._model = None
+        self._id2label: Dict[int, str] = {}
+        # Changes with every model swap (fit, load, merge); per-text result caches key on it
+        self.version: Optional[str] = None
+        self._lock = threading.Lock()  # guards model swaps
+        self._buffer: List[str] = []
+        self._buffer_lock = threading.Lock()
+        self._updating = False
+        self.info: Dict[str, Any] = {"fittedAt": None, "loadedFrom": None, "docs": 0, "updates": 0, "loadMs": None, "reloads": 0, "mergeErrors": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def _new_model(self):
+        from bertopic import BERTopic
+
+        return BERTopic(
+            language=self.lang if self.lang in ("en", "multilingual") else "multilingual",
+            embedding_model=self.embedder,
+            verbose=False,
+        )
+
+    @staticmethod
+    def _labels(model: Any) -> Dict[int, str]:
+        ids = sorted(model.get_topics().keys())
+        labels = model.generate_topic_labels(nr_words=3)
+        return {int(t): lab for t, lab in zip(ids, labels)}
+
+    def _swap(self, model: Any) -> None:
+        labels = self._labels(model)
+        # Derived from the topic set so the same persisted model gets the same version after a restart
+        version = hashlib.sha1(json.dumps(sorted(labels.items())).encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            self._model = model
+            self._id2label = labels
+            self.version = version
+
+    def _encode(self, texts: List[str]):
+        return self.encoder.encode(texts) if self.encoder is not None else None
+
+    # --- lifecycle -------------------------------------------------------------------------
+
+    def load(self) -> bool:
+        """Load a persisted model from `path`; returns False when none exists or loading fails."""
+        if not os.path.isdir(self.path):
+            return False
+        # Resolve the symlink once so a publish during loading cannot mix two versions
+        source = os.path.realpath(self.path)
+        t = time.perf_counter()
+        try:
+            from bertopic import BERTopic
+
+            model = BERTopic.load(source, embedding_model=self.embedder or EMBEDDING_MODEL)
+        except Exception:
+            return False
+        self._swap(model)
+        self._source = source
+        self.info.update({"loadedFrom": source, "loadMs": round((time.perf_counter() - t) * 1000.0, 1)})
+        return True
+
+    def changed(self) -> bool:
+        """True when a model newer than the live one has been published at `path`."""
+        return os.path.isdir(self.path) and os.path.realpath(self.path) != self._source
+
+    def refresh(self) -> bool:
+        """Load the published model if it changed since the last load/save."""
+        if not self.changed():
+            return False
+        if not self.load():
+            return False
+        self.info["reloads"] += 1
+        return True
+
+    def _maybe_reload(self) -> None:
+        """At most every reload_s, pick up a model published by another process on a background thread."""
+        now = time.monotonic()
+        with self._buffer_lock:
+            if self._reloading or now < self._next_check:
+                return
+            self._next_check = now + self.reload_s
+            if not self.changed():
+                return
+            self._reloading = True
+
+        def _run() -> None:
+            try:
+                self.refresh()
+            finally:
+                with self._buffer_lock:
+                    self._reloading = False
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def save(self) -> None:
+        with self._lock:
+            model = self._model
+        if model is None:
+            return
+        self._source = _publish(model, self.path)
+
+    def fit(self, texts: List[str], persist: bool = True) -> Dict[str, Any]:
+        """Full (re)fit on a corpus; meant for the CLI or a periodic job, never the request path."""
+        texts = [t for t in texts if t]
+        if len(texts) < self.min_fit_docs:
+            raise ValueError(f"need at least {self.min_fit_docs} documents to fit, got {len(texts)}")
+        model = self._new_model()
+        model.fit(texts, embeddings=self._encode(texts))
+        self._swap(model)
+        self.info.update({"fittedAt": time.time(), "docs": len(texts), "updates": 0})
+        if persist:
+            self.save()
+        return {"docs": len(texts), "topics": len(self._id2label)}
+
+    def refit(self, texts: List[str]) -> Dict[str, Any]:
+        """fit() and publish under the merge lock, so a concurrent merge cannot overwrite it (or vice versa)."""
+        with _FileLock(self.path + ".lock"):
+            return self.fit(texts)
+
+    # --- request path ----------------------------------------------------------------------
+
+    def transform(self, texts: List[str], embeddings: Any = None) -> List[Tuple[int, str]]:
+        with self._lock:
+            model, id2label = self._model, self._id2label
+        if model is None:
+            raise RuntimeError("topic model not fitted")
+        if embeddings is None:
+            embeddings = self._encode(texts)
+        topics, _ = model.transform(texts, embeddings=embeddings)
+        return [(int(t), id2label.get(int(t), "topic")) for t in topics]
+
+    # --- online updates --------------------------------------------------------------------
+
+    def observe(self, texts: List[str]) -> None:
+        """Buffer new messages; every `update_batch` of them are handed to merge_runner."""
+        self._maybe_reload()
+        if self.update_batch <= 0 or self.merge_runner is None:
+            return
+        with self._buffer_lock:
+            self._buffer.extend(t for t in texts if t)
+            if self._updating or len(self._buffer) < self.update_batch:
+                return
+            batch, self._buffer = self._buffer, []
+            self._updating = True
+        try:
+            fut = self.merge_runner(batch)
+        except Exception:
+            self._merged(None)
+            return
+        fut.add_done_callback(self._merged)
+
+    def _merged(self, fut: Optional[Future]) -> None:
+        try:
+            if fut is None or fut.exception() is not None:
+                self.info["mergeErrors"] += 1
+            elif fut.result().get("merged"):
+                self.info["updates"] += 1
+                self.refresh()
+        except Exception:
+            pass
+        finally:
+            with self._buffer_lock:
+                self._updating = False
+
+    def merge_now(self, batch: List[str]) -> Dict[str, Any]:
+        """Fold `batch` into the newest persisted model and publish it (runs in a topic job process)."""
+        batch = [t for t in batch if t]
+        with _FileLock(self.path + ".lock"):
+            self.refresh()
+            if self._model is None:
+                if len(batch) < self.min_fit_docs:
+                    return {"merged": False, "docs": 0, "topics": 0}
+                return {"merged": True, **self.fit(batch)}
+            from bertopic import BERTopic
+
+            fresh = self._new_model()
+            fresh.fit(batch, embeddings=self._encode(batch))
+            with self._lock:
+                base = self._model
+            merged = BERTopic.merge_models([base, fresh], min_similarity=self.min_similarity, embedding_model=self.embedder)
+            self._swap(merged)
+            self.info["updates"] += 1
+            self.info["docs"] += len(batch)
+            self.save()
+        return {"merged": True, "docs": self.info["docs"], "topics": len(self._id2label)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._buffer_lock:
+            buffered = len(self._buffer)
+        return {**self.info, "version": self.version, "ready": self.ready, "topics": len(self._id2label), "buffered": buffered, "path": self.path}
+
+
+def main() -> None:
+    """python -m app.topic_model --sinceDays 90 [--location LIM]: fit on recent messages and persist."""
+    import argparse
+    from datetime import datetime, timedelta
+
+    from .store import Store
+
+    ap = argparse.ArgumentParser(description="Fit and persist the BERTopic model")
+    ap.add_argument("--sinceDays", type=int, default=90)
+    ap.add_argument("--location", default=None)
+    args = ap.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    store = Store(project_id=os.getenv("FIRESTORE_PROJECT_ID"))
+    since = datetime.utcnow() - timedelta(days=args.sinceDays)
+    texts = store.fetch_texts(location=args.location, since=since) if args.location else store.fetch_texts_since(since)
+    mgr = TopicModelManager(embedder=SentenceTransformer(EMBEDDING_MODEL), lang=os.getenv("ANALYSIS_LANG", "en"))
+    print(mgr.refit(texts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .storage import already_exists
+
+# ("set" | "create" | "delete", document ref, data, merge). Refs are allocated client-side with
+# collection.document(), so callers get the document ID before the write is committed.
+# "create" fails when the document exists; see WriteBuffer._commit for why that matters.
+Write = Tuple[str, Any, Optional[Dict[str, Any]], bool]
+# Called with True once a group is committed, False once it is dropped
+OnDone = Callable[[bool], None]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _is_enabled() -> bool:
+    val = (os.getenv("WRITE_BUFFER_ENABLED") or "1").strip().lower()
+    return val in ("1", "true", "yes", "y", "on")
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer that groups Firestore writes into WriteBatch commits.
+
+    A background thread commits once `max_batch` writes are queued or the oldest one is
+    `max_age_ms` old; flush() drains synchronously (end of a sweep, shutdown). write() bypasses
+    the queue for single-request paths that return document IDs to the client. Writes enqueued
+    together always land in the same batch, so they stay atomic. When `max_pending` writes are
+    waiting, enqueue() blocks until a commit frees room. Failed commits are retried with
+    exponential backoff; after `retries` attempts the writes are dropped and counted.
+    With enabled=False every enqueue() is committed immediately (previous behaviour).
+
+    A commit can fail client-side (timeout) after it landed server-side, so a retry would apply
+    Increment writes twice. Groups that carry increments include a "create" of a fresh document:
+    if a retry fails with AlreadyExists the earlier attempt landed (batches are atomic) and the
+    commit counts as done instead of being applied again.
+    """
+
+    def __init__(
+        self,
+        db: Any,
+        max_batch: int = 400,
+        max_age_ms: float = 200.0,
+        max_pending: int = 5000,
+        retries: int = 3,
+        enabled: bool = True,
+    ) -> None:
+        self.db = db
+        self.max_batch = max(1, min(int(max_batch), 500))  # Firestore caps a batch at 500 writes
+        self.max_age_s = max_age_ms / 1000.0
+        self.max_pending = max(self.max_batch, int(max_pending))
+        self.retries = max(1, int(retries))
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._groups: List[Tuple[List[Write], Optional[OnDone]]] = []
+        self._pending = 0
+        self._oldest: Optional[float] = None
+        self._inflight = 0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Dict[str, Any] = {
+            "enqueued": 0, "writes": 0, "commits": 0, "retries": 0, "failedWrites": 0, "landedRetries": 0,
+            "backpressureWaits": 0, "lastCommitMs": None, "lastError": None,
+        }
+
+    # --- producers -------------------------------------------------------------------------
+
+    def set(self, ref: Any, data: Dict[str, Any], merge: bool = False) -> None:
+        self.enqueue([("set", ref, data, merge)])
+
+    def delete(self, ref: Any) -> None:
+        self.enqueue([("delete", ref, None, False)])
+
+    def enqueue(self, writes: List[Write], on_done: Optional[OnDone] = None) -> None:
+        """Queue `writes` as one atomic group; on_done(committed) is called from the committing thread."""
+        if not writes:
+            return
+        if not self.enabled or self._closed:
+            try:
+                self._commit(writes, raise_on_failure=True)
+            except Exception:
+                self._settle([on_done], False)
+                raise
+            self._settle([on_done], True)
+            return
+        with self._cond:
+            # Backpressure: wait for the flusher instead of growing without bound
+            while self._pending and self._pending + len(writes) > self.max_pending:
+                self._stats["backpressureWaits"] += 1
+                self._cond.notify_all()
+                self._cond.wait(timeout=1.0)
+            self._groups.append((list(writes), on_done))
+            self._pending += len(writes)
+            self._stats["enqueued"] += len(writes)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify_all()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="firestore-write-buffer", daemon=True)
+                self._thread.start()
+
+    def write(self, writes: List[Write]) -> None:
+        """Commit `writes` now in the calling thread as one batch; raises once the retries are exhausted."""
+        if writes:
+            self._commit(list(writes), raise_on_failure=True)
+
+    # --- commit ----------------------------------------------------------------------------
+
+    def _take(self) -> Tuple[List[Write], List[Optional[OnDone]]]:
+        """Pop whole groups up to max_batch writes (at least one group). Caller holds the lock."""
+        out: List[Write] = []
+        callbacks: List[Optional[OnDone]] = []
+        while self._groups and (not out or len(out) + len(self._groups[0][0]) <= self.max_batch):
+            writes, on_done = self._groups.pop(0)
+            out.extend(writes)
+            callbacks.append(on_done)
+        self._pending -= len(out)
+        self._oldest = time.monotonic() if self._groups else None
+        self._inflight += 1
+        return out, callbacks
+
+    @staticmethod
+    def _settle(callbacks: List[Optional[OnDone]], ok: bool) -> None:
+        for cb in callbacks:
+            if cb is not None:
+                try:
+                    cb(ok)
+                except Exception:
+                    pass
+
+    def _commit(self, writes: List[Write], raise_on_failure: bool = False) -> bool:
+        delay = 0.1
+        for attempt in range(self.retries):
+            t = time.perf_counter()
+            try:
+                batch = self.db.batch()
+                for op, ref, data, merge in writes:
+                    if op == "delete":
+                        batch.delete(ref)
+                    elif op == "create":
+                        batch.create(ref, data)
+                    else:
+                        batch.set(ref, data, merge=merge)
+                batch.commit()
+            except Exception as e:
+                if attempt > 0 and already_exists(e):
+                    # The previous attempt landed despite its error; do not apply the batch twice
+                    with self._cond:
+                        self._stats["landedRetries"] += 1
+                        self._stats["writes"] += len(writes)
+                        self._stats["commits"] += 1
+                    return True
+                with self._cond:
+                    self._stats["lastError"] = str(e)
+                    if attempt + 1 < self.retries:
+                        self._stats["retries"] += 1
+                if attempt + 1 >= self.retries:
+                    with self._cond:
+                        self._stats["failedWrites"] += len(writes)
+                    if raise_on_failure:
+                        raise
+                    return False
+                time.sleep(delay)
+                delay *= 2
+                continue
+            with self._cond:
+                self._stats["writes"] += len(writes)
+                self._stats["commits"] += 1
+                self._stats["lastCommitMs"] = round((time.perf_counter() - t) * 1000.0, 2)
+            return True
+        return False
+
+    def _done(self) -> None:
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending:
+                        age = time.monotonic() - (self._oldest or time.monotonic())
+                        if self._pending >= self.max_batch or age >= self.max_age_s:
+                            break
+                        self._cond.wait(timeout=self.max_age_s - age)
+                    else:
+                        self._cond.wait()
+                if not self._pending:
+                    self._thread = None
+                    return
+                writes, callbacks = self._take()
+            ok = False
+            try:
+                ok = self._commit(writes)
+            finally:
+                self._done()
+                self._settle(callbacks, ok)
+
+    def flush(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Commit everything queued so far in the calling thread and wait for in-flight commits."""
+        failed = 0
+        while True:
+            with self._cond:
+                if not self._pending:
+                    break
+                writes, callbacks = self._take()
+            ok = False
+            try:
+                ok = self._commit(writes)
+                if not ok:
+                    failed += len(writes)
+            finally:
+                self._done()
+                self._settle(callbacks, ok)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+        return {"failedWrites": failed}
+
+    def close(self, timeout: Optional[float] = 10.0) -> Dict[str, Any]:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return self.flush(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            out: Dict[str, Any] = dict(self._stats)
+            out["pending"] = self._pending
+            out["inflight"] = self._inflight
+        out.update({"enabled": self.enabled, "maxBatch": self.max_batch, "maxAgeMs": self.max_age_s * 1000.0, "maxPending": self.max_pending})
+        return out
+
+
+def build_write_buffer(db: Any) -> WriteBuffer:
+    """WRITE_BUFFER_ENABLED, WRITE_BUFFER_MAX_BATCH, WRITE_BUFFER_MAX_AGE_MS, WRITE_BUFFER_MAX_PENDING, WRITE_BUFFER_RETRIES."""
+    return WriteBuffer(
+        db,
+        max_batch=int(_env_float("WRITE_BUFFER_MAX_BATCH", 400)),
+        max_age_ms=_env_float("WRITE_BUFFER_MAX_AGE_MS", 200.0),
+        max_pending=int(_env_float("WRITE_BUFFER_MAX_PENDING", 5000)),
+        retries=int(_env_float("WRITE_BUFFER_RETRIES", 3)),
+        enabled=_is_enabled(),
+    )
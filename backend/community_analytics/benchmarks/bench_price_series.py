@@ -0,0 +1,67 @@
+"""
+Compares predict_should_buy on a list of {"ts", "price"} dicts against a PriceSeries.
+
+Run from backend/community_analytics:
+    python -m benchmarks.bench_price_series --points 10000 --repeat 200
+"""
+import argparse
+import json
+import random
+import time
+
+from app.price_predictor import PriceSeries, predict_should_buy
+
+
+def _history(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    t0 = time.time() - n * 3600
+    return [{"ts": t0 + i * 3600, "price": 400.0 + rng.gauss(0, 25) - i * 0.01} for i in range(n)]
+
+
+def _per_call_us(fn, repeat: int) -> float:
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--points", type=int, default=10000)
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    history = _history(args.points)
+    series = PriceSeries.from_history(history)
+    a = predict_should_buy(history, 350.0, 72.0)
+    b = predict_should_buy(series, 350.0, 72.0)
+    same = a["recommendation"] == b["recommendation"] and abs(a["slope"] - b["slope"]) <= 1e-6 * max(1.0, abs(a["slope"]))
+
+    dict_us = _per_call_us(lambda: predict_should_buy(history, 350.0, 72.0), args.repeat)
+    series_us = _per_call_us(lambda: predict_should_buy(series, 350.0, 72.0), args.repeat)
+
+    # Sliding-window update: one append + one expiry, then a prediction
+    state = {"i": args.points}
+
+    def _slide() -> None:
+        i = state["i"]
+        series.append(history[0]["ts"] + i * 3600, 400.0)
+        series.popleft()
+        predict_should_buy(series, 350.0, 72.0)
+        state["i"] = i + 1
+
+    slide_us = _per_call_us(_slide, args.repeat)
+    print(json.dumps({
+        "benchmark": "price_series",
+        "points": args.points,
+        "repeat": args.repeat,
+        "dictListUs": round(dict_us, 2),
+        "priceSeriesUs": round(series_us, 2),
+        "slideAndPredictUs": round(slide_us, 2),
+        "speedup": round(dict_us / series_us, 1) if series_us else None,
+        "resultsMatch": same,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compares Analyzer sentiment backends (SENTIMENT_BACKEND=hf|torch_int8|onnx) on a fixed local corpus.
+
+Each backend runs in its own subprocess so RSS numbers are not polluted by the others.
+Reports throughput (batched), p50/p99 single-text latency, RSS after load, and label
+agreement with the fp32 "hf" pipeline.
+
+Run from backend/community_analytics:
+    python -m benchmarks.bench_sentiment --backends hf,torch_int8,onnx --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "sentiment_corpus.txt")
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    import resource
+
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def _pct(values, q: float) -> float:
+    vals = sorted(values)
+    if not vals:
+        return 0.0
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+def _worker(backend: str, repeat: int, batch: int) -> dict:
+    from app.sentiment_backends import load_sentiment_backend, normalize
+
+    texts = [t.strip() for t in open(CORPUS, encoding="utf-8") if t.strip()]
+    rss0 = _rss_mb()
+    t = time.perf_counter()
+    loaded = load_sentiment_backend("en", backend=backend)
+    load_ms = (time.perf_counter() - t) * 1000.0
+    pipe = loaded["pipe"]
+    pipe(texts[:4])  # warm-up
+
+    single = []
+    for _ in range(repeat):
+        for text in texts:
+            t = time.perf_counter()
+            pipe([text])
+            single.append((time.perf_counter() - t) * 1000.0)
+
+    t = time.perf_counter()
+    for _ in range(repeat):
+        labels = normalize(pipe(texts, batch_size=batch))
+    batched_s = time.perf_counter() - t
+    return {
+        "backend": loaded["backend"],
+        "requested": backend,
+        "fallback": loaded["fallback"],
+        "loadMs": round(load_ms, 1),
+        "rssMb": _rss_mb(),
+        "rssDeltaMb": round(_rss_mb() - rss0, 1),
+        "p50Ms": round(_pct(single, 0.50), 2),
+        "p99Ms": round(_pct(single, 0.99), 2),
+        "throughputPerS": round(len(texts) * repeat / batched_s, 1),
+        "labels": [x["label"] for x in labels],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="hf,torch_int8,onnx")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(_worker(args.worker, args.repeat, args.batch)))
+        return
+
+    results = {}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        cmd = [sys.executable, "-m", "benchmarks.bench_sentiment", "--worker", backend, "--repeat", str(args.repeat), "--batch", str(args.batch)]
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            results[backend] = {"error": out.stderr.strip().splitlines()[-1:] or ["failed"]}
+            continue
+        results[backend] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    baseline = (results.get("hf") or {}).get("labels")
+    for r in results.values():
+        labels = r.pop("labels", None)
+        if baseline and labels:
+            r["labelAgreement"] = round(sum(a == b for a, b in zip(labels, baseline)) / len(baseline), 4)
+    print(json.dumps({"benchmark": "sentiment_backends", "corpus": os.path.basename(CORPUS), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
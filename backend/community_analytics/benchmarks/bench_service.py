@@ -0,0 +1,366 @@
+"""
+Offline benchmark of the service hot paths, emitted as JSON for commit-to-commit comparison.
+
+Everything runs locally: SIMULATE_FLIGHTS=1 for offers, the embedded SQLite store
+(STORAGE_BACKEND=local, fresh temp file per scenario) instead of Firestore, and the heuristic
+Analyzer (ANALYZER_HEURISTIC=1; pass --models to use whatever local models are installed).
+Each scenario runs in its own subprocess so caches and RSS do not leak between them.
+
+Scenarios:
+    run_checks:<n>  POST /alerts/run_checks over n active alerts (default 1k, 10k, 100k)
+    ingest          POST /ingest requests/s and per-request latency
+    read            GET /analysis (rollups and ndjson scan) and /topics latency over a synthetic corpus
+    predict         predict_should_buy per-call cost (dict history, PriceSeries, batch)
+
+Run from backend/community_analytics:
+    python -m benchmarks.bench_service --out bench.json
+    python -m benchmarks.bench_service --alerts 1000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+AIRPORTS = ["LIM", "MIA", "JFK", "MAD", "BOG", "SCL", "MEX", "LAX", "GRU", "CUZ", "EZE", "SFO", "ORD", "CDG", "LHR"]
+LOCATIONS = ["lima", "cusco", "arequipa", "bogota", "madrid"]
+WORDS = (
+    "hotel beach museum market street food tour guide bus taxi airport hostel ceviche mountains river "
+    "weather night price crowd sunset trek ruins plaza coffee train"
+).split()
+MOODS = ["amazing", "great", "awesome", "love", "bad", "terrible", "hate", "awful", "okay", "fine"]
+
+
+def _pct(values, q: float) -> float:
+    vals = sorted(values)
+    if not vals:
+        return 0.0
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+def _latency(samples_ms) -> dict:
+    return {
+        "n": len(samples_ms),
+        "p50Ms": round(_pct(samples_ms, 0.50), 3),
+        "p99Ms": round(_pct(samples_ms, 0.99), 3),
+        "meanMs": round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0.0,
+    }
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    import resource
+
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def _text(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))) + " " + rng.choice(MOODS)
+
+
+def _routes(n: int, rng: random.Random):
+    pairs = [(o, d) for o in AIRPORTS for d in AIRPORTS if o != d]
+    rng.shuffle(pairs)
+    return pairs[: max(1, min(n, len(pairs)))]
+
+
+def _app(args):
+    """Imports the app only after the offline environment is in place."""
+    os.environ["SIMULATE_FLIGHTS"] = "1"
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["LOCAL_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_service_"), "bench.sqlite")
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    if not args.models:
+        os.environ["ANALYZER_HEURISTIC"] = "1"
+    from fastapi.testclient import TestClient
+
+    from app import main
+
+    return main, TestClient(main.app)
+
+
+def _seed_alerts(main, n: int, routes, rng: random.Random, history_points: int) -> None:
+    from datetime import datetime, timedelta, timezone
+
+    db = main.flight_store.db
+    batch, pending = db.batch(), 0
+
+    def _put(collection: str, data: dict) -> None:
+        nonlocal batch, pending
+        batch.set(db.collection(collection).document(), data)
+        pending += 1
+        if pending >= 500:
+            batch.commit()
+            batch, pending = db.batch(), 0
+
+    now = datetime.now(timezone.utc)
+    for origin, destination in routes:
+        base = rng.uniform(250.0, 900.0)
+        for i in range(history_points):
+            _put("flightMonitorEvents", {
+                "origin": origin,
+                "destination": destination,
+                "observedPrice": round(base + rng.gauss(0, 25) - i * 0.5, 2),
+                "createdAt": now - timedelta(hours=history_points - i),
+            })
+    for i in range(n):
+        origin, destination = routes[i % len(routes)]
+        _put("flightAlertsBackend", {
+            "uid": f"bench-{i % 997}",
+            "origin": origin,
+            "destination": destination,
+            "budget": round(rng.uniform(200.0, 1000.0), 2),
+            "departureDate": None,
+            "maxWaitHours": 168,
+            "status": "active",
+            "createdAt": now,
+        })
+    batch.commit()
+
+
+def _run_checks(args, n: int) -> dict:
+    main, client = _app(args)
+    rng = random.Random(args.seed)
+    routes = _routes(args.routes, rng)
+    t = time.perf_counter()
+    _seed_alerts(main, n, routes, rng, args.history_points)
+    seed_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    r = client.post("/alerts/run_checks")
+    wall_s = time.perf_counter() - t
+    body = r.json()
+    stats = body.get("stats") or {}
+    return {
+        "alerts": n,
+        "routes": len(routes),
+        "status": r.status_code,
+        "checked": body.get("count"),
+        "seedS": round(seed_s, 2),
+        "wallMs": round(wall_s * 1000.0, 1),
+        "alertsPerS": round(n / wall_s, 1) if wall_s > 0 else None,
+        "timingsMs": stats.get("timingsMs"),
+        "rssMb": _rss_mb(),
+    }
+
+
+def _ingest(args) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+
+    main, client = _app(args)
+    rng = random.Random(args.seed)
+    payloads = [{"location": rng.choice(LOCATIONS), "text": _text(rng), "uid": f"u{i % 50}"} for i in range(args.ingest)]
+    client.post("/ingest", json=payloads[0])  # warm-up (lazy Analyzer load)
+
+    samples = []
+
+    def _one(p) -> None:
+        t = time.perf_counter()
+        client.post("/ingest", json=p)
+        samples.append((time.perf_counter() - t) * 1000.0)
+
+    t = time.perf_counter()
+    for p in payloads:
+        _one(p)
+    serial_s = time.perf_counter() - t
+    serial = _latency(samples)
+
+    samples = []
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(_one, payloads))
+    concurrent_s = time.perf_counter() - t
+    main.store.writes.flush()
+    return {
+        "requests": len(payloads),
+        "analyzerBackend": main.analyzer.sentiment_backend,
+        "serial": {"reqPerS": round(len(payloads) / serial_s, 1), **serial},
+        "concurrent": {"workers": args.concurrency, "reqPerS": round(len(payloads) / concurrent_s, 1), **_latency(samples)},
+        "writes": main.store.writes.stats(),
+    }
+
+
+def _read(args) -> dict:
+    from datetime import datetime, timezone
+
+    main, client = _app(args)
+    rng = random.Random(args.seed)
+    db = main.store.db
+    batch = db.batch()
+    for i in range(args.corpus):
+        text = _text(rng)
+        location = "lima" if i % 2 == 0 else rng.choice(LOCATIONS)
+        # communityMessages are written by the app clients; /topics reads them
+        batch.set(db.collection("communityMessages").document(), {"location": location, "text": text, "createdAt": datetime.now(timezone.utc)})
+        if i % 500 == 499:
+            batch.commit()
+            batch = db.batch()
+        main.store.save_analysis({
+            "location": location,
+            "text": text,
+            "sentiment": main.analyzer.sentiment(text)["label"],
+            "sentimentScore": 0.5,
+            "topics": rng.sample(WORDS, 2),
+        })
+    batch.commit()
+    main.store.writes.flush()
+    # Records the rollups coverage marker so /analysis reads buckets rather than the raw scan
+    main.store.rebuild_rollups(7)
+
+    out = {"corpus": args.corpus}
+    cases = {
+        "analysis": "/analysis?location=lima&sinceDays=7",
+        "analysisNdjson": "/analysis?location=lima&sinceDays=7&format=ndjson",
+        "topics": "/topics?location=lima&sinceDays=30",
+    }
+    for name, url in cases.items():
+        client.get(url)  # warm-up
+        samples = []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            r = client.get(url)
+            _ = r.content
+            samples.append((time.perf_counter() - t) * 1000.0)
+        out[name] = {"status": r.status_code, "bytes": len(r.content), **_latency(samples)}
+    return out
+
+
+def _predict(args) -> dict:
+    import numpy as np
+
+    from app.price_predictor import PriceSeries, predict_should_buy, predict_should_buy_batch
+
+    rng = random.Random(args.seed)
+    t0 = time.time() - args.history_points * 3600
+    history = [{"ts": t0 + i * 3600, "price": 400.0 + rng.gauss(0, 25) - i * 0.05} for i in range(args.history_points)]
+    series = PriceSeries.from_history(history)
+
+    def _per_call_us(fn, repeat: int) -> float:
+        t = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return round((time.perf_counter() - t) / repeat * 1e6, 3)
+
+    repeat = args.repeat * 100
+    routes = [PriceSeries.from_history(history[: rng.randint(2, len(history))]) for _ in range(50)]
+    alerts = [routes[i % len(routes)] for i in range(1000)]
+    budgets = np.array([rng.uniform(200.0, 600.0) for _ in alerts])
+    t = time.perf_counter()
+    for _ in range(args.repeat):
+        predict_should_buy_batch(alerts, budgets, 72.0)
+    batch_us = (time.perf_counter() - t) / (args.repeat * len(alerts)) * 1e6
+    return {
+        "historyPoints": args.history_points,
+        "dictHistoryUs": _per_call_us(lambda: predict_should_buy(history, 350.0, 72.0), repeat),
+        "priceSeriesUs": _per_call_us(lambda: predict_should_buy(series, 350.0, 72.0), repeat),
+        "batchPerAlertUs": round(batch_us, 3),
+        "batchAlerts": len(alerts),
+    }
+
+
+def _worker(args) -> dict:
+    name = args.worker
+    if name.startswith("run_checks:"):
+        return _run_checks(args, int(name.split(":", 1)[1]))
+    return {"ingest": _ingest, "read": _read, "predict": _predict}[name](args)
+
+
+def _flatten(d, prefix: str = ""):
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            yield from _flatten(v, key)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield key, float(v)
+
+
+def _compare(results: dict, baseline_path: str) -> dict:
+    """Ratio current/baseline for the headline numbers (latency: >1 is slower; throughput: <1 is slower)."""
+    with open(baseline_path, encoding="utf-8") as f:
+        base = dict(_flatten(json.load(f).get("results") or {}))
+    tracked = ("alertsPerS", "reqPerS", "p50Ms", "p99Ms", "wallMs", "Us")
+    out = {}
+    for key, value in _flatten(results):
+        if key.endswith(tracked) and base.get(key):
+            out[key] = round(value / base[key], 3)
+    return out
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Offline benchmark of the community analytics hot paths")
+    ap.add_argument("--scenarios", default="run_checks,ingest,read,predict")
+    ap.add_argument("--alerts", default="1000,10000,100000", help="alert counts for run_checks")
+    ap.add_argument("--routes", type=int, default=200, help="unique routes the alerts are spread over")
+    ap.add_argument("--history-points", type=int, default=48, help="hourly price points per route")
+    ap.add_argument("--ingest", type=int, default=500, help="/ingest requests")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--corpus", type=int, default=5000, help="analysis docs seeded for the read scenario")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--models", action="store_true", help="use installed local models instead of the heuristic Analyzer")
+    ap.add_argument("--out", default=None, help="also write the JSON report to this path")
+    ap.add_argument("--compare", default=None, help="baseline JSON report to compute ratios against")
+    ap.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(_worker(args), default=str))
+        return
+
+    scenarios = []
+    for s in [x.strip() for x in args.scenarios.split(",") if x.strip()]:
+        if s == "run_checks":
+            scenarios += [f"run_checks:{int(n)}" for n in args.alerts.split(",") if n.strip()]
+        else:
+            scenarios.append(s)
+
+    passthrough = [
+        "--routes", str(args.routes), "--history-points", str(args.history_points), "--ingest", str(args.ingest),
+        "--concurrency", str(args.concurrency), "--corpus", str(args.corpus), "--repeat", str(args.repeat),
+        "--seed", str(args.seed),
+    ] + (["--models"] if args.models else [])
+    results = {}
+    for s in scenarios:
+        cmd = [sys.executable, "-m", "benchmarks.bench_service", "--worker", s] + passthrough
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            results[s] = {"error": out.stderr.strip().splitlines()[-1:] or ["failed"]}
+            continue
+        results[s] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    report = {
+        "benchmark": "service",
+        "commit": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("worker", "out", "compare")},
+        "results": results,
+    }
+    if args.compare:
+        report["vsBaseline"] = _compare(results, args.compare)
+    text = json.dumps(report, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()